@@ -0,0 +1,294 @@
+"""Analysis records of app-anal.py and their text, JSON and HTML renderings.
+
+While a question is analysed, app-anal.py appends one record per step to
+the question's analysis records (see storage): a `header` record with the
+question and its target data, one `verdict` record per judged answer, as
+soon as the judge responded, and an `end` record once every answer was
+judged successfully. The report ./analysis/<question>.txt is rendered again from the
+records after each verdict, so a crash only loses the verdict in flight,
+and an interrupted analysis is resumed from its records: the answers
+already judged are not sent to the judge again.
+
+The JSON and HTML renderings (./analysis/<question>.json and .html) are
+made from the same records.
+"""
+import os
+import json
+import html
+import hashlib
+import datetime
+import tempfile
+import results_store
+
+RENDERINGS_FOLDER = './analysis'
+
+def convert_unix_timestamp_to_human_readable(unix_timestamp):
+    createdDateTime = datetime.datetime.fromtimestamp(unix_timestamp)
+    year = createdDateTime.year
+    month = createdDateTime.month
+    day = createdDateTime.day
+    hour = createdDateTime.hour
+    minute = createdDateTime.minute
+    second = createdDateTime.second
+
+    return f"{year}-{(month < 10 and '0' or '')}{month}-{(day < 10 and '0' or '')}{day} {(hour < 10 and '0' or '')}{hour}:{(minute < 10 and '0' or '')}{minute}:{(second < 10 and '0' or '')}{second}"
+
+def text_hash(*parts):
+    """Hash of the texts a record depends on."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def header_record(question_name, question, target_answer, infos_cruciales, infos_a_eviter, analysis_model, prompt_template):
+    """The first record of an analysis; its key changes with anything that invalidates the verdicts."""
+    return {
+        'type': 'header',
+        'key': text_hash(question, target_answer, infos_cruciales, infos_a_eviter, analysis_model, prompt_template),
+        'question_name': question_name,
+        'question': question,
+        'target_answer': target_answer,
+        'infos_cruciales': infos_cruciales,
+        'infos_a_eviter': infos_a_eviter,
+        'analysis_model': analysis_model,
+    }
+
+def verdict_key(model, sample=None):
+    """Identify an answer among those to a question: the model, and the sample of a multi-sample answer."""
+    return model if sample is None else f"{model}#{sample + 1}"
+
+def verdict_label(verdict):
+    """The model of a verdict, as shown in the reports."""
+    if verdict.get('sample') is None:
+        return verdict['model']
+    return f"{verdict['model']} (échantillon {verdict['sample'] + 1})"
+
+def verdict_record(model, answer_text, answer_date, analysis, failed=False, prescore=None, local=False, sample=None):
+    """A judged answer; `prescore` holds its local scores and `local` tells it was graded from them only."""
+    return {
+        'type': 'verdict',
+        'model': model,
+        'sample': sample,
+        'answer_text': answer_text,
+        'answer_hash': text_hash(answer_text),
+        'answer_date': answer_date,
+        'analysis': analysis,
+        'failed': failed,
+        'prescore': prescore,
+        'local': local,
+    }
+
+def end_record():
+    return {'type': 'end'}
+
+def resumable_verdicts(records, header):
+    """Return the verdicts of an interrupted analysis that can be reused, by verdict_key.
+
+    Nothing is reused when the previous analysis completed (a new run starts
+    over) or was made for other question data, judge or prompt. Failed judge
+    requests are not reused, so that they are tried again, nor local grades,
+    which are cheap to make again with the current settings.
+    """
+    if not records or records[0].get('type') != 'header' or records[0].get('key') != header['key']:
+        return {}
+    if any(record.get('type') == 'end' for record in records):
+        return {}
+    return {verdict_key(record['model'], record.get('sample')): record for record in records
+            if record.get('type') == 'verdict' and not record.get('failed') and not record.get('local')}
+
+def split_records(records):
+    """Return (header, verdicts, complete) from the records of an analysis."""
+    header = records[0] if records and records[0].get('type') == 'header' else None
+    verdicts = [record for record in records if record.get('type') == 'verdict']
+    complete = any(record.get('type') == 'end' for record in records)
+    return header, verdicts, complete
+
+def describe_prescore(prescore):
+    """One line with the local scores of an answer (see prescore)."""
+    coverage = '-' if prescore['coverage'] is None else f"{prescore['coverage']:.0%}"
+    line = (f"Pré-évaluation locale: couverture {coverage}, informations à éviter {prescore['forbidden_hits']}, "
+            f"similarité {prescore['similarity']:.2f}, {prescore['tokens']} mots")
+    if prescore['truncated']:
+        line += ", réponse tronquée"
+    return line
+
+def render_text(records):
+    """Render the text report of an analysis."""
+    header, verdicts, _ = split_records(records)
+    if header is None:
+        return ""
+    base_name = header['question_name']
+
+    #report = "(c) 2025 Lavery De Billy S.E.N.C.R.L.\n"
+    report = ""
+    report += f"*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*\n"
+    report += f"Analyse pour {base_name}\n"
+    report += f"Question:\n"
+    report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
+    report += f"\n{header['question']}\n"
+    report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
+    report += f"Réponse attendue pour {base_name}\n"
+    report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
+    report += f"{header['target_answer']}\n"
+    report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
+    report += f"Informations cruciales attendues pour {base_name}:\n"
+    report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
+    report += f"{header['infos_cruciales']}\n"
+    report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
+    report += f"Informations à éviter pour {base_name}:\n"
+    report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
+    report += f"{header['infos_a_eviter']}\n"
+    report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
+    report += f"--------------------------------------------------------\n"
+
+    for verdict in verdicts:
+        model = verdict_label(verdict)
+        report += f"Réponse du modèle {model} pour {base_name}:\n"
+        if verdict['answer_date']: report += f"Date de la réponse: {convert_unix_timestamp_to_human_readable(verdict['answer_date'])}\n"
+        report += f"|-_-|---|-¯-|---|-_-|---|-¯-|---|-_-|---|-¯-|---|-_-|\n\n"
+        report += f"{verdict['answer_text']}\n"
+        report += f"|-_-|---|-¯-|---|-_-|---|-¯-|---|-_-|---|-¯-|---|-_-|\n\n"
+        if verdict.get('prescore'): report += f"{describe_prescore(verdict['prescore'])}\n"
+        report += f"Analyse de la réponse du modèle {model} pour {base_name}:\n"
+        report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
+        report += f"{verdict['analysis']}\n"
+        report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
+        report += f"*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*\n\n"
+
+    #report += "(c) 2025 Lavery De Billy S.E.N.C.R.L."
+    return report
+
+def render_json(records):
+    """Render an analysis as a JSON document, with the parsed scores."""
+    header, verdicts, complete = split_records(records)
+    if header is None:
+        return None
+    document = {
+        'question_name': header['question_name'],
+        'question': header['question'],
+        'reponse_cible': header['target_answer'],
+        'infos_cruciales': header['infos_cruciales'],
+        'infos_a_eviter': header['infos_a_eviter'],
+        'analysis_model': header['analysis_model'],
+        'complete': complete,
+        'answers': [{
+            'model': verdict['model'],
+            'sample': verdict.get('sample'),
+            'date': verdict['answer_date'],
+            'answer': verdict['answer_text'],
+            'analysis': verdict['analysis'],
+            'scores': results_store.parse_scores(verdict['analysis']),
+            'prescore': verdict.get('prescore'),
+            'local': verdict.get('local', False),
+        } for verdict in verdicts],
+    }
+    return json.dumps(document, ensure_ascii=False, indent=2)
+
+HTML_PAGE = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+    <meta charset="UTF-8">
+    <title>Analyse pour {name}</title>
+    <style>
+        body {{
+            font-family: Arial, sans-serif;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+            background-color: #f4f4f9;
+        }}
+        pre {{
+            background-color: #f9f9f9;
+            border: 1px solid #ddd;
+            padding: 10px;
+            white-space: pre-wrap;
+        }}
+        table {{
+            border-collapse: collapse;
+        }}
+        th, td {{
+            border: 1px solid #ddd;
+            padding: 4px 8px;
+        }}
+    </style>
+</head>
+<body>
+    <h1>Analyse pour {name}</h1>
+{status}    <h2>Question</h2>
+    <pre>{question}</pre>
+    <h2>Réponse attendue</h2>
+    <pre>{target_answer}</pre>
+    <h2>Informations cruciales attendues</h2>
+    <pre>{infos_cruciales}</pre>
+    <h2>Informations à éviter</h2>
+    <pre>{infos_a_eviter}</pre>
+    <h2>Notes (évaluées par {analysis_model})</h2>
+    <table>
+        <tr><th>Modèle</th><th>Note globale</th><th>Couverture des informations cruciales</th><th>Informations à éviter présentes</th></tr>
+{score_rows}    </table>
+{sections}</body>
+</html>
+"""
+
+def render_html(records):
+    """Render an analysis as a standalone HTML page."""
+    header, verdicts, complete = split_records(records)
+    if header is None:
+        return None
+    escape = html.escape
+    score_rows = ""
+    sections = ""
+    for verdict in verdicts:
+        model = escape(verdict_label(verdict))
+        scores = results_store.parse_scores(verdict['analysis'])
+        if scores:
+            forbidden = 'oui' if scores['infos_a_eviter_presentes'] else 'non'
+            score_rows += f"        <tr><td>{model}</td><td>{scores['note_globale']:g}/10</td><td>{scores['couverture_infos_cruciales']:g}/10</td><td>{forbidden}</td></tr>\n"
+        else:
+            score_rows += f"        <tr><td>{model}</td><td colspan=\"3\">Notes absentes</td></tr>\n"
+        date = ""
+        if verdict['answer_date']:
+            date = f"    <p>Date de la réponse: {convert_unix_timestamp_to_human_readable(verdict['answer_date'])}</p>\n"
+        if verdict.get('prescore'):
+            date += f"    <p>{escape(describe_prescore(verdict['prescore']))}</p>\n"
+        sections += (
+            f"    <h2>Réponse du modèle {model}</h2>\n{date}"
+            f"    <pre>{escape(verdict['answer_text'])}</pre>\n"
+            f"    <h3>Analyse</h3>\n"
+            f"    <pre>{escape(verdict['analysis'] or '')}</pre>\n"
+        )
+    status = "" if complete else "    <p><strong>Analyse incomplète.</strong></p>\n"
+    return HTML_PAGE.format(
+        name=escape(header['question_name']),
+        status=status,
+        question=escape(header['question']),
+        target_answer=escape(header['target_answer'] or ''),
+        infos_cruciales=escape(header['infos_cruciales'] or ''),
+        infos_a_eviter=escape(header['infos_a_eviter'] or ''),
+        analysis_model=escape(header['analysis_model']),
+        score_rows=score_rows,
+        sections=sections,
+    )
+
+def _write(path, content):
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+def write_renderings(question_name, records, folder=RENDERINGS_FOLDER):
+    """Write the JSON and HTML renderings of an analysis; returns their paths."""
+    paths = []
+    for extension, render in (('json', render_json), ('html', render_html)):
+        content = render(records)
+        if content is not None:
+            path = os.path.join(folder, f"{question_name}.{extension}")
+            _write(path, content)
+            paths.append(path)
+    return paths
+
+def delete_renderings(question_name, folder=RENDERINGS_FOLDER):
+    """Delete the JSON and HTML renderings of an analysis."""
+    for extension in ('json', 'html'):
+        path = os.path.join(folder, f"{question_name}.{extension}")
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,412 @@
+"""Storage of the model answers in ./answers.
+
+The answers to a question are kept in `<q>.a`, a JSON object mapping each
+model (or manual source) to its response. New answers are not merged into
+that file one by one: they are appended as single JSON lines to the log
+`<q>.a.log`, and `compact` later folds the log into `<q>.a` with one atomic
+write. `load_answers` always returns the snapshot with the log applied, so
+readers do not need to care whether a question has been compacted.
+
+Every write (append, compaction, replacement, deletion) holds the lock of
+the question, a `<q>.a.lock` file created with O_EXCL, so several processes
+(compare runs, the Flask manual entry page, a merge of shards) can write
+the answers of the same question without losing each other's answers. A
+lock left by a process that died is taken over once it is older than
+LOCK_STALE_SECONDS, or at once when its process is known to be gone.
+Readers take no lock: they read again when the question was compacted
+while they were reading.
+
+Run `python answer_store.py` to compact every question on demand, and
+`python answer_store.py --recover` to repair the files left by a crash
+(truncated answers files, cut log lines, temporary files and locks).
+"""
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import tempfile
+from contextlib import contextmanager
+
+ANSWERS_FOLDER = './answers'
+LOG_SUFFIX = '.log'
+LOCK_SUFFIX = '.lock'
+DAMAGED_SUFFIX = '.damaged'
+# A lock is held for one write, a few seconds at most for a large compaction
+LOCK_STALE_SECONDS = 120
+LOCK_TIMEOUT = 300
+LOCK_POLL_SECONDS = 0.02
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _lock_for(question_name):
+    with _locks_guard:
+        if question_name not in _locks:
+            _locks[question_name] = threading.Lock()
+        return _locks[question_name]
+
+def answer_path(question_name):
+    return os.path.join(ANSWERS_FOLDER, f"{question_name}.a")
+
+def log_path(question_name):
+    return answer_path(question_name) + LOG_SUFFIX
+
+def lock_path(question_name):
+    return answer_path(question_name) + LOCK_SUFFIX
+
+def _lock_owner(path):
+    """The content of a lock file, or None when it is gone or unreadable."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _owner_is_gone(owner):
+    """Tell whether the process holding a lock is known to have died (same host only)."""
+    if os.name != 'posix' or not owner or owner.get('host') != socket.gethostname():
+        return False
+    try:
+        os.kill(owner['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, KeyError, TypeError):
+        return False
+    return False
+
+def _is_stale(path):
+    try:
+        age = time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+    return age >= LOCK_STALE_SECONDS or _owner_is_gone(_lock_owner(path))
+
+def _break_stale_lock(path):
+    """Remove a stale lock; only the process whose rename succeeds does it."""
+    stale_path = f"{path}.stale-{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+    try:
+        os.rename(path, stale_path)
+    except FileNotFoundError:
+        return
+    if not _is_stale(stale_path):
+        # Another process took the lock in the meantime: give it back
+        os.rename(stale_path, path)
+        return
+    os.remove(stale_path)
+
+@contextmanager
+def question_lock(question_name, timeout=LOCK_TIMEOUT):
+    """Hold the lock of a question, across threads and processes."""
+    os.makedirs(ANSWERS_FOLDER, exist_ok=True)
+    path = lock_path(question_name)
+    owner = json.dumps({'host': socket.gethostname(), 'pid': os.getpid(), 'locked_at': time.time()})
+    with _lock_for(question_name):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if _is_stale(path):
+                    _break_stale_lock(path)
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Answers of '{question_name}' locked by {_lock_owner(path)}; "
+                                       f"if no process is writing them, run python answer_store.py --recover")
+                time.sleep(LOCK_POLL_SECONDS)
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(owner)
+        try:
+            yield
+        finally:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def has_answers(question_name):
+    """Tell whether any answer was stored for the question."""
+    return os.path.exists(answer_path(question_name)) or os.path.exists(log_path(question_name))
+
+def list_answered_questions():
+    """List the names of the questions having stored answers."""
+    names = set()
+    if os.path.isdir(ANSWERS_FOLDER):
+        for file_name in os.listdir(ANSWERS_FOLDER):
+            if file_name.endswith('.a'):
+                names.add(file_name[:-2])
+            elif file_name.endswith('.a' + LOG_SUFFIX):
+                names.add(file_name[:-len('.a' + LOG_SUFFIX)])
+    return sorted(names)
+
+def _read_log(question_name):
+    """Yield the (model, answer) records of the log, oldest first."""
+    path = log_path(question_name)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash during an append
+                continue
+            yield record['model'], record['answer']
+
+def salvage(text):
+    """The complete entries at the start of a truncated answers file.
+
+    Returns a dict of the models whose answer could be read entirely.
+    """
+    decoder = json.JSONDecoder()
+    answers = {}
+    position = text.find('{') + 1
+    if not position:
+        return answers
+    while True:
+        try:
+            while text[position].isspace():
+                position += 1
+            if text[position] == '}':
+                return answers
+            model_name, position = decoder.raw_decode(text, position)
+            while text[position].isspace():
+                position += 1
+            if text[position] != ':':
+                return answers
+            position += 1
+            while text[position].isspace():
+                position += 1
+            answer, position = decoder.raw_decode(text, position)
+        except (IndexError, ValueError):
+            return answers
+        answers[model_name] = answer
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text) or text[position] != ',':
+            return answers
+        position += 1
+
+def _read_answers_file(question_name):
+    """The answers of the answers file, and whether it is damaged."""
+    try:
+        with open(answer_path(question_name), 'r', encoding='utf-8') as file:
+            text = file.read()
+    except FileNotFoundError:
+        return {}, False
+    try:
+        answers = json.loads(text)
+    except ValueError:
+        return salvage(text), True
+    if not isinstance(answers, dict):
+        return {}, True
+    return answers, False
+
+def _version(question_name):
+    try:
+        stat = os.stat(answer_path(question_name))
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def load_answers(question_name):
+    """Load all the answers to a question, log included."""
+    while True:
+        version = _version(question_name)
+        answers, damaged = _read_answers_file(question_name)
+        for model_name, answer in _read_log(question_name):
+            answers[model_name] = answer
+        # Compacted while reading: the log read may already be gone
+        if _version(question_name) == version:
+            break
+    if damaged:
+        print(f"Answers file {answer_path(question_name)} is damaged, only {len(answers)} answers could be read; "
+              f"run python answer_store.py --recover")
+    return answers
+
+def _append_line(path, line):
+    """Append a line, first ending a line cut short by a crash so that it does not swallow this one."""
+    with open(path, 'ab+') as file:
+        if file.tell():
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                line = '\n' + line
+        file.write(line.encode('utf-8'))
+        file.flush()
+        os.fsync(file.fileno())
+
+def append_answer(question_name, model_name, answer):
+    """Record the answer of one model without rewriting the other answers."""
+    line = json.dumps({'model': model_name, 'answer': answer}) + '\n'
+    with question_lock(question_name):
+        _append_line(log_path(question_name), line)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _write_answers_file(question_name, answers):
+    """Atomically replace the answers file of a question; the caller holds the lock."""
+    fd, tmp_path = tempfile.mkstemp(dir=ANSWERS_FOLDER, prefix=f".{question_name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(answers, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, answer_path(question_name))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_answers(question_name, answers):
+    """Atomically replace all the answers to a question, dropping its log."""
+    with question_lock(question_name):
+        _write_answers_file(question_name, answers)
+        # A crash here leaves the old log, applied again over the new answers
+        _remove(log_path(question_name))
+
+def compact(question_name):
+    """Fold the log of a question into its answers file.
+
+    A damaged answers file is left alone (with its log) for `recover`.
+    """
+    with question_lock(question_name):
+        if not os.path.exists(log_path(question_name)):
+            return False
+        answers, damaged = _read_answers_file(question_name)
+        if damaged:
+            print(f"Not compacting '{question_name}': {answer_path(question_name)} is damaged, "
+                  f"run python answer_store.py --recover")
+            return False
+        for model_name, answer in _read_log(question_name):
+            answers[model_name] = answer
+        _write_answers_file(question_name, answers)
+        # A crash here leaves the log, folded again by the next compaction
+        os.remove(log_path(question_name))
+        return True
+
+def compact_all(verbose=False):
+    """Compact every question having a log."""
+    for question_name in list_answered_questions():
+        if compact(question_name) and verbose:
+            print(f"Compacted answers of '{question_name}' into {answer_path(question_name)}")
+
+def answer_text(answer):
+    """The text of a stored answer, or None when it has none."""
+    try:
+        content = answer['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        return None
+    return content if isinstance(content, str) else None
+
+def delete_answers(question_name):
+    """Delete all the answers to a question."""
+    with question_lock(question_name):
+        for path in (answer_path(question_name), log_path(question_name)):
+            _remove(path)
+
+def _temporary_files(question_name):
+    prefix = f".{question_name}."
+    return [os.path.join(ANSWERS_FOLDER, file_name) for file_name in os.listdir(ANSWERS_FOLDER)
+            if file_name.startswith(prefix) and file_name.endswith('.tmp')
+            and '.' not in file_name[len(prefix):-len('.tmp')]]
+
+def recover(question_name, verbose=False):
+    """Repair the answers of a question after a crash, then compact them.
+
+    - a stale lock is removed (a lock held by a running process is waited for);
+    - a damaged answers file is replaced by the answers that can still be
+      read, from the file itself or from a complete temporary file left by an
+      interrupted write, whichever has more; the damaged file is kept as
+      `<q>.a.damaged`;
+    - the lines of the log cut short by a crash are dropped;
+    - the temporary files are removed.
+
+    Returns the list of the repairs made.
+    """
+    repairs = []
+    path = lock_path(question_name)
+    if os.path.exists(path) and _is_stale(path):
+        _break_stale_lock(path)
+        repairs.append(f"removed the stale lock {path}")
+    with question_lock(question_name):
+        answers, damaged = _read_answers_file(question_name)
+        temporary = {}
+        for tmp_path in _temporary_files(question_name):
+            try:
+                with open(tmp_path, 'r', encoding='utf-8') as file:
+                    content = json.load(file)
+            except (OSError, ValueError):
+                content = None
+            if isinstance(content, dict) and len(content) > len(temporary):
+                temporary = content
+            _remove(tmp_path)
+            repairs.append(f"removed the temporary file {tmp_path}")
+        if damaged:
+            os.replace(answer_path(question_name), answer_path(question_name) + DAMAGED_SUFFIX)
+            if len(temporary) > len(answers):
+                answers = temporary
+            _write_answers_file(question_name, answers)
+            repairs.append(f"rewrote {answer_path(question_name)} with the {len(answers)} answers that could be read, "
+                           f"the damaged file is kept as {answer_path(question_name) + DAMAGED_SUFFIX}")
+        elif temporary and not os.path.exists(answer_path(question_name)):
+            _write_answers_file(question_name, temporary)
+            repairs.append(f"restored {answer_path(question_name)} from an interrupted write ({len(temporary)} answers)")
+        if os.path.exists(log_path(question_name)):
+            with open(log_path(question_name), 'r', encoding='utf-8', errors='replace') as file:
+                lines = file.readlines()
+            kept = [line if line.endswith('\n') else line + '\n' for line in lines if _valid_log_line(line)]
+            if len(kept) != len(lines) or (lines and not lines[-1].endswith('\n')):
+                fd, tmp_path = tempfile.mkstemp(dir=ANSWERS_FOLDER, prefix=f".{question_name}.log.", suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                    file.writelines(kept)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, log_path(question_name))
+                repairs.append(f"dropped {len(lines) - len(kept)} damaged lines of {log_path(question_name)}")
+    if compact(question_name):
+        repairs.append("compacted the log")
+    if verbose:
+        for repair in repairs:
+            print(f"'{question_name}': {repair}")
+    return repairs
+
+def _valid_log_line(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return False
+    return isinstance(record, dict) and 'model' in record and 'answer' in record
+
+def _damaged_questions():
+    """The questions having files left by a crash, with or without answers."""
+    names = set(list_answered_questions())
+    if os.path.isdir(ANSWERS_FOLDER):
+        for file_name in os.listdir(ANSWERS_FOLDER):
+            if file_name.endswith('.a' + LOCK_SUFFIX):
+                names.add(file_name[:-len('.a' + LOCK_SUFFIX)])
+    return sorted(names)
+
+def recover_all(verbose=False):
+    """Repair every question; returns the number of questions repaired."""
+    repaired = 0
+    for question_name in _damaged_questions():
+        if recover(question_name, verbose):
+            repaired += 1
+    return repaired
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compact the answer logs into the answers files.")
+    parser.add_argument('--recover', action='store_true',
+                        help="Repair the files left by a crash (truncated files and log lines, temporary files, stale locks) before compacting")
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
+    args = parser.parse_args()
+    if args.recover:
+        print(f"Repaired the answers of {recover_all(args.verbose)} questions")
+    else:
+        compact_all(args.verbose)
@@ -1,78 +1,96 @@
 import os
 import json
+import time
 import argparse
 import requests
-import yaml
+import owui_client
+import storage
+import config_store
+import judge_cache
+import scheduler
+import results_store
+import analysis_report
+import job_runner
+import prescore
+import sharding
+import costs
+import perf_metrics
 import re
-import datetime
 
 THINK_MARKER_TO_BE_IGNORED = True
 DO_NOT_ADD_A_SYSTEM_PROMPT = True
 ADD_CITATIONS_TO_ANSWER = False
+USE_JUDGE_CACHE = True
+BATCH_JUDGING = False
+# Local pre-scoring mode (see prescore); None: from the configuration
+PRESCORE_MODE = None
+# Cost cap of the run; None: from the configuration (see costs)
+BUDGET = None
 
-def load_connect_owui(file_path):
-    with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
+# Token and cost totals of the run
+cost_tracker = None
 
-CONFIG_PATH = './config/config.yaml'
-config = load_connect_owui('./config/connect-owui.yaml')
-API_KEY = config['open_webui']['api_key']
-BASE_URL = config['open_webui']['location']
-API_URL = f"{BASE_URL}/api/chat/completions"
-config_yaml_path = './config/selected_questions.yaml'
+# Size of the judge's context, to check that a batched judge request fits
+# in it (judge_context_tokens in config.yaml)
+DEFAULT_JUDGE_CONTEXT_TOKENS = 16000
+TOKENS_PER_VERDICT = 600
+
+# Analysis returned when the judge request failed
+ANALYSIS_ERROR = "Error in API request"
+SYSTEM_PROMPT = "Tu fournis une évaluation en français de la qualité de la réponse par rapport à la cible."
+PROMPT_TEMPLATE = (
+    "--------------------------------------------------------\n"
+    "Question qui a été posée au modèle d'IA:\n {question}\n"
+    "--------------------------------------------------------\n"
+    "Réponse obtenue du modèle:\n {candidate_answer}\n"
+    "--------------------------------------------------------\n"
+    "Nos experts juridiques ont déterminé que la bonne réponse est:\n {target_answer}\n"
+    "--------------------------------------------------------\n"
+    "Informations cruciales attendues:\n {infos_cruciales}\n"
+    "--------------------------------------------------------\n"
+    "Informations à éviter:\n {infos_a_eviter}."
+    "--------------------------------------------------------\n"
+    "Termine ton évaluation par un objet JSON sur une seule ligne de la forme "
+    "{{\"couverture_infos_cruciales\": <note de 0 à 10>, \"infos_a_eviter_presentes\": <true ou false>, \"note_globale\": <note de 0 à 10>}}.\n"
+)
+BATCH_PROMPT_TEMPLATE = (
+    "--------------------------------------------------------\n"
+    "Question qui a été posée à plusieurs modèles d'IA:\n {question}\n"
+    "--------------------------------------------------------\n"
+    "Nos experts juridiques ont déterminé que la bonne réponse est:\n {target_answer}\n"
+    "--------------------------------------------------------\n"
+    "Informations cruciales attendues:\n {infos_cruciales}\n"
+    "--------------------------------------------------------\n"
+    "Informations à éviter:\n {infos_a_eviter}."
+    "--------------------------------------------------------\n"
+    "{candidates}"
+    "Évalue séparément chacune des réponses ci-dessus par rapport à la bonne réponse, "
+    "aux informations cruciales attendues et aux informations à éviter. "
+    "Réponds uniquement avec un objet JSON dont les clés sont les identifiants des réponses "
+    "({candidate_ids}) et les valeurs des objets de la forme "
+    "{{\"evaluation\": <ton évaluation en français>, \"couverture_infos_cruciales\": <note de 0 à 10>, "
+    "\"infos_a_eviter_presentes\": <true ou false>, \"note_globale\": <note de 0 à 10>}}.\n"
+)
+CANDIDATE_TEMPLATE = (
+    "Réponse {candidate_id}:\n {candidate_answer}\n"
+    "--------------------------------------------------------\n"
+)
 
-questions_dir = './questions'
-answers_dir = './answers'
-targets_dir = './targets'
-analysis_dir = './analysis'
 
 n_questions = 0
 n_models = 0
 
 def load_config():
-    """Load existing configuration from the YAML file."""
-    try:
-        if os.path.exists(CONFIG_PATH):
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as file:
-                return yaml.safe_load(file) or {}
-    except yaml.YAMLError:
-        print("Error reading YAML configuration")
-    return {}
+    """Load the configuration."""
+    return config_store.config()
 
 def load_analysis_model():
     """Load the selected model for analysis from the configuration."""
     config = load_config()
     return config.get('analysis_model', 'GPT-4o')  # default to GPT-4o
 
-def read_file_content(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return file.read().strip()
-
-def read_json_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
-
-def get_analysis_response(question, candidate_answer, target_answer, infos_cruciales, infos_a_eviter, analysis_model, verbose):
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
-
-    prompt = (
-        f"--------------------------------------------------------\n"
-        f"Question qui a été posée au modèle d'IA:\n {question}\n"
-        f"--------------------------------------------------------\n"
-        f"Réponse obtenue du modèle:\n {candidate_answer}\n"
-        f"--------------------------------------------------------\n"
-        f"Nos experts juridiques ont déterminé que la bonne réponse est:\n {target_answer}\n"
-        f"--------------------------------------------------------\n"
-        f"Informations cruciales attendues:\n {infos_cruciales}\n"
-        f"--------------------------------------------------------\n"
-        f"Informations à éviter:\n {infos_a_eviter}."
-        f"--------------------------------------------------------\n"
-    )
-
+def build_judge_request(prompt, analysis_model):
+    """Build the chat completion request sent to the analysis model."""
     if DO_NOT_ADD_A_SYSTEM_PROMPT:
         data = {
             'model': analysis_model,
@@ -85,179 +103,562 @@ def get_analysis_response(question, candidate_answer, target_answer, infos_cruci
         data = {
             'model': analysis_model,
             'messages': [
-                {'role': 'system', 'content': "Tu fournis une évaluation en français de la qualité de la réponse par rapport à la cible."},
+                {'role': 'system', 'content': SYSTEM_PROMPT},
                 {'role': 'user', 'content': prompt}
             ],
             'stream':False,
         }
+    return data
+
+def send_judge_request(data, analysis_model, verbose):
+    """Send a request to the analysis model and return its answer.
 
+    Its tokens and cost are counted; raises costs.BudgetExceeded, without
+    sending it, when it would exceed the budget of the run.
+    """
+    prompt_text = ''.join(message['content'] for message in data['messages'])
+    reserved = cost_tracker.reserve(analysis_model, prompt_text) if cost_tracker is not None else 0.0
     if verbose:
         print("*-*-*-*-*-*-*-*-*")
-        print(f"Making request to: {API_URL}")
+        print(f"Making request to: {owui_client.api_url('/api/chat/completions')}")
         print(f"Using model: {analysis_model}")
         # print(f"Headers: {headers}")
         print(f"Response data: {json.dumps(data, indent=2)}")
         
-    try:
-        response = requests.post(API_URL, headers=headers, json=data)
+    def send_request():
+        response = owui_client.post('/api/chat/completions', data)
         if verbose:
             print("*-*-*-*-*-*-*-*-*")
             print(f"Response status: {response.status_code}")
             print(f"Response headers: {dict(response.headers)}")
             
-        response.raise_for_status()
-        return response.json()['choices'][0]['message']['content']
+        owui_client.check_status(response)
+        return response.json(), response.status_code
+
+    # Rate limited per provider; 429, 5xx and connection errors are retried
+    started = time.perf_counter()
+    try:
+        (response_data, status), retries = scheduler.call_with_retries(analysis_model, send_request, verbose)
+    except requests.exceptions.RequestException as e:
+        if cost_tracker is not None:
+            cost_tracker.release(reserved)
+        status = e.response.status_code if getattr(e, 'response', None) is not None else None
+        perf_metrics.record_request(analysis_model, status, time.perf_counter() - started, False,
+                                    retries=getattr(e, 'retries', 0), kind='judge')
+        raise
+    request_cost = None
+    if cost_tracker is not None:
+        request_cost = cost_tracker.record(analysis_model, response_data.get('usage'), prompt_text, reserved=reserved)
+    perf_metrics.record_request(analysis_model, status, time.perf_counter() - started, True, response_data.get('usage'),
+                                retries=retries, kind='judge', cost=request_cost)
+    return response_data['choices'][0]['message']['content']
+
+def judge_template():
+    """The prompt template in use: the verdicts obtained with another one are not reused."""
+    return BATCH_PROMPT_TEMPLATE if BATCH_JUDGING else PROMPT_TEMPLATE
+
+def judge_cache_key(question, candidate_answer, target_answer, infos_cruciales, infos_a_eviter, analysis_model, template):
+    """Return the judge cache key of a candidate answer, or None when the cache is disabled."""
+    if not USE_JUDGE_CACHE:
+        return None
+    target_data = {
+        'reponse_cible': target_answer,
+        'infos_cruciales': infos_cruciales,
+        'infos_a_eviter': infos_a_eviter,
+    }
+    if not DO_NOT_ADD_A_SYSTEM_PROMPT:
+        template = SYSTEM_PROMPT + template
+    return judge_cache.make_key(question, candidate_answer, target_data, analysis_model, template)
+
+def get_analysis_response(question, candidate_answer, target_answer, infos_cruciales, infos_a_eviter, analysis_model, verbose, question_name=None):
+    prompt = PROMPT_TEMPLATE.format(
+        question=question,
+        candidate_answer=candidate_answer,
+        target_answer=target_answer,
+        infos_cruciales=infos_cruciales,
+        infos_a_eviter=infos_a_eviter,
+    )
+
+    # The same judge, prompt and inputs always get the same verdict from the cache
+    cache_key = judge_cache_key(question, candidate_answer, target_answer, infos_cruciales, infos_a_eviter, analysis_model, PROMPT_TEMPLATE)
+    if cache_key is not None:
+        cached_response = judge_cache.get(cache_key)
+        if cached_response is not None:
+            if verbose:
+                print("*-*-*-*-*-*-*-*-*")
+                print(f"Judge response served from the cache ({cache_key[:12]})")
+            return cached_response
+
+    try:
+        analysis = send_judge_request(build_judge_request(prompt, analysis_model), analysis_model, verbose)
+        if cache_key is not None:
+            judge_cache.put(cache_key, analysis, question_name, analysis_model)
+        return analysis
     except requests.exceptions.RequestException as e:
         print(f"Error with API request: {e}")
-        return "Error in API request"
+        return ANALYSIS_ERROR
+    except costs.BudgetExceeded:
+        # Judged again on the next run, like a failed request
+        return ANALYSIS_ERROR
 
-def main(verbose=False):
-    os.makedirs(analysis_dir, exist_ok=True)
-    analysis_model = load_analysis_model()
-    if verbose:
-        print("*-*-*-*-*-*-*-*-*")
-        print(f"Analysis to be performed by {analysis_model}")
-        
+def parse_batch_verdicts(content):
+    """Extract the per-candidate verdicts from the JSON object answered by the judge."""
+    content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
+    start = content.find('{')
+    end = content.rfind('}')
+    if start < 0 or end < start:
+        return {}
     try:
-        with open(config_yaml_path, 'r', encoding='utf-8') as stream:
-            selected_questions = yaml.safe_load(stream) or []
-            n_questions = len(selected_questions)
+        verdicts = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(verdicts, dict):
+        return {}
+    parsed = {}
+    for key, value in verdicts.items():
+        if isinstance(value, dict) and 'evaluation' in value:
+            # Same layout as a single evaluation: the text, then the scores
+            scores = {field: value.get(field) for field in results_store.SCORE_FIELDS}
+            parsed[str(key)] = f"{value['evaluation']}\n{json.dumps(scores, ensure_ascii=False)}"
+        else:
+            parsed[str(key)] = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, indent=2)
+    return parsed
+
+def get_batch_analysis_responses(question, candidates, target_answer, infos_cruciales, infos_a_eviter, analysis_model, verbose, question_name=None):
+    """Judge all the candidate answers to a question with as few judge requests as possible.
+
+    `candidates` is a list of (model, answer text). The answers are packed into
+    requests that fit the judge context; an answer that does not fit alone, or
+    whose verdict is missing from the judge's answer, is judged on its own.
+    Returns a dict mapping each model to its analysis.
+    """
+    verdicts = {}
+    pending = []
+    for model, answer_text in candidates:
+        cache_key = judge_cache_key(question, answer_text, target_answer, infos_cruciales, infos_a_eviter, analysis_model, BATCH_PROMPT_TEMPLATE)
+        cached_response = judge_cache.get(cache_key) if cache_key is not None else None
+        if cached_response is not None:
             if verbose:
                 print("*-*-*-*-*-*-*-*-*")
-                print(f"Loaded {n_questions} questions: {selected_questions}")
-                
-    except (FileNotFoundError, yaml.YAMLError) as e:
+                print(f"Judge response for {model} served from the cache ({cache_key[:12]})")
+            verdicts[model] = cached_response
+        else:
+            pending.append((model, answer_text, cache_key))
+
+    # Pack the pending answers into batches fitting the judge context
+    context_tokens = int(load_config().get('judge_context_tokens', DEFAULT_JUDGE_CONTEXT_TOKENS))
+    base_tokens = costs.estimate_tokens(BATCH_PROMPT_TEMPLATE.format(
+        question=question, target_answer=target_answer, infos_cruciales=infos_cruciales,
+        infos_a_eviter=infos_a_eviter, candidates='', candidate_ids=''))
+    batches = []
+    batch = []
+    batch_tokens = base_tokens
+    for candidate in pending:
+        candidate_tokens = costs.estimate_tokens(CANDIDATE_TEMPLATE.format(candidate_id='candidat_00', candidate_answer=candidate[1])) + TOKENS_PER_VERDICT
+        if batch and batch_tokens + candidate_tokens > context_tokens:
+            batches.append(batch)
+            batch = []
+            batch_tokens = base_tokens
+        batch.append(candidate)
+        batch_tokens += candidate_tokens
+    if batch:
+        batches.append(batch)
+
+    for batch in batches:
+        if len(batch) == 1:
+            # A single answer, possibly too long to share the context: judge it alone
+            for model, answer_text, _ in batch:
+                if verbose and len(pending) > 1:
+                    print(f"The answer of {model} does not fit in a batched request, judging it alone")
+                verdicts[model] = get_analysis_response(question, answer_text, target_answer, infos_cruciales,
+                                                        infos_a_eviter, analysis_model, verbose, question_name)
+            continue
+
+        candidate_ids = [f"candidat_{i}" for i in range(1, len(batch) + 1)]
+        prompt = BATCH_PROMPT_TEMPLATE.format(
+            question=question,
+            target_answer=target_answer,
+            infos_cruciales=infos_cruciales,
+            infos_a_eviter=infos_a_eviter,
+            candidates=''.join(CANDIDATE_TEMPLATE.format(candidate_id=candidate_id, candidate_answer=answer_text)
+                               for candidate_id, (_, answer_text, _) in zip(candidate_ids, batch)),
+            candidate_ids=', '.join(candidate_ids),
+        )
         if verbose:
-            print(f"YAML file not found or error reading YAML file: {e}. Defaulting to all answered questions.")
-        selected_questions = None
-    q=0
-    for question_file in os.listdir(questions_dir):
-        if question_file.endswith('.q'):
-            base_name = question_file[:-2]
-            question_path = os.path.join(questions_dir, question_file)
-            answer_path = os.path.join(answers_dir, question_file.replace('.q', '.a'))
-
-            if selected_questions is not None and base_name not in selected_questions:
-                    if verbose:
-                        print(f"Skipping question '{base_name}' as it is not listed in selected questions")
-                    continue
-            
-            if not os.path.exists(answer_path):
+            print("*-*-*-*-*-*-*-*-*")
+            print(f"Judging {len(batch)} answers for {question_name} in a single request")
+        try:
+            batch_verdicts = parse_batch_verdicts(send_judge_request(build_judge_request(prompt, analysis_model), analysis_model, verbose))
+        except requests.exceptions.RequestException as e:
+            print(f"Error with batched API request: {e}")
+            batch_verdicts = {}
+        except costs.BudgetExceeded:
+            batch_verdicts = {}
+
+        for candidate_id, (model, answer_text, cache_key) in zip(candidate_ids, batch):
+            if candidate_id in batch_verdicts:
+                verdicts[model] = batch_verdicts[candidate_id]
+                if cache_key is not None:
+                    judge_cache.put(cache_key, verdicts[model], question_name, analysis_model)
+            else:
+                if verbose:
+                    print(f"No verdict for {model} in the batched answer, judging it alone")
+                verdicts[model] = get_analysis_response(question, answer_text, target_answer, infos_cruciales,
+                                                        infos_a_eviter, analysis_model, verbose, question_name)
+    return verdicts
+
+def select_questions(store, verbose=False, shard=None):
+    """The names of the selected questions having answers, in the `shard` when given."""
+    selected_questions = config_store.selected_questions()
+    if selected_questions is not None:
+        if verbose:
+            print("*-*-*-*-*-*-*-*-*")
+            print(f"Loaded {len(selected_questions)} questions: {selected_questions}")
+    elif verbose:
+        print(f"No question selection in {config_store.SELECTED_QUESTIONS_PATH}. Defaulting to all answered questions.")
+    question_names = []
+    for base_name in store.list_questions():
+        if selected_questions is not None and base_name not in selected_questions:
                 if verbose:
-                    print(f"Skipping {base_name} because the answer file {answer_path} does not exist.")
+                    print(f"Skipping question '{base_name}' as it is not listed in selected questions")
                 continue
+        
+        if not store.has_answers(base_name):
+            if verbose:
+                print(f"Skipping {base_name} because there are no answers in {store.answers_location(base_name)}.")
+            continue
+        if not sharding.in_shard(sharding.unit_key(base_name), shard):
+            continue
+        question_names.append(base_name)
+    return question_names
+
+def build_candidates(answers_data, verbose=False, q=None, n_questions=None, base_name=None):
+    """One candidate per answer to judge: every sample of a multi-sample answer is judged.
+
+    Returns the (key, model, sample, answer text, date) candidates, and
+    whether each one was truncated and its latency, by candidate key.
+    """
+    n=0
+    n_models = len(answers_data)
+    candidates = []
+    truncated = {}
+    latencies = {}
+    for model, model_data in answers_data.items():
+        n=n+1
+        
+        if verbose:
+            print("*-*-*-*-*-*-*-*-*")
+            print(f"Processing response from model {n}/{n_models}-{model} for question {q}/{n_questions}-{base_name}")
+        
+        samples = model_data['samples'] if 'samples' in model_data else [model_data]
+        for i, sample_data in enumerate(samples):
+            sample = i if 'samples' in model_data else None
+            key = analysis_report.verdict_key(model, sample)
+            answer_text = sample_data['choices'][0]['message']['content']
+            truncated[key] = sample_data['choices'][0].get('finish_reason') == 'length'
+            latencies[key] = (sample_data.get('harness') or {}).get('latency')
             
-            q=q+1
-            target_path = os.path.join(targets_dir, question_file.replace('.q', '.t'))
-
-            question = read_file_content(question_path)
-            target_data = read_json_file(target_path)
-            target_answer = target_data['reponse_cible']
-            infos_cruciales = target_data.get('infos_cruciales', '')
-            infos_a_eviter = target_data.get('infos_a_eviter', '')
-
-            #report = "(c) 2025 Lavery De Billy S.E.N.C.R.L.\n"
-            report = ""
-            report += f"*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*\n"
-            report += f"Analyse pour {base_name}\n"
-            report += f"Question:\n"
-            report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
-            report += f"\n{question}\n"
-            report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
-            report += f"Réponse attendue pour {base_name}\n"
-            report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
-            report += f"{target_answer}\n"
-            report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
-            report += f"Informations cruciales attendues pour {base_name}:\n"
-            report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
-            report += f"{infos_cruciales}\n"
-            report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
-            report += f"Informations à éviter pour {base_name}:\n"
-            report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
-            report += f"{infos_a_eviter}\n"
-            report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
-            report += f"--------------------------------------------------------\n"
-
-            answers_data = read_json_file(answer_path)
-            n=0
-            n_models = len(answers_data)
-            for model, model_data in answers_data.items():
-                n=n+1
-                
-                if verbose:
+            if 'created' in sample_data:
+                answer_date_unix = sample_data['created']
+            else:
+                answer_date_unix = None
+            
+            if ADD_CITATIONS_TO_ANSWER:
+                answer_citations = ""
+                c=0
+                if 'citations' in sample_data:
+                    for citation_text in sample_data['citations']:
+                        c=c+1
+                        answer_citations = answer_citations + "\n" + f"citation[{c}]: "+ citation_text
+                    answer_citations = answer_citations + "\n"
+                else:
+                    answer_citations = "\n"
+                answer_text = answer_text + answer_citations
+
+            if THINK_MARKER_TO_BE_IGNORED:
+                answer_text = re.sub(r'<think>.*?</think>', '', answer_text, flags=re.DOTALL)
+
+            candidates.append((key, model, sample, answer_text, answer_date_unix))
+    return candidates, truncated, latencies
+
+def estimate_requests(store, question_names, analysis_model, prescore_settings):
+    """The (judge, prompt) of each judge request an analysis of the questions would send.
+
+    The answers already judged, graded locally in triage mode or whose
+    verdict is in the judge cache are left out. Each answer counts as one
+    request, also with --batch, which sends fewer but larger ones.
+    """
+    judge_requests = []
+    for base_name in question_names:
+        question = store.load_question(base_name).strip()
+        target_data = store.load_target(base_name)
+        if target_data is None:
+            continue
+        target_answer = target_data['reponse_cible']
+        infos_cruciales = target_data.get('infos_cruciales', '')
+        infos_a_eviter = target_data.get('infos_a_eviter', '')
+        header = analysis_report.header_record(base_name, question, target_answer, infos_cruciales,
+                                               infos_a_eviter, analysis_model, judge_template())
+        judged = analysis_report.resumable_verdicts(store.load_analysis_records(base_name), header)
+        candidates, truncated, _ = build_candidates(store.load_answers(base_name))
+        pending = {key: answer_text for key, _, _, answer_text, _ in candidates
+                   if not (key in judged and judged[key]['answer_hash'] == analysis_report.text_hash(answer_text))}
+        if prescore_settings['mode'] == 'triage' and pending:
+            prescores = prescore.score_answers({key: (answer_text, truncated[key]) for key, answer_text in pending.items()},
+                                               target_answer, infos_cruciales, infos_a_eviter, prescore_settings)
+            to_judge, _ = prescore.triage(prescores, prescore_settings)
+            pending = {key: pending[key] for key in to_judge}
+        # A batched run also falls back to per-model requests, cached under the per-model template
+        templates = (BATCH_PROMPT_TEMPLATE, PROMPT_TEMPLATE) if BATCH_JUDGING else (PROMPT_TEMPLATE,)
+        for key, answer_text in pending.items():
+            cache_keys = [judge_cache_key(question, answer_text, target_answer, infos_cruciales, infos_a_eviter, analysis_model, template)
+                          for template in templates]
+            if any(cache_key is not None and judge_cache.get(cache_key) is not None for cache_key in cache_keys):
+                continue
+            prompt = PROMPT_TEMPLATE.format(question=question, candidate_answer=answer_text, target_answer=target_answer,
+                                            infos_cruciales=infos_cruciales, infos_a_eviter=infos_a_eviter)
+            judge_requests.append((analysis_model, prompt))
+    return judge_requests
+
+def main(verbose=False, progress=False, shard=None, queue=None, output=None, estimate=False):
+    """Analyse the answers to the selected questions.
+
+    In a sharded run (see sharding), only the questions of the `shard` are
+    analysed, each question is first claimed from the `queue` when given,
+    and the scores are written to the `output` folder, to be merged.
+
+    The tokens and cost of the judge requests are counted (see costs): once
+    the next request would exceed the BUDGET, no new request is sent and the
+    remaining answers are judged on the next run. With `estimate`, nothing
+    is sent: the tokens and cost of the judge requests are estimated and
+    printed.
+    """
+    global cost_tracker
+    store = storage.get_storage()
+    analysis_model = load_analysis_model()
+    if verbose:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Analysis to be performed by {analysis_model}")
+        
+    if not estimate and config_store.connect_owui() is None:
+        print(f"No Open WebUI connection settings found in {config_store.CONNECT_OWUI_PATH}, save them from app-setup-questions.py first.")
+        return
+
+    question_names = select_questions(store, verbose, shard)
+    n_questions = len(question_names)
+
+    prescore_settings = prescore.load_settings()
+    if PRESCORE_MODE is not None:
+        prescore_settings['mode'] = PRESCORE_MODE
+
+    if estimate:
+        costs.print_estimate(estimate_requests(store, question_names, analysis_model, prescore_settings), 'judge', BUDGET)
+        return
+    cost_tracker = costs.CostTracker('judge', BUDGET)
+
+    for q, base_name in enumerate(question_names, start=1):
+        if cost_tracker.stopped:
+            print(f"Budget reached: {n_questions - q + 1} questions left for the next run")
+            break
+        if queue is not None and not queue.claim(sharding.unit_key(base_name)):
+            if verbose:
+                print(f"Skipping {base_name}: claimed by another process or already analysed")
+            continue
+        question = store.load_question(base_name).strip()
+        target_data = store.load_target(base_name)
+        if target_data is None:
+            print(f"Skipping {base_name} because its target data is missing.")
+            if queue is not None:
+                queue.release(sharding.unit_key(base_name))
+            continue
+        target_answer = target_data['reponse_cible']
+        infos_cruciales = target_data.get('infos_cruciales', '')
+        infos_a_eviter = target_data.get('infos_a_eviter', '')
+
+        header = analysis_report.header_record(base_name, question, target_answer, infos_cruciales,
+                                               infos_a_eviter, analysis_model, judge_template())
+        judged = analysis_report.resumable_verdicts(store.load_analysis_records(base_name), header)
+
+        candidates, truncated, latencies = build_candidates(store.load_answers(base_name), verbose, q, n_questions, base_name)
+        n_candidates = len(candidates)
+
+        # Reuse the verdicts of an interrupted analysis, for the answers that did not change
+        records = [header]
+        for key, _, _, answer_text, _ in candidates:
+            if key in judged and judged[key]['answer_hash'] == analysis_report.text_hash(answer_text):
+                records.append(judged[key])
+        reused = {analysis_report.verdict_key(record['model'], record.get('sample')) for record in records[1:]}
+        store.write_analysis_records(base_name, records)
+        store.save_analysis(base_name, analysis_report.render_text(records))
+        if verbose and reused:
+            print("*-*-*-*-*-*-*-*-*")
+            print(f"Resuming the analysis of {base_name}: {len(reused)}/{n_candidates} answers already judged")
+
+        # Local scores of all the answers; in triage mode the clear cases are graded from them
+        prescores = {}
+        local = {}
+        if prescore_settings['mode'] != 'off':
+            prescores = prescore.score_answers({key: (answer_text, truncated[key]) for key, _, _, answer_text, _ in candidates},
+                                               target_answer, infos_cruciales, infos_a_eviter, prescore_settings)
+            if prescore_settings['mode'] == 'triage':
+                _, local = prescore.triage({key: scores for key, scores in prescores.items() if key not in reused},
+                                           prescore_settings)
+                if verbose and local:
                     print("*-*-*-*-*-*-*-*-*")
-                    print(f"Processing response from model {n}/{n_models}-{model} for question {q}/{n_questions}-{base_name}")
-                
-                answer_text = model_data['choices'][0]['message']['content']
-                
-                if 'created' in model_data:
-                    answer_date_unix = model_data['created']
+                    print(f"Graded {len(local)}/{n_candidates} answers of {base_name} locally: "
+                          + ', '.join(f"{key} ({reason})" for key, reason in local.items()))
+
+        pending = [(key, answer_text) for key, _, _, answer_text, _ in candidates if key not in reused and key not in local]
+        if BATCH_JUDGING and pending:
+            verdicts = get_batch_analysis_responses(
+                question,
+                pending,
+                target_answer,
+                infos_cruciales,
+                infos_a_eviter,
+                analysis_model,
+                verbose,
+                base_name
+            )
+
+        n=0
+        failed = 0
+        for key, model, sample, answer_text, answer_date_unix in candidates:
+            n=n+1
+            if key not in reused:
+                if key in local:
+                    api_response = prescore.local_analysis(prescores[key], local[key])
+                elif BATCH_JUDGING:
+                    api_response = verdicts[key]
                 else:
-                    answer_date_unix = None
-                
-                if ADD_CITATIONS_TO_ANSWER:
-                    answer_citations = ""
-                    c=0
-                    if 'citations' in model_data:
-                        for citation_text in model_data['citations']:
-                            c=c+1
-                            answer_citations = answer_citations + "\n" + f"citation[{c}]: "+ citation_text
-                        answer_citations = answer_citations + "\n"
-                    else:
-                        answer_citations = "\n"
-                    answer_text = answer_text + answer_citations
-
-                if THINK_MARKER_TO_BE_IGNORED:
-                    answer_text = re.sub(r'<think>.*?</think>', '', answer_text, flags=re.DOTALL)
-
-                api_response = get_analysis_response(
-                    question,
-                    answer_text,
-                    target_answer,
-                    infos_cruciales,
-                    infos_a_eviter,
-                    analysis_model,
-                    verbose
-                )
-
-                report += f"Réponse du modèle {model} pour {base_name}:\n"
-                if answer_date_unix: report += f"Date de la réponse: {convert_unix_timestamp_to_human_readable(answer_date_unix)}\n"
-                report += f"|-_-|---|-¯-|---|-_-|---|-¯-|---|-_-|---|-¯-|---|-_-|\n\n"
-                report += f"{answer_text}\n"
-                report += f"|-_-|---|-¯-|---|-_-|---|-¯-|---|-_-|---|-¯-|---|-_-|\n\n"
-                report += f"Analyse de la réponse du modèle {model} pour {base_name}:\n"
-                report += f"-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_\n"
-                report += f"{api_response}\n"
-                report += f"-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯-¯\n"
-                report += f"*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*\n\n"
+                    api_response = get_analysis_response(
+                        question,
+                        answer_text,
+                        target_answer,
+                        infos_cruciales,
+                        infos_a_eviter,
+                        analysis_model,
+                        verbose,
+                        base_name
+                    )
+                record = analysis_report.verdict_record(model, answer_text, answer_date_unix, api_response,
+                                                        failed=api_response == ANALYSIS_ERROR,
+                                                        prescore=prescores.get(key), local=key in local,
+                                                        sample=sample)
+                failed = failed + record['failed']
+                # Checkpoint the verdict before anything else, then show it in the report
+                store.append_analysis_record(base_name, record)
+                records.append(record)
+                store.save_analysis(base_name, analysis_report.render_text(records))
 
                 if verbose:
                     print("*-*-*-*-*-*-*-*-*")
-                    print(f"Processed response from model {n}/{n_models}-{model} for question {q}/{n_questions}-{base_name}")
+                    print(f"Processed response {n}/{n_candidates}-{key} for question {q}/{n_questions}-{base_name}")
+            if progress:
+                job_runner.emit_progress(question=q, n_questions=n_questions, question_name=base_name,
+                                         model=n, n_models=n_candidates, model_name=key,
+                                         fraction=((q - 1) + n / n_candidates) / n_questions,
+                                         costs=cost_tracker.totals())
 
-            #report += "(c) 2025 Lavery De Billy S.E.N.C.R.L."
-            analysis_filename = os.path.join(analysis_dir, question_file.replace('.q', '.txt'))
-            with open(analysis_filename, 'w', encoding='utf-8') as f:
-                f.write(report)
+        if not failed:
+            records.append(analysis_report.end_record())
+            store.append_analysis_record(base_name, records[-1])
+        elif verbose:
+            print(f"{failed} answers of {base_name} could not be judged; they will be judged again on the next run")
+        renderings = analysis_report.write_renderings(base_name, records)
+        save_scores(base_name, records, analysis_model, latencies, output)
+        if queue is not None:
+            if failed:
+                queue.release(sharding.unit_key(base_name))
+            else:
+                queue.complete(sharding.unit_key(base_name))
 
-            if verbose:
-                print("*-*-*-*-*-*-*-*-*")
-                print(f"Completed analysis for {q}/{n_questions}-{base_name}\nSaved in {analysis_dir} under the name {analysis_filename}")
-                
+        if verbose:
+            print("*-*-*-*-*-*-*-*-*")
+            print(f"Completed analysis for {q}/{n_questions}-{base_name}\nSaved in {store.analysis_location(base_name)} and {', '.join(renderings)}")
+            print(f"Running totals: {cost_tracker.summary()}")
+            
+    if cost_tracker.requests:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Run totals: {cost_tracker.summary()}")
+    if output is not None:
+        print(f"Scores saved in {output.folder}; run 'python app-shards.py merge' once every shard is done")
+        return
+    update_leaderboard(verbose)
 
-def convert_unix_timestamp_to_human_readable(unix_timestamp):
-    createdDateTime = datetime.datetime.fromtimestamp(unix_timestamp)
-    year = createdDateTime.year
-    month = createdDateTime.month
-    day = createdDateTime.day
-    hour = createdDateTime.hour
-    minute = createdDateTime.minute
-    second = createdDateTime.second
+def save_scores(base_name, records, analysis_model, latencies, output=None):
+    """Save the results rows of a question and, for the models answering several times, their sample statistics.
 
-    return f"{year}-{(month < 10 and '0' or '')}{month}-{(day < 10 and '0' or '')}{day} {(hour < 10 and '0' or '')}{hour}:{(minute < 10 and '0' or '')}{minute}:{(second < 10 and '0' or '')}{second}"
+    They go to the `output` folder of a sharded run instead of ./analysis.
+    A model with a verdict that failed or was not asked because of the budget
+    is left out, so that its previous scores stay until it is judged again.
+    """
+    by_model = {}
+    for record in records:
+        if record['type'] == 'verdict':
+            by_model.setdefault(record['model'], []).append(record)
+    rows = []
+    sample_rows = []
+    for model, verdicts in by_model.items():
+        if any(verdict.get('failed') for verdict in verdicts):
+            continue
+        judge = 'prescore' if all(verdict.get('local') for verdict in verdicts) else analysis_model
+        if verdicts[0].get('sample') is None:
+            rows.append(results_store.make_row(base_name, model, judge, verdicts[-1]['analysis']))
+            continue
+        analyses = [verdict['analysis'] for verdict in verdicts]
+        rows.append(results_store.make_samples_row(base_name, model, judge, analyses))
+        sample_rows.append(results_store.make_sample_stats_row(
+            base_name, model, analyses,
+            [latencies.get(analysis_report.verdict_key(model, verdict['sample'])) for verdict in verdicts],
+            [verdict['answer_text'] for verdict in verdicts],
+            [prescore.words(verdict['answer_text']) for verdict in verdicts],
+        ))
+    results_path = output.results_path if output is not None else results_store.RESULTS_CSV
+    samples_path = output.samples_path if output is not None else results_store.SAMPLES_CSV
+    results_store.save_results(rows, results_path)
+    if sample_rows:
+        results_store.save_sample_stats(sample_rows, samples_path)
+
+def update_leaderboard(verbose=False):
+    """Rank the models from the scores of all the analysed questions."""
+    board, sample_stats = results_store.update_rankings()
+    if verbose:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Leaderboard saved in {results_store.LEADERBOARD_CSV}")
+        for rank, row in enumerate(board, start=1):
+            interval = f"[{row['note_globale_ic_bas']}, {row['note_globale_ic_haut']}]" if row['note_globale_ic_bas'] is not None else ""
+            print(f"{rank}. {row['model']}: {row['note_globale_moyenne']}/10 {interval} over {row['valid_scores']}/{row['questions']} scored questions")
+        if sample_stats:
+            print(f"Sample statistics saved in {results_store.SAMPLES_CSV} and {results_store.STABILITY_CSV}")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Run model answer analysis.")
     parser.add_argument('--verbose', action='store_true', help="Enable verbose mode")
+    parser.add_argument('--no-cache', action='store_true', help="Always ask the judge, ignoring the cached responses")
+    parser.add_argument('--batch', action='store_true', help="Judge all the answers to a question in a single request when they fit in the judge context")
+    parser.add_argument('--prescore', choices=prescore.MODES, default=None,
+                        help="Local pre-scoring: off, record the local scores, or triage (grade the clear cases locally); default from config.yaml")
+    parser.add_argument('--shard', type=sharding.parse_shard, default=None, help="Only analyse the questions of shard i of N (i/N)")
+    parser.add_argument('--queue', action='store_true', help="Claim the questions one by one from the work queue of --work-dir")
+    parser.add_argument('--work-dir', default=sharding.DEFAULT_WORK_DIR, help=f"Shared folder of the sharded runs (default: {sharding.DEFAULT_WORK_DIR})")
+    parser.add_argument('--lease-seconds', type=int, default=sharding.LEASE_SECONDS, help=f"Age after which the claim of a dead process is taken over (default: {sharding.LEASE_SECONDS})")
+    parser.add_argument('--budget', type=float, default=None, help="Cost cap of the run: no new judge request is sent once it would be exceeded (default: costs.budget.judge in config.yaml)")
+    parser.add_argument('--estimate', action='store_true', help="Only print the estimated tokens and cost of the judge requests, without sending them")
+    parser.add_argument('--leaderboard', action='store_true', help="Only rebuild the leaderboard from the scores already in the results file")
+    parser.add_argument('--progress', action='store_true', help="Print machine-readable progress lines for the web interface")
     args = parser.parse_args()
-    main(verbose=args.verbose)
\ No newline at end of file
+    USE_JUDGE_CACHE = not args.no_cache
+    BATCH_JUDGING = args.batch
+    PRESCORE_MODE = args.prescore
+    BUDGET = args.budget
+    if args.leaderboard:
+        update_leaderboard(verbose=True)
+    else:
+        queue = output = None
+        if args.shard is not None or args.queue:
+            worker = sharding.worker_id(args.shard)
+            output = sharding.ShardOutput(args.work_dir, worker)
+            if args.queue:
+                queue = sharding.WorkQueue(args.work_dir, worker, args.lease_seconds)
+        main(verbose=args.verbose, progress=args.progress, shard=args.shard, queue=queue, output=output, estimate=args.estimate)
\ No newline at end of file
@@ -0,0 +1,41 @@
+import argparse
+import bulk_io
+import storage
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import of questions, bulk export of questions, answers and analysis results (JSON Lines or CSV).")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Import questions with their target data")
+    import_parser.add_argument('file', help="File to import, '-' for stdin")
+    import_parser.add_argument('--skip-existing', action='store_true', help="Keep the questions that already exist instead of replacing them")
+    import_parser.add_argument('--batch-size', type=int, default=bulk_io.BATCH_SIZE, help=f"Questions saved at once (default {bulk_io.BATCH_SIZE})")
+
+    export_parser = subparsers.add_parser('export', help="Export questions, answers or analysis results")
+    export_parser.add_argument('what', choices=sorted(bulk_io.EXPORTS), help="What to export")
+    export_parser.add_argument('file', help="File to write, '-' for stdout")
+    export_parser.add_argument('--model', action='append', help="Only the answers or results of this model (repeatable)")
+
+    for subparser in (import_parser, export_parser):
+        subparser.add_argument('--format', choices=bulk_io.FORMATS, default=None, help="jsonl or csv (default: from the file extension, jsonl for '-')")
+        subparser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
+    args = parser.parse_args()
+
+    store = storage.get_storage()
+    file_format = args.format or bulk_io.guess_format(args.file)
+    if args.command == 'import':
+        if args.verbose:
+            print("*-*-*-*-*-*-*-*-*")
+            print(f"Importing questions from {args.file} ({file_format}) to {store.describe()}")
+        with bulk_io.open_file(args.file, 'r') as file:
+            counts = bulk_io.import_questions(store, file, file_format, max(args.batch_size, 1), args.skip_existing, args.verbose)
+        print(f"Imported {counts['imported']} questions, skipped {counts['skipped']} existing questions, "
+              f"{counts['errors']} rows with errors")
+    else:
+        with bulk_io.open_file(args.file, 'w') as file:
+            count = bulk_io.export(store, args.what, file, file_format, args.model)
+        if args.file != '-':
+            print(f"Exported {count} rows of {args.what} from {store.describe()} to {args.file}")
+
+if __name__ == "__main__":
+    main()
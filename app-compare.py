@@ -1,80 +1,62 @@
 import requests
-import yaml
 import json
 import os
+import hashlib
+import time
 import argparse
+import threading
+import owui_client
+import storage
+import config_store
+import perf_metrics
+import scheduler
+import job_runner
+import sharding
+import costs
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 MODELS_SUPPORTING_CITATIONS =  ["perplexity","claude"]
 
-def load_connect_owui(file_path):
-    with open(file_path, 'r', encoding="utf-8") as file:
-        return yaml.safe_load(file)
-
-config = load_connect_owui('./config/connect-owui.yaml')
-API_KEY = config['open_webui']['api_key']
-BASE_URL = config['open_webui']['location']
-
-# Constants
-CONFIG_PATH = './config/config.yaml'
-QUESTIONS_FOLDER = './questions'
-ANSWERS_FOLDER = './answers'
-
 n_questions = 0
 n_models = 0
 
-def load_models(config_path, verbose):
-    """Load model names from a YAML configuration file."""
-    try:
-        with open(config_path, 'r', encoding="utf-8") as file:
-            config = yaml.safe_load(file)
-        models = config.get('selected_models', [])
-        n_models = len(models)
-        if verbose:
-            print(f"Loaded {n_models} models: {models}")
-            
+# Per-model concurrency limits for the workers
+model_limits = {}
 
-        return models
-    except Exception as e:
-        print(f"Error loading models from config: {e}")
-        return []
+# Result of a task whose pair was claimed by another process (see sharding)
+SKIPPED = object()
+# Result of a task not sent because of the budget (see costs)
+OVER_BUDGET = object()
 
-def read_question(file_name, verbose, q, n_questions):
-    """Read the question from the specified file."""
-    try:
-        with open(file_name, 'r', encoding="utf-8") as file:
-            question = file.read().strip()
-        if verbose:
-            print("*-*-*-*-*-*-*-*-*")
-            print(f"Question {q}/{n_questions} read from '{file_name}'")
-            #print(f"{question}")
-            
-        return question
-    except FileNotFoundError:
-        print(f"Error: The file {file_name} was not found.")
-        return None
+# Token and cost totals of the run
+cost_tracker = None
 
-def format_token(token):
-    """Ensure token is in the correct format."""
-    if not token.startswith('sk-'):
-        token = f'sk-{token}'
-    return token
+def load_models(verbose):
+    """Load the selected model names from the configuration."""
+    models = config_store.config().get('selected_models', []) or []
+    n_models = len(models)
+    if verbose:
+        print(f"Loaded {n_models} models: {models}")
+        
 
-def generate_answer(question, model_name, verbose):
-    """Generate an answer using a model hosted on Open WebUI."""
-    if not question:
-        print("No question to process.")
+    return models
+
+def read_question(q_name, verbose, q, n_questions):
+    """Read the question from the storage."""
+    question = storage.get_storage().load_question(q_name)
+    if question is None:
+        print(f"Error: The question {q_name} was not found.")
         return None
+    question = question.strip()
+    if verbose:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Question {q}/{n_questions} read: '{q_name}'")
+        #print(f"{question}")
+        
+    return question
 
-    # Format token and prepare request
-    token = format_token(API_KEY)
-    url = f"{BASE_URL}/api/chat/completions"
-    
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
-    
+def build_payload(question, model_name, options=None):
+    """Build the chat completion request sent to the model, with the sampling `options` (temperature, seed)."""
     if any(name in model_name.lower() for name in MODELS_SUPPORTING_CITATIONS):
         payload = {
             'model': model_name,
@@ -88,6 +70,91 @@ def generate_answer(question, model_name, verbose):
         'messages': [{'role': 'user', 'content': question}],
         'stream': False,
         }
+    payload.update(options or {})
+    return payload
+
+def sample_options(options, sample):
+    """The options of one sample: each sample gets its own seed."""
+    options = dict(options or {})
+    if options.get('seed') is not None:
+        options['seed'] = options['seed'] + sample
+    return options
+
+def pair_hash(question, model_name, options, n_samples):
+    """Hash of what a stored answer was asked with, samples included."""
+    payload = build_payload(question, model_name, options)
+    if n_samples > 1:
+        payload['samples'] = n_samples
+    return request_hash(payload)
+
+def request_hash(payload):
+    """Hash the question text, model id and options of a request.
+
+    The transport option 'stream' does not change the answer and is left out.
+    """
+    options = {key: value for key, value in payload.items() if key != 'stream'}
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+
+def read_streamed_completion(response, started, verbose):
+    """Rebuild a chat completion from the server-sent events of a streamed one.
+
+    Returns the completion and the time to its first content token.
+    """
+    completion = {'object': 'chat.completion'}
+    content = []
+    role = 'assistant'
+    finish_reason = None
+    first_token_at = None
+    for line in owui_client.iter_lines(response):
+        if not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            break
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            if verbose:
+                print(f"Ignoring unreadable stream chunk: {data}")
+            continue
+        if 'error' in chunk:
+            raise ValueError(f"Error in streamed response: {chunk['error']}")
+        for key in ('id', 'created', 'model', 'usage', 'citations'):
+            if chunk.get(key):
+                completion[key] = chunk[key]
+        for choice in chunk.get('choices') or []:
+            delta = choice.get('delta') or {}
+            role = delta.get('role', role)
+            if delta.get('content'):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                content.append(delta['content'])
+            finish_reason = choice.get('finish_reason') or finish_reason
+    completion.setdefault('created', int(time.time()))
+    completion['choices'] = [{
+        'index': 0,
+        'message': {'role': role, 'content': ''.join(content)},
+        'finish_reason': finish_reason,
+    }]
+    ttft = first_token_at - started if first_token_at is not None else None
+    return completion, ttft, len(content)
+
+def generate_answer(question, model_name, verbose, stream=False, options=None):
+    """Generate an answer using a model hosted on Open WebUI.
+
+    Time to first token (streaming only), total latency, output tokens/sec
+    and cost are stored under the 'harness' key of the returned response.
+    Raises costs.BudgetExceeded, without sending it, when the request would
+    exceed the budget of the run.
+    """
+    if not question:
+        print("No question to process.")
+        return None
+
+    # Prepare request; the shared client carries the authorization headers
+    url = owui_client.api_url('/api/chat/completions')
+    payload = build_payload(question, model_name, options)
+    payload['stream'] = stream
 
     if verbose:
         print("*-*-*-*-*-*-*-*-*")
@@ -97,8 +164,19 @@ def generate_answer(question, model_name, verbose):
         print(f"Payload: {json.dumps(payload, indent=2)}")
         
 
-    try:
-        response = requests.post(url, headers=headers, json=payload)
+    def send_request():
+        """Send the request once; returns the response data, status, start time, TTFT and chunk count."""
+        started = time.perf_counter()
+        if stream:
+            with owui_client.post_stream('/api/chat/completions', payload) as response:
+                if verbose:
+                    print("*-*-*-*-*-*-*-*-*")
+                    print(f"Response status: {response.status_code}")
+                    print(f"Response headers: {dict(response.headers)}")
+                owui_client.check_status(response)
+                response_data, ttft, n_chunks = read_streamed_completion(response, started, verbose)
+            return response_data, response.status_code, started, ttft, n_chunks
+        response = owui_client.post('/api/chat/completions', payload)
         
         if verbose:
             print("*-*-*-*-*-*-*-*-*")
@@ -106,8 +184,36 @@ def generate_answer(question, model_name, verbose):
             print(f"Response headers: {dict(response.headers)}")
             
 
-        response.raise_for_status()
-        response_data = response.json()
+        owui_client.check_status(response)
+        return response.json(), response.status_code, started, None, None
+
+    reserved = cost_tracker.reserve(model_name, question) if cost_tracker is not None else 0.0
+    started = time.perf_counter()
+    status = None
+    retries = 0
+    try:
+        # Rate limited per provider; 429, 5xx and connection errors are retried
+        (response_data, status, started, ttft, n_chunks), retries = scheduler.call_with_retries(model_name, send_request, verbose)
+        latency = time.perf_counter() - started
+
+        # Without usage in the response, count the streamed chunks instead
+        output_tokens = (response_data.get('usage') or {}).get('completion_tokens', n_chunks)
+        generation_time = latency - ttft if ttft is not None else latency
+        request_cost = None
+        if cost_tracker is not None:
+            request_cost = cost_tracker.record(model_name, response_data.get('usage'), question, output_tokens, reserved)
+        response_data['harness'] = {
+            'stream': stream,
+            'status': status,
+            'retries': retries,
+            'ttft': ttft,
+            'latency': latency,
+            'output_tokens': output_tokens,
+            'tokens_per_sec': output_tokens / generation_time if output_tokens and generation_time > 0 else None,
+            'cost': request_cost,
+        }
+        perf_metrics.record_request(model_name, status, latency, True, response_data.get('usage'), ttft,
+                                    response_data['harness']['tokens_per_sec'], retries, stream=stream, cost=request_cost)
         
         if verbose:
             print("*-*-*-*-*-*-*-*-*")
@@ -117,10 +223,13 @@ def generate_answer(question, model_name, verbose):
         return response_data
 
     except requests.exceptions.HTTPError as e:
+        status = e.response.status_code
+        retries = getattr(e, 'retries', 0)
         print(f"HTTP error occurred: {e.response.text}")
         if verbose:
             print(f"Full error details: {e}")
     except requests.exceptions.RequestException as e:
+        retries = getattr(e, 'retries', 0)
         print(f"Request error: {e}")
         if verbose:
             print(f"Full error details: {e}")
@@ -128,42 +237,117 @@ def generate_answer(question, model_name, verbose):
         print(f"An error occurred: {e}")
         if verbose:
             print(f"Full error details: {e}")
+    if cost_tracker is not None:
+        cost_tracker.release(reserved)
+    perf_metrics.record_request(model_name, status, time.perf_counter() - started, False, retries=retries, stream=stream)
     return None
 
-def write_answers(file_name, answers, verbose):
-    """Write the collected answers to a specified file as JSON."""
+def list_question_files(selected_questions, verbose):
+    """List the question files to process, honouring the selected questions."""
+    question_files = []
+    for q_name in storage.get_storage().list_questions():
+        # Check if this question is listed in the YAML file, if it exists
+        if selected_questions is not None and q_name not in selected_questions:
+            if verbose:
+                print(f"Skipping question '{q_name}' as it is not listed in selected questions")
+            continue
+        question_files.append(f"{q_name}.q")
+    return question_files
+
+def answer_question(q_file, question, q, n_questions, model_name, n, n_models, verbose, stream=False, options=None, sample=0, n_samples=1):
+    """Generate one answer (one sample of it with `n_samples` > 1) of a model to a question."""
+    label = f" (sample {sample + 1}/{n_samples})" if n_samples > 1 else ""
+    if verbose:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Processing question {q}/{n_questions}: {q_file} with model {n}/{n_models}:'{model_name}'{label}")
+
+    options = sample_options(options, sample)
+    # Generate the new answer within the per-model concurrency limit
+    with model_limits[model_name]:
+        answer = generate_answer(question, model_name, verbose, stream, options)
+    if answer is None:
+        print(f"No answer generated for question {q}-'{q_file}' with model {n} '{model_name}'{label}.")
+        return None
+    answer.setdefault('harness', {})['request_hash'] = request_hash(build_payload(question, model_name, options))
+    return answer
+
+def save_answer(q_file, question, q, n_questions, model_name, n, n_models, verbose, options, samples, store=None):
+    """Save the answer of a model to a question, all its samples under the model key.
+
+    A single sample is saved as is. Several samples are saved as the first
+    one, so that a reader of a single answer finds it as usual, with the
+    list of all of them under 'samples'. When a sample failed, the others
+    are saved but the pair will be asked again on the next run.
+    """
+    q_name = os.path.splitext(q_file)[0]
+    answers = [answer for answer in samples if answer is not None]
+    if not answers:
+        return False
+    if len(samples) == 1:
+        answer = answers[0]
+    else:
+        answer = dict(answers[0])
+        answer['harness'] = dict(answers[0].get('harness') or {})
+        answer['harness']['request_hash'] = pair_hash(question, model_name, options, len(samples)) if len(answers) == len(samples) else None
+        answer['samples'] = answers
+        if len(answers) < len(samples):
+            print(f"Only {len(answers)}/{len(samples)} samples generated for question {q}-'{q_file}' with model {n} '{model_name}', saving them anyway.")
+
+    # Append this model's answer only; the answers of the other models
+    # are left untouched until the file is compacted
+    store = store or storage.get_storage()
     try:
-        with open(file_name, 'w', encoding="utf-8") as file:
-            json.dump(answers, file, indent=2)
+        store.append_answer(q_name, model_name, answer)
         if verbose:
             print("*-*-*-*-*-*-*-*-*")
-            print(f"Answers written to '{file_name}'")
-            
+            print(f"Saved answer for question {q}/{n_questions}-'{q_file}' with model {n}/{n_models}-'{model_name}' in '{store.answers_location(q_name)}'")
     except Exception as e:
-        print(f"Error writing answers to file '{file_name}': {e}")
+        print(f"Error writing answer to '{store.answers_location(q_name)}': {e}")
+        return False
+    return True
 
-def process_question_files(verbose):
-    """Process all question files with all models."""
-    os.makedirs(ANSWERS_FOLDER, exist_ok=True)
+def process_question_files(verbose, workers=1, per_model=0, force=False, stream=False, progress=False, samples=1, options=None,
+                           shard=None, queue=None, output=None, budget=None, estimate=False):
+    """Process all question files with all models.
 
+    Each model is asked `samples` times per question, with the sampling
+    `options` (temperature, seed) when given; the samples run in parallel
+    like separate requests.
 
-    # Load the list of selected questions from the YAML file
-    config_yaml_path = './config/selected_questions.yaml'
-    try:
-        with open(config_yaml_path, 'r', encoding='utf-8') as stream:
-            selected_questions = yaml.safe_load(stream) or []
-            n_questions = len(selected_questions)
-            if verbose:
-                print("*-*-*-*-*-*-*-*-*")
-                print(f"There are {n_questions} questions loaded : {selected_questions}")
-                
-    except (FileNotFoundError, yaml.YAMLError) as e:
+    Up to `workers` requests run at once, and at most `per_model` of them
+    target the same model (0 means no per-model limit). A model whose stored
+    answer was obtained with the same question text and request options is
+    not asked again, unless `force` is set. With `progress`, a progress line
+    for the web interface is printed after each pair (see job_runner).
+
+    In a sharded run (see sharding), only the pairs of the `shard` are
+    processed, each pair is first claimed from the `queue` when given, and
+    the answers are written to the `output` folder instead of the storage.
+
+    The tokens and cost of the requests are counted (see costs): no new
+    request is sent once the next one would exceed the `budget` (default:
+    from the configuration). With `estimate`, nothing is sent: the tokens
+    and cost of the requests to send are estimated and printed.
+    """
+    global cost_tracker
+    store = storage.get_storage()
+    writer = output or store
+
+    if not estimate and config_store.connect_owui() is None:
+        print(f"No Open WebUI connection settings found in {config_store.CONNECT_OWUI_PATH}, save them from app-setup-questions.py first.")
+        return
+
+    # Load the list of selected questions
+    selected_questions = config_store.selected_questions()
+    if selected_questions is not None:
         if verbose:
-            print(f"YAML file not found or error reading YAML file: {e}. Defaulting to all questions.")
-        selected_questions = None
+            print("*-*-*-*-*-*-*-*-*")
+            print(f"There are {len(selected_questions)} questions loaded : {selected_questions}")
+    elif verbose:
+        print(f"No question selection in {config_store.SELECTED_QUESTIONS_PATH}. Defaulting to all questions.")
 
     # Load models
-    models = load_models(CONFIG_PATH, verbose)
+    models = load_models(verbose)
     n_models = len(models)
     if not models:
         print("No models found in configuration.")
@@ -171,76 +355,175 @@ def process_question_files(verbose):
 
     if verbose:
         print("*-*-*-*-*-*-*-*-*")
-        print(f"Looking for questions in: {QUESTIONS_FOLDER}")
-        print(f"Will save answers in: {ANSWERS_FOLDER}")
+        print(f"Reading questions from {store.describe()} and saving answers in: {writer.describe()}")
         
 
-    # Process each model
-    n=0
+    question_files = list_question_files(selected_questions, verbose)
+    n_questions = len(question_files)
+
+    workers = max(1, workers)
+    owui_client.configure(pool_size=workers)
+    per_model = per_model if per_model > 0 else workers
     for model_name in models:
-        n=n+1
-        if verbose:
-            print("*-*-*-*-*-*-*-*-*")
-            print(f"Processing all {n_questions} questions for model {n}/{n_models}:'{model_name}'")
-            
+        model_limits[model_name] = threading.BoundedSemaphore(per_model)
 
-        # Process each question file
-        q=0
-        for q_file in os.listdir(QUESTIONS_FOLDER):
-            
-            if q_file.endswith('.q'):
-                q_name = os.path.splitext(q_file)[0]
-		# Check if this question is listed in the YAML file, if it exists
-                if selected_questions is not None and q_name not in selected_questions:
-                    if verbose:
-                        print(f"Skipping question '{q_name}' as it is not listed in selected questions")
-                    continue
-                q=q+1
+    # Answers of an interrupted sharded run, not merged yet
+    output_hashes = output.request_hashes() if output is not None and not force else {}
+
+    # Interleave the models so that concurrent workers spread over providers
+    tasks = []
+    n_skipped = 0
+    n_other_shards = 0
+    for q, q_file in enumerate(question_files, start=1):
+        question = read_question(os.path.splitext(q_file)[0], verbose, q, n_questions)
+        if not question:
+            continue
+        existing_answers = {}
+        if not force:
+            try:
+                existing_answers = store.load_answers(os.path.splitext(q_file)[0])
+            except Exception as e:
+                print(f"Error loading existing answers for '{q_file}': {e}")
+        for n, model_name in enumerate(models, start=1):
+            q_name = os.path.splitext(q_file)[0]
+            if not sharding.in_shard(sharding.unit_key(q_name, model_name), shard):
+                n_other_shards = n_other_shards + 1
+                continue
+            stored_hash = existing_answers.get(model_name, {}).get('harness', {}).get('request_hash')
+            if output_hashes.get((q_name, model_name), stored_hash) == pair_hash(question, model_name, options, samples):
+                n_skipped = n_skipped + 1
                 if verbose:
-                    print("*-*-*-*-*-*-*-*-*")
-                    print(f"Processing question {q}/{n_questions}: {q_file}")
-                    
-                q_path = os.path.join(QUESTIONS_FOLDER, q_file)
-                question = read_question(q_path, verbose,q,n_questions)
-
-                if question:
-                    output_file = os.path.join(ANSWERS_FOLDER, f"{os.path.splitext(q_file)[0]}.a")
-
-                    # Load existing answers if any
-                    existing_answers = {}
-                    if os.path.exists(output_file):
-                        try:
-                            with open(output_file, 'r', encoding="utf-8") as file:
-                                existing_answers = json.load(file)
-                            if verbose:
-                                print("*-*-*-*-*-*-*-*-*")
-                                print(f"Loaded existing answers from other models for question {q}/{n_questions} from {output_file}")
-                                
-                        except Exception as e:
-                            print(f"Error loading existing answers from '{output_file}': {e}")
-
-                    # Generate and save new answer
-                    answer = generate_answer(question, model_name, verbose)
-                    if answer is not None:
-                        existing_answers[model_name] = answer
-                        if verbose:
-                            print("*-*-*-*-*-*-*-*-*")
-                            print(f"Saving answers for question {q}/{n_questions}-'{q_file}' with model {n}/{n_models}-'{model_name}'")
-                            
-                        write_answers(output_file, existing_answers, verbose)
-                    else:
-                        print(f"No answer generated for question {q}-'{q_file}' with model {n} '{model_name}'.")
+                    print(f"Skipping question {q}/{n_questions}-'{q_file}' with model {n}/{n_models}-'{model_name}': already answered")
+                continue
+            for sample in range(samples):
+                tasks.append((q_file, question, q, n_questions, model_name, n, n_models, verbose, stream, options, sample, samples))
+    n_tasks = len(tasks)
+
+    if verbose:
+        print("*-*-*-*-*-*-*-*-*")
+        sampling = f", {samples} samples each" if samples > 1 else ""
+        print(f"Processing {n_tasks // samples} question/model pairs ({n_skipped} already answered{sampling}) for {n_questions} questions and {n_models} models with {workers} workers ({per_model} per model)")
+        if shard is not None:
+            print(f"Shard {shard[0]}/{shard[1]}: {n_other_shards} pairs are left to the other shards")
+
+    if estimate:
+        costs.print_estimate([(task[4], task[1]) for task in tasks], 'compare', budget)
+        return
+    cost_tracker = costs.CostTracker('compare', budget)
+
+    # In queue mode, a pair is claimed when its first sample starts, so that
+    # the processes sharing the queue pick the pairs one at a time
+    claims = {}
+    claims_lock = threading.Lock()
+
+    def run_task(task):
+        if queue is not None:
+            key = sharding.unit_key(os.path.splitext(task[0])[0], task[4])
+            with claims_lock:
+                if key not in claims:
+                    claims[key] = queue.claim(key)
+            if not claims[key]:
+                return SKIPPED
+        try:
+            return answer_question(*task)
+        except costs.BudgetExceeded:
+            return OVER_BUDGET
+
+    done = 0
+    n_over_budget = 0
+    # The samples of each pair, until they are all there and the answer is saved
+    pair_samples = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_task, task): task for task in tasks}
+        for future in as_completed(futures):
+            done = done + 1
+            task = futures[future]
+            try:
+                answer = future.result()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                answer = None
+            if answer is OVER_BUDGET:
+                n_over_budget = n_over_budget + 1
+                answer = None
+            received = pair_samples.setdefault((task[0], task[4]), [None] * samples)
+            received[task[10]] = answer if answer is not None else False
+            if all(sample is not None for sample in received):
+                del pair_samples[(task[0], task[4])]
+                if any(sample is SKIPPED for sample in received):
+                    if verbose:
+                        print(f"Skipping question {task[2]}/{n_questions}-'{task[0]}' with model {task[5]}/{n_models}-'{task[4]}': claimed by another process")
+                else:
+                    saved = save_answer(*task[:8], options, [sample or None for sample in received], writer)
+                    if queue is not None:
+                        key = sharding.unit_key(os.path.splitext(task[0])[0], task[4])
+                        if saved:
+                            queue.complete(key)
+                        else:
+                            queue.release(key)
+            if verbose:
+                print("*-*-*-*-*-*-*-*-*")
+                print(f"Completed {done}/{n_tasks} requests")
+                print(f"Running totals: {cost_tracker.summary()}")
+            if progress:
+                job_runner.emit_progress(done=done, total=n_tasks, fraction=done / n_tasks,
+                                         question=task[2], n_questions=n_questions, question_name=task[0],
+                                         model=task[5], n_models=n_models, model_name=task[4],
+                                         costs=cost_tracker.totals())
+
+    if cost_tracker.requests or n_over_budget:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Run totals: {cost_tracker.summary()}")
+        if n_over_budget:
+            print(f"{n_over_budget} requests not sent because of the budget; they will be sent on the next run")
+
+    if output is not None:
+        print(f"Answers saved in {output.folder}; run 'python app-shards.py merge' once every shard is done")
+        return
+
+    # Fold the answers logged during the run into the answers files, with a
+    # single write per question
+    for q_file in question_files:
+        q_name = os.path.splitext(q_file)[0]
+        try:
+            if store.compact(q_name) and verbose:
+                print("*-*-*-*-*-*-*-*-*")
+                print(f"Answers written to '{store.answers_location(q_name)}'")
+        except Exception as e:
+            print(f"Error writing answers to '{store.answers_location(q_name)}': {e}")
 
 def main():
     parser = argparse.ArgumentParser(description="Process question files and generate complete responses.")
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of requests sent concurrently (default: 1)')
+    parser.add_argument('--per-model', type=int, default=0, help='Maximum concurrent requests per model (default: same as --workers)')
+    parser.add_argument('--stream', action='store_true', help='Stream the answers to measure the time to first token and tokens/sec')
+    parser.add_argument('--force', action='store_true', help='Ask every model again, even for questions it already answered')
+    parser.add_argument('--progress', action='store_true', help='Print machine-readable progress lines for the web interface')
+    parser.add_argument('--samples', type=int, default=1, help='Number of independent answers asked to each model per question (default: 1)')
+    parser.add_argument('--temperature', type=float, default=None, help="Sampling temperature sent to the models (default: the model's)")
+    parser.add_argument('--seed', type=int, default=None, help='Seed sent to the models; sample i gets seed + i (default: none)')
+    parser.add_argument('--shard', type=sharding.parse_shard, default=None, help='Only process the question/model pairs of shard i of N (i/N)')
+    parser.add_argument('--queue', action='store_true', help='Claim the question/model pairs one by one from the work queue of --work-dir')
+    parser.add_argument('--work-dir', default=sharding.DEFAULT_WORK_DIR, help=f'Shared folder of the sharded runs (default: {sharding.DEFAULT_WORK_DIR})')
+    parser.add_argument('--lease-seconds', type=int, default=sharding.LEASE_SECONDS, help=f'Age after which the claim of a dead process is taken over (default: {sharding.LEASE_SECONDS})')
+    parser.add_argument('--budget', type=float, default=None, help='Cost cap of the run: no new request is sent once it would be exceeded (default: costs.budget.compare in config.yaml)')
+    parser.add_argument('--estimate', action='store_true', help='Only print the estimated tokens and cost of the requests to send, without sending them')
     #parser.add_argument('--token', required=True, help='API token for authentication')
     
     args = parser.parse_args()
     
     # Process all questions
     #process_question_files(args.token, args.verbose)
-    process_question_files(args.verbose)
+    options = {key: value for key, value in (('temperature', args.temperature), ('seed', args.seed)) if value is not None}
+    queue = output = None
+    if args.shard is not None or args.queue:
+        worker = sharding.worker_id(args.shard)
+        output = sharding.ShardOutput(args.work_dir, worker)
+        if args.queue:
+            queue = sharding.WorkQueue(args.work_dir, worker, args.lease_seconds)
+    process_question_files(args.verbose, args.workers, args.per_model, args.force, args.stream, args.progress,
+                           max(1, args.samples), options, args.shard, queue, output, args.budget, args.estimate)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
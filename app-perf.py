@@ -0,0 +1,37 @@
+import argparse
+import datetime
+import perf_metrics
+
+def main(verbose=False, last_run=False, since=None):
+    """Aggregate the request records of app-compare.py into a per-model performance report."""
+    records = perf_metrics.load_records(since=since)
+    if last_run:
+        records = perf_metrics.load_records(run=perf_metrics.last_run(records))
+    if verbose:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Loaded {len(records)} request records from {perf_metrics.REQUESTS_LOG}")
+    if not records:
+        print("No request records found, run app-compare.py first.")
+        return
+
+    rows = perf_metrics.aggregate(records)
+    perf_metrics.write_report(rows)
+
+    print(f"{'Model':40} {'Req':>6} {'Err%':>6} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} {'TTFT s':>8} {'tok/s':>8} {'Cost':>10}")
+    for row in rows:
+        cells = [row['latency_p50'], row['latency_p90'], row['latency_p99'], row['ttft_p50'], row['tokens_per_sec'], row['cost']]
+        cells = ['-' if cell is None else cell for cell in cells]
+        print(f"{row['model'][:40]:40} {row['requests']:>6} {row['error_rate'] * 100:>6.1f} "
+              f"{cells[0]:>8} {cells[1]:>8} {cells[2]:>8} {cells[3]:>8} {cells[4]:>8} {cells[5]:>10}")
+    if verbose:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Report saved in {perf_metrics.REPORT_CSV} and {perf_metrics.REPORT_JSON}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the per-model latency and throughput report.")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Enable verbose mode")
+    parser.add_argument('--last-run', action='store_true', help="Only use the requests of the last app-compare.py run")
+    parser.add_argument('--since', help="Only use the requests made since this date (YYYY-MM-DD)")
+    args = parser.parse_args()
+    since = datetime.datetime.strptime(args.since, '%Y-%m-%d').timestamp() if args.since else None
+    main(verbose=args.verbose, last_run=args.last_run, since=since)
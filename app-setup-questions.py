@@ -1,231 +1,79 @@
 from flask import Flask, render_template, request, redirect, url_for, Response
 import json
 import os
-import yaml
 import requests
-import subprocess
-import time
+import owui_client
+import storage
+import config_store
+import model_catalog
+import perf_metrics
+import job_runner
+import search_index
 
 app = Flask(__name__)
 
-# Ensure directories exist for storing files
-os.makedirs('./questions', exist_ok=True)
-os.makedirs('./targets', exist_ok=True)
-os.makedirs('./answers', exist_ok=True)
-os.makedirs('./config', exist_ok=True)
+# The runs of app-compare.py and app-anal.py launched from the web interface
+jobs = job_runner.JobManager()
+# The models offered by Open WebUI, cached between page loads
+catalog = model_catalog.ModelCatalog()
+# Full-text index of the questions, targets, answers and analyses
+search = search_index.SearchIndex()
 
-def load_connect_owui(file_path):
-    with open(file_path, 'r', encoding="utf-8") as file:
-        return yaml.safe_load(file)
+def load_connect_owui():
+    return config_store.connect_owui() or {}
 
-# Configuration paths and settings
-CONFIG_PATH = './config/config.yaml'
-config_file = './config/connect-owui.yaml'
-config = load_connect_owui(config_file)
-API_KEY = config['open_webui']['api_key']
-BASE_URL = config['open_webui']['location']
-API_URL = f"{BASE_URL}/api/models"
-
-def save_connect_owui(config, file_path):
-    with open(file_path, 'w') as file:
-        yaml.dump(config, file)
+def save_connect_owui(config):
+    config_store.save(config_store.CONNECT_OWUI_PATH, config)
 
 
 # Question management functions
 def save_question(nom_question, question_content):
-    question_path = f'./questions/{nom_question}.q'
-    with open(question_path, 'w', encoding="utf-8") as file:
-        file.write(question_content)
+    storage.get_storage().save_question(nom_question, question_content)
 
 def save_target(nom_question, target_data):
-    target_path = f'./targets/{nom_question}.t'
-    with open(target_path, 'w', encoding="utf-8") as file:
-        json.dump(target_data, file, indent=4)
+    storage.get_storage().save_target(nom_question, target_data)
 
 def load_question(nom_question):
-    question_path = f'./questions/{nom_question}.q'
-    if os.path.exists(question_path):
-        with open(question_path, 'r', encoding="utf-8") as file:
-            return file.read()
-    return None
+    return storage.get_storage().load_question(nom_question)
 
 def load_target(nom_question):
-    target_path = f'./targets/{nom_question}.t'
-    if os.path.exists(target_path):
-        with open(target_path, 'r', encoding="utf-8") as file:
-            return json.load(file)
-    return None
+    return storage.get_storage().load_target(nom_question)
 
 def save_selected_questions(selected_questions):
-    config_path = './config/selected_questions.yaml'
-    with open(config_path, 'w', encoding='utf-8') as file:
-        yaml.dump(selected_questions, file)
+    config_store.save(config_store.SELECTED_QUESTIONS_PATH, selected_questions)
 
 def load_selected_questions():
-    config_yaml_path = './config/selected_questions.yaml'
-    try:
-        with open(config_yaml_path, 'r', encoding='utf-8') as stream:
-            return yaml.safe_load(stream) or []
-    except (FileNotFoundError, yaml.YAMLError):
-        return []
+    return config_store.selected_questions() or []
 
 def list_questions():
-    return [f[:-2] for f in os.listdir('./questions') if f.endswith('.q')]
+    return storage.get_storage().list_questions()
 
 def save_manual_answer(question_name, answer_content, source):
-    answer_path = f'./answers/{question_name}.a'
-    manual_entry = {source: {'choices': [{'message': {'content': answer_content}}]}}
-    existing_answers = {}
-    if os.path.exists(answer_path):
-        with open(answer_path, 'r', encoding='utf-8') as file:
-            existing_answers = json.load(file)
-    existing_answers.update(manual_entry)
-    with open(answer_path, 'w', encoding='utf-8') as file:
-        json.dump(existing_answers, file, indent=2)
+    manual_entry = {'choices': [{'message': {'content': answer_content}}]}
+    storage.get_storage().append_answer(question_name, source, manual_entry)
 
 # Model management functions
 def fetch_models():
-    config = load_connect_owui(config_file)
-    API_KEY = config['open_webui']['api_key']
-    BASE_URL = config['open_webui']['location']
-    API_URL = f"{BASE_URL}/api/models"
-
-    if test_connection(True):
-        headers = {'Authorization': f'Bearer {API_KEY}'}
-        response = requests.get(API_URL, headers=headers)
-        if response.status_code == 200:
-            try:
-                response_data = response.json()
-                models_data = response_data.get('data', [])
-                models_data.sort(key=lambda x: x.get('name', ''))
-                enriched_models = []
-                for model in models_data:
-                    # Base model information
-                    enriched_model = {
-                        'id': model.get('id', 'Unknown'),
-                        'name': model.get('name', model.get('id', 'Unnamed Model')),
-                        'owned_by': model.get('owned_by', 'Unknown'),
-                        'created': model.get('created', 0),
-                        'details': {}  # Initialize details dictionary
-                    }
-                    # Detailed description and capabilities
-                    if 'info' in model and 'meta' in model['info']:
-                        meta = model['info']['meta']
-                        enriched_model['description'] = meta.get('description', '')
-                        enriched_model['profile_image'] = meta.get('profile_image_url', '')
-                    # Ollama-specific details
-                    if 'ollama' in model:
-                        ollama_details = model['ollama'].get('details', {})
-                        enriched_model['model_type'] = 'Ollama'
-                        enriched_model['details'] = {
-                            'format': ollama_details.get('format', 'Unknown'),
-                            'family': ollama_details.get('family', 'Unknown'),
-                            'parameter_size': ollama_details.get('parameter_size', 'Unknown'),
-                            'quantization_level': ollama_details.get('quantization_level', 'Unknown')
-                        }
-                        enriched_model['size'] = model['ollama'].get('size', 0)
-                        enriched_model['modified_at'] = model['ollama'].get('modified_at', '')
-                    # OpenAI-specific details
-                    elif 'openai' in model:
-                        enriched_model['model_type'] = 'OpenAI'
-                        openai_details = model['openai']
-                        enriched_model['details'] = {
-                            'family': 'GPT',
-                            'parameter_size': 'Variable'
-                        }
-                        enriched_model['openai_details'] = {
-                            'id': openai_details.get('id', ''),
-                            'object': openai_details.get('object', ''),
-                            'owned_by': openai_details.get('owned_by', '')
-                        }
-                    # Google-specific details
-                    elif 'Google' in enriched_model['name']:
-                        enriched_model['model_type'] = 'Google'
-                        enriched_model['details'] = {
-                            'family': 'Gemini/PaLM',
-                            'parameter_size': 'Variable'
-                        }
-                    # Perplexity-specific details
-                    elif 'perplexity' in enriched_model['name']:
-                        enriched_model['model_type'] = 'Perplexity'
-                        enriched_model['details'] = {
-                            'family': 'Perplexity',
-                            'parameter_size': 'Variable'
-                        }                     
-                    # Anthropic-specific details
-                    elif 'anthropic' in enriched_model['name'].lower() or 'claude' in enriched_model['name'].lower():
-                        enriched_model['model_type'] = 'Anthropic'
-                        enriched_model['details'] = {
-                            'family': 'Claude',
-                            'parameter_size': 'Variable'
-                        }
-                    # Mistral-specific details
-                    elif 'mistral' in enriched_model['name'].lower():
-                        enriched_model['model_type'] = 'Mistral'
-                        enriched_model['details'] = {
-                            'family': 'Mistral',
-                            'parameter_size': 'Variable'
-                        }
-                    enriched_models.append(enriched_model)
-                return enriched_models
-            except ValueError as e:
-                print(f"Error parsing JSON: {e}")
-                return ["{e}"]
-        else:
-            print(f"Failed to fetch models: {response.content}")
-            return ["{response.content}"]
-    else:
-        print(f"Failed to fetch models: connection to API failed")
-        return []
+    models, _ = catalog.get()
+    return models
 
 def load_analysis_config():
-    if os.path.exists(CONFIG_PATH):
-        with open(CONFIG_PATH, 'r', encoding="utf-8") as file:
-            try:
-                return yaml.safe_load(file) or {}
-            except yaml.YAMLError:
-                print("Error reading YAML configuration")
-                return {}
-    return {}
+    return config_store.config()
 
 def save_analysis_model(selected_model):
-    current_config = load_analysis_config()
-    current_config['analysis_model'] = selected_model
-    with open(CONFIG_PATH, 'w', encoding="utf-8") as file:
-        yaml.dump(current_config, file)
+    config_store.update(config_store.CONFIG_PATH, analysis_model=selected_model)
 
 def load_selected_models():
-    """Load selected models from the YAML configuration file."""
-    if os.path.exists(CONFIG_PATH):
-        with open(CONFIG_PATH, 'r', encoding="utf-8") as file:
-            try:
-                config = yaml.safe_load(file)
-                return config.get("selected_models", [])
-            except yaml.YAMLError:
-                print("Error reading YAML configuration")
-                return []
-    return []
+    """Load selected models from the configuration."""
+    return config_store.config().get("selected_models", []) or []
 
 def save_to_yaml(selected_models):
-    """Save the updated list of selected models to a YAML file, preserving existing configurations."""
-    # Load the existing configuration
-    current_config = {}
-    if os.path.exists(CONFIG_PATH):
-        with open(CONFIG_PATH, 'r', encoding="utf-8") as file:
-            try:
-                current_config = yaml.safe_load(file) or {}
-            except yaml.YAMLError:
-                print("Error reading YAML configuration")
-    # Update the selected models
-    current_config['selected_models'] = selected_models
-    # Write the updated configuration back to the YAML file
-    with open(CONFIG_PATH, 'w', encoding="utf-8") as file:
-        yaml.dump(current_config, file)
+    """Save the updated list of selected models, preserving existing configurations."""
+    config_store.update(config_store.CONFIG_PATH, selected_models=selected_models)
 
 # Routes
 @app.route('/')
 def index():
-    config = load_connect_owui(config_file)
     return render_template('index_q.html')
 
 @app.route('/select_comparator', methods=['GET', 'POST'])
@@ -247,7 +95,7 @@ def add_q():
         reponse_cible = request.form.get('reponse_cible')
         infos_cruciales = request.form.get('infos_cruciales')
         infos_a_eviter = request.form.get('infos_a_eviter')
-        if not nom_question or ' ' in nom_question:
+        if not storage.valid_question_name(nom_question):
             return "Nom de la question doit être un seul mot", 400
         save_question(nom_question, question_content)
         target_data = {
@@ -259,57 +107,58 @@ def add_q():
         return redirect(url_for('add_q'))
     return render_template('add_q.html')
 
+# The question pages load the questions page by page from the JSON API below
 @app.route('/questions')
 def questions():
-    question_files = os.listdir('./questions')
-    questions = []
-    for filename in question_files:
-        nom_question = filename.split('.')[0]
-        question_content = load_question(nom_question)
-        target_data = load_target(nom_question)
-        first_paragraph = question_content.split('\n')[0] if question_content else ''
-        questions.append({
-            'nom_question': nom_question,
-            'question_content': question_content,
-            'target_data': target_data,
-            'first_paragraph': first_paragraph
-        })
-    questions.sort(key=lambda x: x['nom_question'].lower())
-    return render_template('questions.html', questions=questions)
+    return render_template('questions.html')
 
 @app.route('/delquestion')
 def delquestion():
-    question_files = os.listdir('./questions')
-    questions = []
-    for filename in question_files:
-        nom_question = filename.split('.')[0]
-        question_content = load_question(nom_question)
-        target_data = load_target(nom_question)
-        first_paragraph = question_content.split('\n')[0] if question_content else ''
-        questions.append({
-            'nom_question': nom_question,
-            'question_content': question_content,
-            'target_data': target_data,
-            'first_paragraph': first_paragraph
-        })
-    questions.sort(key=lambda x: x['nom_question'].lower())
-    return render_template('delquestion.html', questions=questions)
+    return render_template('delquestion.html')
 
 @app.route('/edit', methods=['GET'])
 def edit():
-    question_files = os.listdir('./questions')
-    questions = []
-    for filename in question_files:
-        nom_question = filename.split('.')[0]
-        question_content = load_question(nom_question)
-        target_data = load_target(nom_question)
-        questions.append({
-            'nom_question': nom_question,
-            'question_content': question_content,
-            'target_data': target_data
-        })
-    questions.sort(key=lambda x: x['nom_question'].lower())
-    return render_template('edit.html', questions=questions)
+    return render_template('edit.html')
+
+QUESTIONS_PAGE_SIZE = 50
+QUESTIONS_PAGE_MAX = 500
+
+@app.route('/api/questions')
+def api_questions():
+    """A page of the questions, sorted by name, with their first paragraph."""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', QUESTIONS_PAGE_SIZE, type=int), 1), QUESTIONS_PAGE_MAX)
+    total, page = storage.get_storage().question_page(offset, limit)
+    return {'total': total, 'offset': offset, 'limit': limit, 'questions': page}
+
+@app.route('/api/questions/<nom_question>')
+def api_question(nom_question):
+    """The full content and target data of one question."""
+    question_content = load_question(nom_question)
+    if question_content is None:
+        return {'error': f"Question {nom_question} introuvable"}, 404
+    return {'nom_question': nom_question, 'question_content': question_content, 'target_data': load_target(nom_question)}
+
+SEARCH_MAX = 500
+
+@app.route('/search')
+def search_page():
+    return render_template('search.html', models=search.models(), kinds=search_index.KINDS)
+
+@app.route('/api/search')
+def api_search():
+    """Full-text search, optionally restricted to some models, kinds or to the selected questions."""
+    query = request.args.get('q', '')
+    models = request.args.getlist('model')
+    kinds = [kind for kind in request.args.getlist('kind') if kind in search_index.KINDS]
+    questions = request.args.getlist('question')
+    if request.args.get('selected'):
+        questions = load_selected_questions()
+        if not questions:
+            return {'query': query, 'count': 0, 'results': []}
+    limit = min(max(request.args.get('limit', search_index.DEFAULT_LIMIT, type=int), 1), SEARCH_MAX)
+    results = search.search(query, models or None, questions or None, kinds or None, limit)
+    return {'query': query, 'count': len(results), 'results': results}
 
 @app.route('/edit/<nom_question>', methods=['GET', 'POST'])
 def edit_question(nom_question):
@@ -336,9 +185,7 @@ def select_questions():
         selected_questions = request.form.getlist('selected_questions')
         save_selected_questions(selected_questions)
         return redirect(url_for('select_questions'))
-    question_files = os.listdir('./questions')
-    questions = [filename.split('.')[0] for filename in question_files]
-    questions.sort(key=lambda x: x.lower())
+    questions = [entry['nom_question'] for entry in storage.get_storage().all_questions()]
     selected_questions = load_selected_questions()
     return render_template('select_questions.html', questions=questions, selected_questions=selected_questions)
 
@@ -357,33 +204,8 @@ def manual_entry():
 @app.route('/models', methods=['GET', 'POST'])
 def models():
     """Main route for the application, handling both displaying models and saving user's selection."""
-    models = fetch_models()
-    # Organize models by provider
-    providers = {
-        'Ollama - Offine': [],
-        'Anthropic': [],
-        'Google': [],
-        'OpenAI': [],
-        'Mistral': [],
-        'Perplexity': [],
-        'Autre':[]
-    }
-    for model in models:
-        model_name = model['name'].lower()
-        if 'google' in model_name or 'gemini' in model_name:
-            providers['Google'].append(model)
-        elif 'anthropic' in model_name or 'claude' in model_name:
-            providers['Anthropic'].append(model)
-        elif 'perplexity' in model_name:
-            providers['Perplexity'].append(model)
-        elif model.get('model_type') == 'OpenAI':
-            providers['OpenAI'].append(model)
-        elif model.get('model_type') == 'Ollama':
-            providers['Ollama - Offine'].append(model)
-        elif 'mistral' in model_name or model.get('model_type') == 'Mistral':
-            providers['Mistral'].append(model)
-        else:
-            providers['Autre'].append(model)
+    # Models organized by provider
+    models, providers = catalog.get()
     if request.method == 'POST':
         selected_models = request.form.getlist('models')
         save_to_yaml(selected_models)
@@ -395,29 +217,26 @@ def models():
 def delete_questions():
     selected_questions = request.form.getlist('selected_questions')
     for nom_question in selected_questions:
-        question_path = f'./questions/{nom_question}.q'
-        answer_path = f'./answers/{nom_question}.a'
-        target_path = f'./targets/{nom_question}.t'
-        if os.path.exists(question_path):
-            os.remove(question_path)
-        if os.path.exists(answer_path):
-            os.remove(answer_path)
-        if os.path.exists(target_path):
-            os.remove(target_path)
+        storage.get_storage().delete_question(nom_question)
     return redirect(url_for('delquestion'))
 
 @app.route('/test_connection', methods=['POST'])
 def test_connection(local = False):
-    config = load_connect_owui(config_file)
-    API_KEY = config['open_webui']['api_key']
-    BASE_URL = config['open_webui']['location']
+    config = load_connect_owui().get('open_webui') or {}
+    API_KEY = config.get('api_key')
+    BASE_URL = config.get('location')
 
     if not API_KEY or not BASE_URL:
         return {'status': 'error', 'message': 'API key and location are required.'}, 400
 
     try:
-        response = requests.get(f"{BASE_URL}/api/models", headers={'Authorization': f'Bearer {API_KEY}'})
+        response = owui_client.get('/api/models')
         if response.status_code == 200:
+            # The answer is the model list: keep it for the model pages
+            try:
+                catalog.update(response.json())
+            except ValueError:
+                pass
             if not local:
                 return {'status': 'success', 'message': 'Connexion réussie!'}
             else:
@@ -435,7 +254,7 @@ def test_connection(local = False):
 
 @app.route('/edit_config', methods=['GET', 'POST'])
 def edit_config():
-    config = load_connect_owui(config_file)
+    config = load_connect_owui()
     message = None
     category = None
 
@@ -446,57 +265,24 @@ def edit_config():
                 'location': request.form.get('location')
             }
         }
-        save_connect_owui(new_config, config_file)
-        config = load_connect_owui(config_file)
+        save_connect_owui(new_config)
+        owui_client.reset()
+        catalog.invalidate()
+        config = load_connect_owui()
         message = 'Configuration sauvegardée avec succès!'
         category = 'success'
 
     return render_template('edit_config.html', config=config, message=message, category=category)
 
-def run_script(script_path, check_interval=0.1):
-    try:
-        process = subprocess.Popen(
-            ["python", "-u", script_path, "--verbose"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1,  # Line buffered
-        )
-
-        while True:
-            output_line = process.stdout.readline()
-
-            # Yield any new output
-            if output_line:
-                yield f"data: {output_line}\n\n"
-            else:
-                # Check if the process is still running
-                if process.poll() is not None:
-                    break
-
-            # Wait for a short time before checking again, to not busy-wait
-            time.sleep(check_interval)
-
-        # Ensure any remaining output is captured and yielded after process ends
-        remaining_output = process.stdout.read()
-        if remaining_output:
-            yield f"data: {remaining_output}\n\n"
-
-        # Check the return code to determine if the process was successful
-        return_code = process.wait()
-        if return_code == 0:
-            yield "data: Script execution completed successfully.\n\n"
-        else:
-            yield f"data: Script execution failed with return code {return_code}.\n\n"
-
-    except Exception as e:
-        yield f"data: Error occurred: {str(e)}\n\n"
+@app.route('/performance')
+def performance():
+    records = perf_metrics.load_records()
+    last_run = request.args.get('last_run') is not None
+    if last_run:
+        records = perf_metrics.load_records(run=perf_metrics.last_run(records))
+    rows = perf_metrics.aggregate(records)
+    return render_template('performance.html', rows=rows, n_records=len(records), last_run=last_run)
 
-    finally:
-        if process:
-            process.stdout.close()
-            process.terminate()
-        
 @app.route('/run_compare')
 def run_compare():
     return render_template('output.html', script_name='app-compare.py')
@@ -505,13 +291,64 @@ def run_compare():
 def run_anal():
     return render_template('output.html', script_name='app-anal.py')
 
+def follow_job(script_path):
+    """Stream the run of a script, starting it unless a run of it is already going on.
+
+    While another script runs, a single 'busy' event names it and nothing is started.
+
+    A reconnecting EventSource sends the id of the last event it received;
+    it is then attached to the latest run of the script from that point
+    instead of starting a new one.
+    """
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    job = jobs.latest(script_path) if last_event_id is not None else None
+    if job is None:
+        try:
+            job, created = jobs.start(script_path)
+        except job_runner.JobBusy as e:
+            # Another script is running: say which one instead of following it
+            busy = e.job.summary()
+            return Response(f"event: busy\ndata: {json.dumps(busy)}\n\n",
+                            mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+        after = -1
+    else:
+        created = False
+        try:
+            after = int(last_event_id)
+        except ValueError:
+            after = -1
+
+    def generate():
+        yield f"event: job\ndata: {json.dumps({**job.summary(), 'created': created})}\n\n"
+        yield from job_runner.sse_stream(job, after)
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/events_compare')
 def events_compare():
-    return Response(run_script("app-compare.py"), mimetype='text/event-stream')
+    return follow_job("app-compare.py")
 
 @app.route('/events_anal')
 def events_anal():
-    return Response(run_script("app-anal.py"), mimetype='text/event-stream')
+    return follow_job("app-anal.py")
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return {'error': f"Unknown job {job_id}"}, 404
+    return job.summary()
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if jobs.get(job_id) is None:
+        return {'error': f"Unknown job {job_id}"}, 404
+    return {'cancelled': jobs.cancel(job_id)}
 
 if __name__ == '__main__':
+    # Ensure directories exist for storing files
+    os.makedirs('./questions', exist_ok=True)
+    os.makedirs('./targets', exist_ok=True)
+    os.makedirs('./answers', exist_ok=True)
+    os.makedirs('./config', exist_ok=True)
     app.run(debug=True)
@@ -0,0 +1,37 @@
+import os
+import shutil
+import argparse
+import sharding
+import storage
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge, inspect or reset the work folder of the sharded runs of app-compare.py and app-anal.py.")
+    parser.add_argument('command', choices=['merge', 'status', 'reset'],
+                        help="merge: add the answers and scores of the shards not merged yet to the storage and ./analysis; "
+                             "status: count the units done and leased; reset: forget the queue (leases and done units)")
+    parser.add_argument('--work-dir', default=sharding.DEFAULT_WORK_DIR, help=f"Shared folder of the sharded runs (default: {sharding.DEFAULT_WORK_DIR})")
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.work_dir):
+        print(f"No sharded run in {args.work_dir}")
+        return
+
+    if args.command == 'merge':
+        store = storage.get_storage()
+        if args.verbose:
+            print("*-*-*-*-*-*-*-*-*")
+            print(f"Merging {args.work_dir} into {store.describe()}")
+        counts = sharding.merge(store, args.work_dir, args.verbose)
+        print(f"Merged {counts['answers']} answers, {counts['results']} result rows and {counts['samples']} sample statistics rows")
+    elif args.command == 'status':
+        queue = sharding.WorkQueue(args.work_dir)
+        status = queue.status()
+        print(f"{status['done']} units done and {status['leased']} in progress in {args.work_dir}")
+    else:
+        for folder in sharding.QUEUE_FOLDERS:
+            shutil.rmtree(os.path.join(args.work_dir, folder), ignore_errors=True)
+        print(f"Queue of {args.work_dir} reset; the shard outputs are kept until you delete them, the merged ones in {os.path.join(args.work_dir, sharding.MERGED_FOLDER)}")
+
+if __name__ == "__main__":
+    main()
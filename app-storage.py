@@ -0,0 +1,27 @@
+import argparse
+import storage
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the questions, targets, answers and analyses between the files and the SQLite database.")
+    parser.add_argument('direction', choices=['import', 'export'],
+                        help="import: files -> SQLite database; export: SQLite database -> files")
+    parser.add_argument('--db', default=None, help=f"SQLite database (default: storage.path in the configuration, or {storage.DEFAULT_DATABASE})")
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
+    args = parser.parse_args()
+
+    path = args.db or storage.load_settings().get('path') or storage.DEFAULT_DATABASE
+    files = storage.FileStorage()
+    database = storage.SQLiteStorage(path)
+    source, destination = (files, database) if args.direction == 'import' else (database, files)
+    if args.verbose:
+        print("*-*-*-*-*-*-*-*-*")
+        print(f"Copying from {source.describe()} to {destination.describe()}")
+
+    counts = storage.copy(source, destination, args.verbose)
+    print(f"Copied {counts['questions']} questions, {counts['targets']} targets, "
+          f"{counts['answers']} answers and {counts['analyses']} analyses to {destination.describe()}")
+    if args.direction == 'import':
+        print("Set 'storage: {backend: sqlite}' in ./config/config.yaml to use the database.")
+
+if __name__ == "__main__":
+    main()
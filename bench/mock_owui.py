@@ -0,0 +1,182 @@
+"""Local stand-in for the Open WebUI API, to test and benchmark the harness.
+
+Implements GET /api/models and POST /api/chat/completions (streaming and
+non-streaming) with a configurable latency distribution, injected 429/5xx
+errors and citations for the models that support them. GET /_stats returns
+the request counters and POST /_stats/reset clears them.
+
+    python bench/mock_owui.py --port 3001 --latency lognormal:0.8:0.4 --error-429 0.05
+
+Point ./config/connect-owui.yaml at http://localhost:3001 (any API key).
+"""
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from flask import Flask, request, Response, jsonify
+from werkzeug.serving import make_server
+
+DEFAULT_MODELS = ['gpt-4o', 'claude-3-5-sonnet', 'mistral-large', 'perplexity-sonar', 'llama3:8b', 'gemini-1.5-pro']
+MODELS_SUPPORTING_CITATIONS = ["perplexity", "claude"]
+
+def parse_latency(spec):
+    """Parse a latency distribution: 'fixed:S', 'uniform:MIN:MAX', 'normal:MEAN:SD' or 'lognormal:MEDIAN:SIGMA' (seconds)."""
+    kind, *params = spec.split(':')
+    params = [float(p) for p in params]
+    if kind == 'fixed':
+        return lambda: params[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(params[0], params[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(params[0], params[1]))
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(0, params[1]) * params[0]
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def create_app(models=None, latency='fixed:0.05', token_delay=0.0, error_429=0.0, error_5xx=0.0, retry_after=1, answer_words=120, seed=None):
+    """Create the mock server application."""
+    app = Flask(__name__)
+    models = models or DEFAULT_MODELS
+    sample_latency = parse_latency(latency)
+    rng = random.Random(seed)
+    stats = {'models': 0, 'completions': 0, 'streamed': 0, '429': 0, '5xx': 0}
+    stats_lock = threading.Lock()
+
+    def count(key):
+        with stats_lock:
+            stats[key] += 1
+
+    def model_entry(name):
+        entry = {'id': name, 'name': name, 'object': 'model', 'created': 1700000000, 'owned_by': 'openai'}
+        if ':' in name:
+            entry['owned_by'] = 'ollama'
+            entry['ollama'] = {'size': 4661224676, 'modified_at': '2024-01-01T00:00:00Z',
+                               'details': {'format': 'gguf', 'family': 'llama', 'parameter_size': '8B', 'quantization_level': 'Q4_0'}}
+        elif name.startswith('gpt'):
+            entry['openai'] = {'id': name, 'object': 'model', 'owned_by': 'openai'}
+        return entry
+
+    def answer_text(model, question):
+        words = [rng.choice(['le', 'contrat', 'article', 'délai', 'la', 'loi', 'prévoit', 'que', 'partie', 'civil']) for _ in range(answer_words)]
+        return f"<think>Réflexion de {model}</think>Réponse de {model} à « {question[:60]} » : " + ' '.join(words) + '.'
+
+    def judge_scores():
+        return {'couverture_infos_cruciales': rng.randint(0, 10), 'infos_a_eviter_presentes': rng.random() < 0.2,
+                'note_globale': rng.randint(0, 10)}
+
+    @app.get('/api/models')
+    def list_models():
+        count('models')
+        return jsonify({'data': [model_entry(name) for name in models]})
+
+    @app.get('/_stats')
+    def get_stats():
+        with stats_lock:
+            return jsonify(dict(stats))
+
+    @app.post('/_stats/reset')
+    def reset_stats():
+        with stats_lock:
+            for key in stats:
+                stats[key] = 0
+        return jsonify(dict(stats))
+
+    @app.post('/api/chat/completions')
+    def chat_completions():
+        payload = request.get_json()
+        model = payload.get('model', '')
+        draw = rng.random()
+        if draw < error_429:
+            count('429')
+            return Response(json.dumps({'detail': 'Rate limit exceeded'}), status=429,
+                            headers={'Retry-After': str(retry_after)}, mimetype='application/json')
+        if draw < error_429 + error_5xx:
+            count('5xx')
+            return Response(json.dumps({'detail': 'Upstream error'}), status=rng.choice([500, 502, 503]), mimetype='application/json')
+        if model not in models:
+            return Response(json.dumps({'detail': 'Model not found'}), status=400, mimetype='application/json')
+
+        count('completions')
+        question = payload['messages'][-1]['content']
+        candidate_ids = sorted(set(re.findall(r'candidat_\d+', question)))
+        if candidate_ids:
+            # Batched judge request: one verdict per candidate, as a JSON object
+            content = json.dumps({candidate_id: {'evaluation': answer_text(model, candidate_id), **judge_scores()}
+                                  for candidate_id in candidate_ids}, ensure_ascii=False)
+        elif 'note_globale' in question:
+            # Judge request: the evaluation ends with its scores
+            content = answer_text(model, question) + '\n' + json.dumps(judge_scores())
+        else:
+            content = answer_text(model, question)
+        usage = {
+            'prompt_tokens': sum(len(m['content'].split()) for m in payload['messages']),
+            'completion_tokens': len(content.split()),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        completion_id = f"chatcmpl-{rng.getrandbits(48):012x}"
+        created = int(time.time())
+        citations = None
+        if payload.get('return_citations') or any(name in model.lower() for name in MODELS_SUPPORTING_CITATIONS):
+            citations = [f"https://www.legisquebec.gouv.qc.ca/fr/document/lc/CCQ-1991#{i}" for i in range(1, 4)]
+
+        delay = sample_latency()
+        if not payload.get('stream'):
+            time.sleep(delay)
+            body = {
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': usage,
+            }
+            if citations:
+                body['citations'] = citations
+            return jsonify(body)
+
+        count('streamed')
+
+        def events():
+            time.sleep(delay)
+            base = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model}
+            yield 'data: ' + json.dumps({**base, 'choices': [{'index': 0, 'delta': {'role': 'assistant'}}]}) + '\n\n'
+            for word in content.split(' '):
+                if token_delay:
+                    time.sleep(token_delay)
+                yield 'data: ' + json.dumps({**base, 'choices': [{'index': 0, 'delta': {'content': word + ' '}}]}) + '\n\n'
+            last = {**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage}
+            if citations:
+                last['citations'] = citations
+            yield 'data: ' + json.dumps(last) + '\n\n'
+            yield 'data: [DONE]\n\n'
+
+        return Response(events(), mimetype='text/event-stream')
+
+    return app
+
+def start_in_thread(app, host='127.0.0.1', port=0):
+    """Serve the application from a background thread; returns the server, whose port is `server.port`."""
+    # One access log line per request would drown the benchmark output
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Open WebUI API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3001)
+    parser.add_argument('--models', help="Comma separated model ids (default: a few models of each provider)")
+    parser.add_argument('--latency', default='fixed:0.05', help="Latency distribution before the first token: fixed:S, uniform:MIN:MAX, normal:MEAN:SD or lognormal:MEDIAN:SIGMA")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="Delay between streamed tokens (seconds)")
+    parser.add_argument('--error-429', type=float, default=0.0, help="Fraction of completions answered with 429")
+    parser.add_argument('--error-5xx', type=float, default=0.0, help="Fraction of completions answered with 500/502/503")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After header sent with the 429 responses (seconds)")
+    parser.add_argument('--answer-words', type=int, default=120, help="Length of the generated answers")
+    parser.add_argument('--seed', type=int, help="Seed of the random generator")
+    args = parser.parse_args()
+
+    app = create_app(args.models.split(',') if args.models else None, args.latency, args.token_delay,
+                     args.error_429, args.error_5xx, args.retry_after, args.answer_words, args.seed)
+    print(f"Mock Open WebUI listening on http://{args.host}:{args.port}")
+    make_server(args.host, args.port, app, threaded=True).serve_forever()
@@ -0,0 +1,114 @@
+"""Benchmark the harness against the local mock Open WebUI server.
+
+For every combination of question count, model count and worker count, a
+throw-away working directory is filled with generated questions, targets and
+configuration, then app-compare.py and app-anal.py are run in it against
+bench/mock_owui.py. The mock's latency is fixed, so the time the scripts
+spend beyond the ideal (requests x latency / workers) is the harness's own
+overhead.
+
+    python bench/run_bench.py --questions 10,100 --models 2,6 --workers 1,8
+"""
+import os
+import csv
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import requests
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mock_owui
+
+def prepare_workdir(workdir, base_url, n_questions, models):
+    """Create the configuration, questions and targets of one benchmark case."""
+    for folder in ('config', 'questions', 'targets'):
+        os.makedirs(os.path.join(workdir, folder), exist_ok=True)
+    with open(os.path.join(workdir, 'config', 'connect-owui.yaml'), 'w', encoding='utf-8') as file:
+        yaml.dump({'open_webui': {'api_key': 'sk-bench', 'location': base_url}}, file)
+    with open(os.path.join(workdir, 'config', 'config.yaml'), 'w', encoding='utf-8') as file:
+        yaml.dump({'selected_models': models, 'analysis_model': models[0]}, file)
+    names = [f"question{i:05d}" for i in range(n_questions)]
+    with open(os.path.join(workdir, 'config', 'selected_questions.yaml'), 'w', encoding='utf-8') as file:
+        yaml.dump(names, file)
+    for name in names:
+        with open(os.path.join(workdir, 'questions', f"{name}.q"), 'w', encoding='utf-8') as file:
+            file.write(f"Quel est le délai de prescription applicable dans le cas {name} ?\nDétails du cas.")
+        with open(os.path.join(workdir, 'targets', f"{name}.t"), 'w', encoding='utf-8') as file:
+            json.dump({'reponse_cible': "Trois ans.", 'infos_cruciales': "Article 2925 C.c.Q.",
+                       'infos_a_eviter': "Dix ans."}, file, indent=4)
+
+def run_script(workdir, script, args):
+    """Run one of the harness scripts in the working directory; returns (seconds, return code)."""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(REPO_DIR, script)] + args, cwd=workdir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+    return time.perf_counter() - started, result.returncode
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app-compare.py and app-anal.py against a local mock Open WebUI.")
+    parser.add_argument('--questions', default='10,50', help="Comma separated question counts")
+    parser.add_argument('--models', default='2,6', help="Comma separated model counts")
+    parser.add_argument('--workers', default='1,8', help="Comma separated app-compare.py worker counts")
+    parser.add_argument('--latency', type=float, default=0.05, help="Fixed latency of the mock server (seconds)")
+    parser.add_argument('--stream', action='store_true', help="Run app-compare.py with --stream")
+    parser.add_argument('--skip-anal', action='store_true', help="Only benchmark app-compare.py")
+    parser.add_argument('--output', default='bench_results.csv', help="CSV file receiving the results")
+    parser.add_argument('--keep', action='store_true', help="Keep the working directories")
+    args = parser.parse_args()
+
+    all_models = mock_owui.DEFAULT_MODELS
+
+    results = []
+    print(f"{'Questions':>9} {'Models':>6} {'Workers':>7} {'Requests':>8} {'Compare s':>9} {'Ideal s':>8} {'Overhead ms/req':>15} {'Anal s':>7}")
+    for n_questions in [int(n) for n in args.questions.split(',')]:
+        for n_models in [int(n) for n in args.models.split(',')]:
+            # Beyond the default models, serve numbered copies of them
+            models = [all_models[i] if i < len(all_models) else f"{all_models[i % len(all_models)]}-{i}"
+                      for i in range(n_models)]
+            for n_workers in [int(n) for n in args.workers.split(',')]:
+                workdir = tempfile.mkdtemp(prefix='genai-bench-')
+                mock = mock_owui.create_app(models=models, latency=f"fixed:{args.latency}", seed=0)
+                case_server = mock_owui.start_in_thread(mock)
+                case_url = f"http://127.0.0.1:{case_server.port}"
+                try:
+                    prepare_workdir(workdir, case_url, n_questions, models)
+                    n_requests = n_questions * n_models
+                    compare_args = ['--workers', str(n_workers)] + (['--stream'] if args.stream else [])
+                    compare_time, compare_code = run_script(workdir, 'app-compare.py', compare_args)
+                    stats = requests.get(f"{case_url}/_stats").json()
+                    anal_time, anal_code = (None, 0) if args.skip_anal else run_script(workdir, 'app-anal.py', [])
+                finally:
+                    case_server.shutdown()
+                    if not args.keep:
+                        shutil.rmtree(workdir, ignore_errors=True)
+                ideal = n_requests * args.latency / n_workers
+                overhead = (compare_time - ideal) / n_requests * 1000 if n_requests else 0
+                row = {
+                    'questions': n_questions, 'models': n_models, 'workers': n_workers,
+                    'requests': n_requests, 'served': stats['completions'],
+                    'compare_seconds': round(compare_time, 3), 'ideal_seconds': round(ideal, 3),
+                    'overhead_ms_per_request': round(overhead, 2),
+                    'anal_seconds': None if anal_time is None else round(anal_time, 3),
+                    'ok': compare_code == 0 and anal_code == 0,
+                }
+                results.append(row)
+                anal_cell = '-' if anal_time is None else f"{anal_time:.2f}"
+                print(f"{n_questions:>9} {n_models:>6} {n_workers:>7} {n_requests:>8} {compare_time:>9.2f} {ideal:>8.2f} {overhead:>15.2f} {anal_cell:>7}")
+
+    with open(args.output, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Results saved in {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Bulk import and export of question banks, answers and analysis results.
+
+Files are JSON Lines (one object per line) or CSV with a header row, and
+are read and written one row at a time, so their size does not matter.
+A question row has the columns of QUESTION_COLUMNS, the fields of /add_q:
+
+    {"nom_question": "bail01", "question_content": "...", "reponse_cible": "...",
+     "infos_cruciales": "...", "infos_a_eviter": "..."}
+
+Imported rows are checked (single-word name, as in the web interface, and
+a question text) and saved by batches of BATCH_SIZE questions; a bad row
+is reported with its line number and skipped, the others are imported.
+
+The answers (ANSWER_COLUMNS, one row per question and model, or per
+sample of the models asked several times) and the analysis results
+(RESULT_COLUMNS, one row per verdict of the analysis records, with the
+parsed scores) can be exported the same way. `sample` is the index of the
+sample, empty for a single answer.
+"""
+import sys
+import csv
+import json
+import contextlib
+import storage
+import answer_store
+import analysis_report
+import results_store
+
+FORMATS = ('jsonl', 'csv')
+BATCH_SIZE = 500
+
+QUESTION_COLUMNS = ['nom_question', 'question_content', 'reponse_cible', 'infos_cruciales', 'infos_a_eviter']
+TARGET_COLUMNS = ['reponse_cible', 'infos_cruciales', 'infos_a_eviter']
+ANSWER_COLUMNS = ['nom_question', 'model', 'sample', 'created', 'content']
+RESULT_COLUMNS = ['nom_question', 'model', 'sample', 'judge', 'complete', 'valid'] + results_store.SCORE_FIELDS + ['analysis']
+
+# Question texts and answers are longer than the default limit of the csv module
+csv.field_size_limit(64 * 1024 * 1024)
+
+def guess_format(path):
+    """The format of a file from its extension (JSON Lines unless .csv)."""
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+@contextlib.contextmanager
+def open_file(path, mode):
+    """Open a file for the csv/json modules; '-' is stdin or stdout."""
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+    else:
+        # utf-8-sig skips the byte order mark of spreadsheet exports
+        with open(path, mode, encoding='utf-8-sig' if mode == 'r' else 'utf-8', newline='') as file:
+            yield file
+
+def read_rows(file, file_format):
+    """Yield (line number, row) for each row; row is an error message for an unreadable row."""
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, f"invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, "expected a JSON object"
+            continue
+        yield line_number, row
+
+def write_rows(file, file_format, columns, rows):
+    """Write rows one by one; returns how many were written."""
+    count = 0
+    if file_format == 'csv':
+        writer = csv.DictWriter(file, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    for row in rows:
+        file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+def validate_question(row):
+    """Return (nom_question, question_content, target_data) from a row, or raise ValueError."""
+    nom_question = (row.get('nom_question') or '').strip()
+    if not storage.valid_question_name(nom_question):
+        raise ValueError(f"invalid question name '{nom_question}' (it must be a single word)")
+    question_content = row.get('question_content')
+    if not isinstance(question_content, str) or not question_content.strip():
+        raise ValueError(f"question '{nom_question}' has no question_content")
+    target_data = {}
+    for column in TARGET_COLUMNS:
+        value = row.get(column)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{column} of question '{nom_question}' is not a text")
+        target_data[column] = value or ''
+    return nom_question, question_content, target_data
+
+def import_questions(store, file, file_format, batch_size=BATCH_SIZE, skip_existing=False, verbose=False):
+    """Import the questions of a file; returns the counts of imported, skipped and invalid rows."""
+    counts = {'imported': 0, 'skipped': 0, 'errors': 0}
+    existing = set(store.list_questions()) if skip_existing else set()
+    batch = []
+
+    def flush():
+        store.save_questions(batch)
+        counts['imported'] += len(batch)
+        if verbose:
+            print(f"Imported {counts['imported']} questions")
+        batch.clear()
+
+    for line_number, row in read_rows(file, file_format):
+        try:
+            if isinstance(row, str):
+                raise ValueError(row)
+            question = validate_question(row)
+        except ValueError as e:
+            counts['errors'] += 1
+            print(f"Line {line_number}: {e}")
+            continue
+        if question[0] in existing:
+            counts['skipped'] += 1
+            continue
+        batch.append(question)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return counts
+
+def question_rows(store):
+    """Yield the questions with their target data, one row each."""
+    for nom_question in store.list_questions():
+        question_content = store.load_question(nom_question)
+        if question_content is None:
+            continue
+        target_data = store.load_target(nom_question) or {}
+        row = {'nom_question': nom_question, 'question_content': question_content}
+        for column in TARGET_COLUMNS:
+            row[column] = target_data.get(column) or ''
+        yield row
+
+def answer_rows(store, models=None):
+    """Yield one row per stored answer, one per sample of a multi-sample answer, optionally of some models only."""
+    for nom_question in store.list_answered_questions():
+        for model, answer in store.load_answers(nom_question).items():
+            if models and model not in models:
+                continue
+            if isinstance(answer, dict) and 'samples' in answer:
+                samples = enumerate(answer['samples'])
+            else:
+                samples = [(None, answer)]
+            for sample, sample_answer in samples:
+                yield {
+                    'nom_question': nom_question,
+                    'model': model,
+                    'sample': sample,
+                    'created': sample_answer.get('created') if isinstance(sample_answer, dict) else None,
+                    'content': answer_store.answer_text(sample_answer),
+                }
+
+def result_rows(store, models=None):
+    """Yield one row per verdict of the analysis records, with the parsed scores."""
+    for nom_question in store.list_analyses():
+        header, verdicts, complete = analysis_report.split_records(store.load_analysis_records(nom_question))
+        if header is None:
+            continue
+        for verdict in verdicts:
+            if models and verdict['model'] not in models:
+                continue
+            scores = results_store.parse_scores(verdict['analysis'])
+            row = {
+                'nom_question': nom_question,
+                'model': verdict['model'],
+                'sample': verdict.get('sample'),
+                # Graded by the local pre-scoring, as in results.csv
+                'judge': 'prescore' if verdict.get('local') else header['analysis_model'],
+                'complete': complete,
+                'valid': scores is not None,
+                'analysis': verdict['analysis'],
+            }
+            for field in results_store.SCORE_FIELDS:
+                row[field] = scores[field] if scores else None
+            yield row
+
+EXPORTS = {
+    'questions': (QUESTION_COLUMNS, question_rows),
+    'answers': (ANSWER_COLUMNS, answer_rows),
+    'results': (RESULT_COLUMNS, result_rows),
+}
+
+def export(store, what, file, file_format, models=None):
+    """Export the questions, answers or results to a file; returns the number of rows."""
+    columns, rows = EXPORTS[what]
+    return write_rows(file, file_format, columns, rows(store) if what == 'questions' else rows(store, models))
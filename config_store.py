@@ -0,0 +1,100 @@
+"""Cached access to the YAML files of ./config.
+
+Each file is parsed once and kept in memory; a later `load` only checks the
+file's modification time and size, and parses it again when it changed
+(e.g. edited by hand or saved by another process). `save` writes through a
+temporary file and `os.replace`, so a reader never sees half a file.
+
+Nothing is read at import time, so the scripts can be imported without a
+configuration.
+"""
+import os
+import copy
+import threading
+import tempfile
+import yaml
+
+CONFIG_FOLDER = './config'
+CONFIG_PATH = os.path.join(CONFIG_FOLDER, 'config.yaml')
+CONNECT_OWUI_PATH = os.path.join(CONFIG_FOLDER, 'connect-owui.yaml')
+SELECTED_QUESTIONS_PATH = os.path.join(CONFIG_FOLDER, 'selected_questions.yaml')
+
+_MISSING = object()
+
+_lock = threading.RLock()
+# path -> ((mtime_ns, size), parsed content or _MISSING)
+_cache = {}
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def load(path, default=None):
+    """Return the content of a YAML file, or `default` when it is missing or invalid.
+
+    The caller gets its own copy and may modify it.
+    """
+    with _lock:
+        signature = _signature(path)
+        cached = _cache.get(path)
+        if cached is None or cached[0] != signature:
+            content = _MISSING
+            if signature is not None:
+                try:
+                    with open(path, 'r', encoding='utf-8') as file:
+                        content = yaml.safe_load(file)
+                except FileNotFoundError:
+                    signature = None
+                except yaml.YAMLError as e:
+                    print(f"Error reading YAML file {path}: {e}")
+            cached = (signature, content)
+            _cache[path] = cached
+        content = cached[1]
+    if content is _MISSING or content is None:
+        return copy.deepcopy(default)
+    return copy.deepcopy(content)
+
+def save(path, content):
+    """Atomically replace a YAML file."""
+    folder = os.path.dirname(path) or '.'
+    with _lock:
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                yaml.dump(content, file)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _cache[path] = (_signature(path), copy.deepcopy(content))
+
+def update(path, **changes):
+    """Set some keys of a YAML mapping, keeping the others."""
+    with _lock:
+        content = load(path, {})
+        content.update(changes)
+        save(path, content)
+        return content
+
+def config():
+    """The main configuration, ./config/config.yaml."""
+    return load(CONFIG_PATH, {})
+
+def connect_owui():
+    """The Open WebUI connection settings, or None when they were not saved yet."""
+    return load(CONNECT_OWUI_PATH)
+
+def selected_questions():
+    """The selected question names, or None when there is no selection file.
+
+    Only a missing file means "all the questions": an empty selection
+    selects none.
+    """
+    if not os.path.exists(SELECTED_QUESTIONS_PATH):
+        return None
+    return load(SELECTED_QUESTIONS_PATH, []) or []
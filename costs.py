@@ -0,0 +1,222 @@
+"""Token and cost accounting of the requests, with budget caps.
+
+Every request sent by app-compare.py (kind 'compare') and app-anal.py
+(kind 'judge') is counted from the `usage` block of its response: prompt
+and completion tokens, and their cost from the price table of the
+configuration. The requests log of perf_metrics keeps them per request.
+
+Before a request is sent, its cost is estimated (prompt from the length of
+the text, completion from the mean completion size of the model in the
+requests log) and reserved against the budget of the run. When a request
+would exceed the budget, it is not sent and the run stops sending new ones;
+the requests already sent finish and are counted. `estimate` gives the same
+estimate for a whole run before starting it (--estimate).
+
+Settings in ./config/config.yaml, prices per million tokens:
+
+    costs:
+      currency: USD
+      prices:
+        GPT-4o: {prompt: 2.5, completion: 10}
+        default: {prompt: 1, completion: 3}   # the models not listed
+      budget:
+        compare: 10     # cost cap of an app-compare.py run
+        judge: 2        # cost cap of an app-anal.py run
+"""
+import threading
+import numpy as np
+import config_store
+import perf_metrics
+
+KINDS = ('compare', 'judge')
+# Rough size of a token
+CHARS_PER_TOKEN = 4
+# Completion size assumed for a model without history in the requests log
+DEFAULT_COMPLETION_TOKENS = {'compare': 800, 'judge': 400}
+
+class BudgetExceeded(Exception):
+    """Raised instead of sending a request that would exceed the budget of the run."""
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def load_settings():
+    """Load the costs section of the configuration."""
+    settings = config_store.config().get('costs') or {}
+    return {
+        'currency': settings.get('currency') or '',
+        'prices': settings.get('prices') or {},
+        'budget': settings.get('budget') or {},
+    }
+
+def price(prices, model):
+    """The (prompt, completion) prices per million tokens of a model, or None when it has none."""
+    entry = prices.get(model, prices.get('default'))
+    if not entry:
+        return None
+    return float(entry.get('prompt', 0) or 0), float(entry.get('completion', 0) or 0)
+
+def cost(prices, model, prompt_tokens, completion_tokens):
+    """The cost of a number of tokens of a model, 0 without a price."""
+    model_price = price(prices, model)
+    if model_price is None:
+        return 0.0
+    return (prompt_tokens * model_price[0] + completion_tokens * model_price[1]) / 1e6
+
+def completion_history(kind):
+    """The mean completion tokens of each model in the requests log, and of all of them under None."""
+    records = [record for record in perf_metrics.load_records(kind=kind)
+               if record.get('ok') and record.get('completion_tokens') is not None]
+    if not records:
+        return {}
+    models, model_index = np.unique([record['model'] for record in records], return_inverse=True)
+    tokens = np.array([record['completion_tokens'] for record in records], dtype=float)
+    means = np.bincount(model_index, weights=tokens) / np.bincount(model_index)
+    history = {str(model): float(mean) for model, mean in zip(models, means)}
+    history[None] = float(tokens.mean())
+    return history
+
+class CostTracker:
+    """Running token and cost totals of a run, and its budget.
+
+    Thread-safe: the workers of app-compare.py reserve and record their
+    requests concurrently.
+    """
+
+    def __init__(self, kind, budget=None, settings=None):
+        settings = settings or load_settings()
+        self.kind = kind
+        self.prices = settings['prices']
+        self.currency = settings['currency']
+        self.budget = budget if budget is not None else settings['budget'].get(kind)
+        self.history = completion_history(kind)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.reserved = 0.0
+        self.by_model = {}
+        # Set by the first request refused: no request is sent after it
+        self.stopped = False
+        self.unpriced = set()
+
+    def expected_completion(self, model):
+        return self.history.get(model, self.history.get(None, DEFAULT_COMPLETION_TOKENS[self.kind]))
+
+    def estimate(self, model, prompt_text):
+        """The estimated (prompt tokens, completion tokens, cost) of a request."""
+        prompt_tokens = estimate_tokens(prompt_text)
+        completion_tokens = self.expected_completion(model)
+        return prompt_tokens, completion_tokens, cost(self.prices, model, prompt_tokens, completion_tokens)
+
+    def reserve(self, model, prompt_text):
+        """Reserve the estimated cost of a request before sending it.
+
+        Returns the reserved cost, to give back to `record`; raises
+        BudgetExceeded when the request would exceed the budget, and for
+        every request after that one.
+        """
+        _, _, estimated = self.estimate(model, prompt_text)
+        with self.lock:
+            if model not in self.unpriced and price(self.prices, model) is None:
+                self.unpriced.add(model)
+                if self.prices:
+                    print(f"No price for model {model} in the costs section of {config_store.CONFIG_PATH}, its cost is not counted")
+            if not self.stopped and self.budget is not None and self.cost + self.reserved + estimated > self.budget:
+                self.stopped = True
+                print(f"Budget of {self.format_cost(self.budget)} reached ({self.format_cost(self.cost)} spent, "
+                      f"{self.format_cost(self.reserved)} in progress): no new {self.kind} requests are sent")
+            if self.stopped:
+                raise BudgetExceeded(f"{self.kind} budget of {self.format_cost(self.budget)} reached")
+            self.reserved += estimated
+        return estimated
+
+    def record(self, model, usage, prompt_text='', completion_tokens=None, reserved=0.0):
+        """Count a request sent, from the usage of its response; returns its cost.
+
+        Without usage, the prompt is estimated from `prompt_text` and the
+        completion taken from `completion_tokens` (e.g. the streamed chunks).
+        """
+        usage = usage or {}
+        prompt_tokens = usage.get('prompt_tokens')
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(prompt_text) if prompt_text else 0
+        completion = usage.get('completion_tokens', completion_tokens) or 0
+        request_cost = cost(self.prices, model, prompt_tokens, completion)
+        with self.lock:
+            self.reserved = max(0.0, self.reserved - reserved)
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion
+            self.cost += request_cost
+            totals = self.by_model.setdefault(model, {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0})
+            totals['requests'] += 1
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion
+            totals['cost'] += request_cost
+        return request_cost
+
+    def release(self, reserved):
+        """Give back the reservation of a request that failed."""
+        with self.lock:
+            self.reserved = max(0.0, self.reserved - reserved)
+
+    def format_cost(self, value):
+        return f"{value:.4f} {self.currency}".rstrip()
+
+    def totals(self):
+        """The running totals, as sent in the progress lines."""
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cost': round(self.cost, 6),
+                'budget': self.budget,
+                'currency': self.currency,
+            }
+
+    def summary(self):
+        """One line describing the totals of the run."""
+        budget = f" of a budget of {self.format_cost(self.budget)}" if self.budget is not None else ""
+        return (f"{self.requests} {self.kind} requests, {self.prompt_tokens} prompt + {self.completion_tokens} completion tokens, "
+                f"cost {self.format_cost(self.cost)}{budget}")
+
+def estimate(requests, kind, budget=None, settings=None):
+    """Estimate the tokens and cost of a run from its requests, a list of (model, prompt text).
+
+    Returns the estimate of each model and the totals (model None).
+    """
+    tracker = CostTracker(kind, budget, settings)
+    rows = {}
+    for model, prompt_text in requests:
+        prompt_tokens, completion_tokens, request_cost = tracker.estimate(model, prompt_text)
+        for key in (model, None):
+            row = rows.setdefault(key, {'model': key, 'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0})
+            row['requests'] += 1
+            row['prompt_tokens'] += prompt_tokens
+            row['completion_tokens'] += round(completion_tokens)
+            row['cost'] += request_cost
+    return rows, tracker
+
+def print_estimate(requests, kind, budget=None):
+    """Print the dry-run estimate of a run, model by model."""
+    rows, tracker = estimate(requests, kind, budget)
+    print("*-*-*-*-*-*-*-*-*")
+    if not requests:
+        print(f"No {kind} requests to send")
+        return
+    for model, row in sorted((model, row) for model, row in rows.items() if model is not None):
+        source = "history" if model in tracker.history else "default size"
+        print(f"{model}: {row['requests']} requests, ~{row['prompt_tokens']} prompt + ~{row['completion_tokens']} completion tokens "
+              f"({source}), ~{tracker.format_cost(row['cost'])}")
+    total = rows[None]
+    print(f"Total: {total['requests']} {kind} requests, ~{total['prompt_tokens']} prompt + ~{total['completion_tokens']} completion tokens, "
+          f"~{tracker.format_cost(total['cost'])}")
+    if tracker.budget is not None:
+        verdict = "within" if total['cost'] <= tracker.budget else "OVER"
+        print(f"Estimate {verdict} the budget of {tracker.format_cost(tracker.budget)}")
+    unpriced = sorted(model for model in rows if model is not None and price(tracker.prices, model) is None)
+    if unpriced:
+        print(f"No price for {', '.join(unpriced)}: not counted in the cost")
@@ -0,0 +1,211 @@
+"""Background jobs running app-compare.py and app-anal.py for the setup app.
+
+Only one job runs at a time: asking for a run of the script already
+running returns the running job, so a reconnecting browser or a second tab
+follows the existing run instead of starting another one; asking for
+another script while a job runs raises JobBusy. Each job keeps a buffer
+of numbered events (output lines, progress updates and the final status)
+that any number of followers can read from any position, which is what the
+SSE `Last-Event-ID` resume relies on.
+
+The scripts report their progress on lines starting with PROGRESS_PREFIX
+when run with `--progress` (see `emit_progress`).
+"""
+import sys
+import json
+import time
+import threading
+import itertools
+import subprocess
+
+PROGRESS_PREFIX = '@@progress '
+MAX_BUFFERED_EVENTS = 100000
+KEEPALIVE_SECONDS = 15
+
+def emit_progress(**fields):
+    """Print a progress line for the job runner."""
+    print(PROGRESS_PREFIX + json.dumps(fields), flush=True)
+
+class JobBusy(Exception):
+    """Raised when a script is started while a run of another script is going on."""
+
+    def __init__(self, job):
+        super().__init__(f"{job.script} is already running (job {job.id})")
+        self.job = job
+
+class Job:
+    """One run of a script, with its buffered events."""
+
+    def __init__(self, job_id, script, args):
+        self.id = job_id
+        self.script = script
+        self.args = args
+        self.status = 'running'
+        self.return_code = None
+        self.started = time.time()
+        self.finished = None
+        self.progress = {}
+        self.process = None
+        self.events_base = 0
+        self.buffer = []
+        self.condition = threading.Condition()
+
+    @property
+    def active(self):
+        return self.status in ('running', 'cancelling')
+
+    def add_event(self, event):
+        with self.condition:
+            self.buffer.append(event)
+            if len(self.buffer) > MAX_BUFFERED_EVENTS:
+                # Forget the oldest lines of very long runs
+                drop = len(self.buffer) - MAX_BUFFERED_EVENTS
+                del self.buffer[:drop]
+                self.events_base += drop
+            self.condition.notify_all()
+
+    def events(self, after=-1):
+        """Yield (event id, event) from the event following `after`, until the job ends.
+
+        Yields (None, None) when nothing happened for KEEPALIVE_SECONDS.
+        """
+        position = max(after + 1, 0)
+        while True:
+            with self.condition:
+                if position < self.events_base:
+                    position = self.events_base
+                if position - self.events_base >= len(self.buffer):
+                    if not self.active:
+                        return
+                    self.condition.wait(KEEPALIVE_SECONDS)
+                    pending = self.buffer[position - self.events_base:]
+                else:
+                    pending = self.buffer[position - self.events_base:]
+            if not pending:
+                yield None, None
+            for event in pending:
+                yield position, event
+                position += 1
+
+    def update_progress(self, progress):
+        """Record a progress report of the script, with an estimated time left."""
+        elapsed = time.time() - self.started
+        fraction = progress.get('fraction')
+        if fraction:
+            progress['eta_seconds'] = round(elapsed / fraction * (1 - fraction))
+        progress['elapsed_seconds'] = round(elapsed)
+        self.progress = progress
+        self.add_event({'type': 'progress', **progress})
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'script': self.script,
+            'status': self.status,
+            'return_code': self.return_code,
+            'started': self.started,
+            'finished': self.finished,
+            'progress': self.progress,
+        }
+
+class JobManager:
+    """Start, follow and cancel the script runs, one at a time."""
+
+    def __init__(self, python=sys.executable, cwd=None):
+        self.python = python
+        self.cwd = cwd
+        self.jobs = {}
+        self.current = None
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def start(self, script, args=()):
+        """Start a run of `script`, or return its job already running.
+
+        Returns (job, created); raises JobBusy when another script is running.
+        """
+        with self.lock:
+            if self.current is not None and self.current.active:
+                if self.current.script != script:
+                    raise JobBusy(self.current)
+                return self.current, False
+            job = Job(str(next(self.ids)), script, list(args))
+            self.jobs[job.id] = job
+            self.current = job
+        try:
+            job.process = subprocess.Popen(
+                [self.python, "-u", script, "--verbose", "--progress"] + job.args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                encoding='utf-8',
+                errors='replace',
+                bufsize=1,  # Line buffered
+                cwd=self.cwd,
+            )
+        except Exception as e:
+            job.add_event({'type': 'line', 'text': f"Error occurred: {str(e)}"})
+            self._finish(job, 'failed', None)
+            return job, True
+        threading.Thread(target=self._follow, args=(job,), daemon=True).start()
+        return job, True
+
+    def latest(self, script=None):
+        """Return the most recent job, optionally of one script."""
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if script is None or job.script == script]
+        return max(jobs, key=lambda job: int(job.id)) if jobs else None
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Stop a running job; returns False when it was not running."""
+        job = self.get(job_id)
+        if job is None or job.status != 'running' or job.process is None:
+            return False
+        job.status = 'cancelling'
+        job.process.terminate()
+        return True
+
+    def _follow(self, job):
+        """Read the output of the job's process as it is produced."""
+        process = job.process
+        for line in process.stdout:
+            line = line.rstrip('\n')
+            if line.startswith(PROGRESS_PREFIX):
+                try:
+                    job.update_progress(json.loads(line[len(PROGRESS_PREFIX):]))
+                    continue
+                except ValueError:
+                    pass
+            job.add_event({'type': 'line', 'text': line})
+        process.stdout.close()
+        return_code = process.wait()
+        if job.status == 'cancelling':
+            job.add_event({'type': 'line', 'text': "Script execution cancelled."})
+            self._finish(job, 'cancelled', return_code)
+        elif return_code == 0:
+            job.add_event({'type': 'line', 'text': "Script execution completed successfully."})
+            self._finish(job, 'succeeded', return_code)
+        else:
+            job.add_event({'type': 'line', 'text': f"Script execution failed with return code {return_code}."})
+            self._finish(job, 'failed', return_code)
+
+    def _finish(self, job, status, return_code):
+        # The end event and the status change must be seen together by the followers
+        with job.condition:
+            job.status = status
+            job.return_code = return_code
+            job.finished = time.time()
+            job.add_event({'type': 'end', 'status': status, 'return_code': return_code})
+
+def sse_stream(job, after=-1):
+    """Format the events of a job as server-sent events."""
+    for event_id, event in job.events(after):
+        if event is None:
+            yield ": keepalive\n\n"
+        elif event['type'] == 'line':
+            yield f"id: {event_id}\ndata: {event['text']}\n\n"
+        else:
+            yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,143 @@
+"""Persistent cache of the judge (analysis model) responses.
+
+A judge response only depends on the question, the cleaned candidate answer,
+the target data, the judge model and the prompt template, so app-anal.py
+keys each response on a hash of those and serves unchanged pairs from
+./cache/judge instead of asking the judge again.
+
+The cache is bounded by `judge_cache_max_mb` in ./config/config.yaml
+(default 100); the least recently used entries are evicted first.
+
+Invalidate entries from the command line:
+    python judge_cache.py --question <nom_question>
+    python judge_cache.py --judge <analysis model>
+    python judge_cache.py --clear
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import tempfile
+import config_store
+
+CACHE_FOLDER = './cache/judge'
+DEFAULT_MAX_MB = 100
+
+_lock = threading.Lock()
+_total_size = None
+
+def load_max_bytes():
+    """Load the size bound of the cache from the configuration."""
+    config = config_store.config()
+    return int(float(config.get('judge_cache_max_mb', DEFAULT_MAX_MB)) * 1024 * 1024)
+
+def make_key(question, answer_text, target_data, judge_model, prompt_template):
+    """Hash everything the judge response depends on."""
+    material = json.dumps({
+        'question': question,
+        'answer': answer_text,
+        'target': target_data,
+        'judge': judge_model,
+        'template': prompt_template,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def _entry_path(key):
+    return os.path.join(CACHE_FOLDER, f"{key}.json")
+
+def _entries():
+    """List the cache entries as (path, size, last use) tuples."""
+    if not os.path.isdir(CACHE_FOLDER):
+        return []
+    entries = []
+    with os.scandir(CACHE_FOLDER) as it:
+        for entry in it:
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+    return entries
+
+def get(key):
+    """Return the cached judge response for `key`, or None."""
+    path = _entry_path(key)
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            entry = json.load(file)
+        # The modification time records the last use, for the LRU eviction
+        os.utime(path, None)
+        return entry['response']
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+def put(key, response, question_name=None, judge_model=None):
+    """Store a judge response, evicting old entries beyond the size bound."""
+    global _total_size
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    entry = {
+        'question_name': question_name,
+        'judge_model': judge_model,
+        'created': int(time.time()),
+        'response': response,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_FOLDER, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(entry, file, ensure_ascii=False)
+    with _lock:
+        if _total_size is None:
+            _total_size = sum(size for _, size, _ in _entries())
+        path = _entry_path(key)
+        if os.path.exists(path):
+            _total_size -= os.path.getsize(path)
+        os.replace(tmp_path, path)
+        _total_size += os.path.getsize(path)
+        max_bytes = load_max_bytes()
+        if _total_size > max_bytes:
+            _total_size = _evict(max_bytes)
+
+def _evict(max_bytes):
+    """Delete the least recently used entries until the cache fits."""
+    entries = sorted(_entries(), key=lambda entry: entry[2])
+    total_size = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+        if total_size <= max_bytes:
+            break
+        os.remove(path)
+        total_size -= size
+    return total_size
+
+def invalidate(question_name=None, judge_model=None):
+    """Delete the entries of a question and/or a judge model, or all entries."""
+    global _total_size
+    removed = 0
+    with _lock:
+        for path, _, _ in _entries():
+            if question_name is not None or judge_model is not None:
+                try:
+                    with open(path, 'r', encoding='utf-8') as file:
+                        entry = json.load(file)
+                except ValueError:
+                    entry = {}
+                if question_name is not None and entry.get('question_name') != question_name:
+                    continue
+                if judge_model is not None and entry.get('judge_model') != judge_model:
+                    continue
+            os.remove(path)
+            removed += 1
+        _total_size = None
+    return removed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Invalidate cached judge responses.")
+    parser.add_argument('--question', help="Invalidate the responses for this question")
+    parser.add_argument('--judge', help="Invalidate the responses of this analysis model")
+    parser.add_argument('--clear', action='store_true', help="Invalidate every cached response")
+    args = parser.parse_args()
+
+    if args.question or args.judge or args.clear:
+        removed = invalidate(args.question, args.judge)
+        print(f"Removed {removed} cached judge responses from {CACHE_FOLDER}")
+    else:
+        entries = _entries()
+        print(f"{len(entries)} cached judge responses in {CACHE_FOLDER} ({sum(size for _, size, _ in entries) / (1024 * 1024):.1f} MB)")
@@ -0,0 +1,196 @@
+"""Cached catalog of the models offered by Open WebUI.
+
+The model selection pages used to ask Open WebUI for /api/models twice on
+every page load. The catalog asks once and keeps the enriched models,
+grouped by provider, for `model_catalog_ttl` seconds (./config/config.yaml,
+default 300). Past that, the pages are served the previous catalog while a
+background thread refreshes it, so they only wait on Open WebUI for the very
+first load. `invalidate` drops the catalog, e.g. when the connection
+settings change.
+"""
+import time
+import threading
+import requests
+import config_store
+import owui_client
+
+DEFAULT_TTL = 300
+
+# Provider sections of the model selection page, in display order
+PROVIDER_SECTIONS = ['Ollama - Offine', 'Anthropic', 'Google', 'OpenAI', 'Mistral', 'Perplexity', 'Autre']
+
+def load_ttl():
+    """Load how long the catalog stays fresh, in seconds."""
+    return float(config_store.config().get('model_catalog_ttl', DEFAULT_TTL))
+
+def enrich_model(model):
+    """Extract what the pages show of a model from its /api/models entry."""
+    # Base model information
+    enriched_model = {
+        'id': model.get('id', 'Unknown'),
+        'name': model.get('name', model.get('id', 'Unnamed Model')),
+        'owned_by': model.get('owned_by', 'Unknown'),
+        'created': model.get('created', 0),
+        'details': {}  # Initialize details dictionary
+    }
+    # Detailed description and capabilities
+    if 'info' in model and 'meta' in model['info']:
+        meta = model['info']['meta']
+        enriched_model['description'] = meta.get('description', '')
+        enriched_model['profile_image'] = meta.get('profile_image_url', '')
+    # Ollama-specific details
+    if 'ollama' in model:
+        ollama_details = model['ollama'].get('details', {})
+        enriched_model['model_type'] = 'Ollama'
+        enriched_model['details'] = {
+            'format': ollama_details.get('format', 'Unknown'),
+            'family': ollama_details.get('family', 'Unknown'),
+            'parameter_size': ollama_details.get('parameter_size', 'Unknown'),
+            'quantization_level': ollama_details.get('quantization_level', 'Unknown')
+        }
+        enriched_model['size'] = model['ollama'].get('size', 0)
+        enriched_model['modified_at'] = model['ollama'].get('modified_at', '')
+    # OpenAI-specific details
+    elif 'openai' in model:
+        enriched_model['model_type'] = 'OpenAI'
+        openai_details = model['openai']
+        enriched_model['details'] = {
+            'family': 'GPT',
+            'parameter_size': 'Variable'
+        }
+        enriched_model['openai_details'] = {
+            'id': openai_details.get('id', ''),
+            'object': openai_details.get('object', ''),
+            'owned_by': openai_details.get('owned_by', '')
+        }
+    # Google-specific details
+    elif 'Google' in enriched_model['name']:
+        enriched_model['model_type'] = 'Google'
+        enriched_model['details'] = {
+            'family': 'Gemini/PaLM',
+            'parameter_size': 'Variable'
+        }
+    # Perplexity-specific details
+    elif 'perplexity' in enriched_model['name']:
+        enriched_model['model_type'] = 'Perplexity'
+        enriched_model['details'] = {
+            'family': 'Perplexity',
+            'parameter_size': 'Variable'
+        }                     
+    # Anthropic-specific details
+    elif 'anthropic' in enriched_model['name'].lower() or 'claude' in enriched_model['name'].lower():
+        enriched_model['model_type'] = 'Anthropic'
+        enriched_model['details'] = {
+            'family': 'Claude',
+            'parameter_size': 'Variable'
+        }
+    # Mistral-specific details
+    elif 'mistral' in enriched_model['name'].lower():
+        enriched_model['model_type'] = 'Mistral'
+        enriched_model['details'] = {
+            'family': 'Mistral',
+            'parameter_size': 'Variable'
+        }
+
+    return enriched_model
+
+def enrich_models(response_data):
+    """Enrich every model of an /api/models response, sorted by name."""
+    models_data = response_data.get('data', [])
+    models_data.sort(key=lambda x: x.get('name', ''))
+    return [enrich_model(model) for model in models_data]
+
+def group_by_provider(models):
+    """Group the models by provider for the model selection page."""
+    providers = {section: [] for section in PROVIDER_SECTIONS}
+    for model in models:
+        model_name = model['name'].lower()
+        if 'google' in model_name or 'gemini' in model_name:
+            providers['Google'].append(model)
+        elif 'anthropic' in model_name or 'claude' in model_name:
+            providers['Anthropic'].append(model)
+        elif 'perplexity' in model_name:
+            providers['Perplexity'].append(model)
+        elif model.get('model_type') == 'OpenAI':
+            providers['OpenAI'].append(model)
+        elif model.get('model_type') == 'Ollama':
+            providers['Ollama - Offine'].append(model)
+        elif 'mistral' in model_name or model.get('model_type') == 'Mistral':
+            providers['Mistral'].append(model)
+        else:
+            providers['Autre'].append(model)
+    return providers
+
+class ModelCatalog:
+    """The enriched models and their grouping by provider, refreshed after a TTL."""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.models = None
+        self.providers = None
+        self.fetched = 0.0
+        self.generation = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def _ttl(self):
+        return self.ttl if self.ttl is not None else load_ttl()
+
+    def _fetch(self):
+        """Ask Open WebUI for its models; returns None when that failed."""
+        try:
+            response = owui_client.get('/api/models')
+        except requests.RequestException as e:
+            print(f"Failed to fetch models: {e}")
+            return None
+        if response.status_code != 200:
+            print(f"Failed to fetch models: {response.status_code} - {response.text}")
+            return None
+        try:
+            return response.json()
+        except ValueError as e:
+            print(f"Error parsing JSON: {e}")
+            return None
+
+    def update(self, response_data, generation=None):
+        """Replace the catalog with the body of an /api/models response; returns (models, providers)."""
+        models = enrich_models(response_data)
+        providers = group_by_provider(models)
+        with self.lock:
+            # A response fetched before an invalidation may come from another server
+            if generation is None or generation == self.generation:
+                self.models = models
+                self.providers = providers
+                self.fetched = time.monotonic()
+        return models, providers
+
+    def _refresh(self, generation):
+        try:
+            response_data = self._fetch()
+            if response_data is not None:
+                self.update(response_data, generation)
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def get(self):
+        """Return (models, providers), fetching them only when there is no catalog yet."""
+        with self.lock:
+            models, providers, generation = self.models, self.providers, self.generation
+            stale = models is not None and time.monotonic() - self.fetched > self._ttl()
+            if stale and not self.refreshing:
+                self.refreshing = True
+                threading.Thread(target=self._refresh, args=(generation,), daemon=True).start()
+        if models is not None:
+            return models, providers
+        response_data = self._fetch()
+        if response_data is None:
+            return [], group_by_provider([])
+        return self.update(response_data, generation)
+
+    def invalidate(self):
+        """Forget the catalog; the next `get` fetches it again."""
+        with self.lock:
+            self.models = None
+            self.providers = None
+            self.generation += 1
@@ -0,0 +1,153 @@
+"""Shared HTTP client for the Open WebUI API.
+
+All the scripts send their requests through a single pooled session so that
+connections to Open WebUI are kept alive and reused between requests.
+The pool can be tuned in ./config/config.yaml:
+
+    http:
+      pool_size: 10     # connections kept open to Open WebUI
+      http2: false      # requires the optional 'httpx[http2]' package
+      timeout: null     # seconds, null to wait forever
+"""
+import threading
+import contextlib
+import requests
+import config_store
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+
+_lock = threading.Lock()
+_client = None
+_settings = None
+_min_pool_size = 0
+
+def format_token(token):
+    """Ensure token is in the correct format."""
+    if not token.startswith('sk-'):
+        token = f'sk-{token}'
+    return token
+
+def load_http_settings():
+    """Load the connection settings and the HTTP pool options."""
+    connect = config_store.connect_owui()
+    if not connect or not connect.get('open_webui'):
+        raise FileNotFoundError(f"No Open WebUI connection settings in {config_store.CONNECT_OWUI_PATH}")
+    http = config_store.config().get('http', {}) or {}
+    return {
+        'api_key': connect['open_webui']['api_key'],
+        'base_url': connect['open_webui']['location'].rstrip('/'),
+        'pool_size': max(int(http.get('pool_size', DEFAULT_POOL_SIZE)), _min_pool_size),
+        'http2': bool(http.get('http2', False)),
+        'timeout': http.get('timeout'),
+    }
+
+def _build_client(settings):
+    headers = {
+        'Authorization': f"Bearer {format_token(settings['api_key'])}",
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+    if settings['http2']:
+        try:
+            import httpx
+            limits = httpx.Limits(max_connections=settings['pool_size'],
+                                  max_keepalive_connections=settings['pool_size'])
+            return httpx.Client(http2=True, headers=headers, limits=limits, timeout=settings['timeout'])
+        except ImportError:
+            print("HTTP/2 requested but 'httpx[http2]' is not installed, falling back to HTTP/1.1")
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=settings['pool_size'], pool_maxsize=settings['pool_size'])
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _current():
+    global _client, _settings
+    with _lock:
+        if _client is None:
+            _settings = load_http_settings()
+            _client = _build_client(_settings)
+        return _client, _settings
+
+def get_client():
+    """Return the shared client, creating it on first use."""
+    return _current()[0]
+
+def reset():
+    """Close the shared client; the next request reloads the configuration."""
+    global _client, _settings
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _settings = None
+
+def configure(pool_size=None):
+    """Make sure the pool holds at least `pool_size` connections."""
+    global _min_pool_size
+    if pool_size and pool_size > _min_pool_size:
+        _min_pool_size = pool_size
+        if _settings is not None and _settings['pool_size'] < pool_size:
+            reset()
+
+def api_url(path):
+    """Return the full URL of an Open WebUI API path."""
+    return f"{_current()[1]['base_url']}{path}"
+
+def get(path, **kwargs):
+    """Send a GET request to the Open WebUI API."""
+    return _request('GET', path, **kwargs)
+
+def post(path, payload, **kwargs):
+    """Send a JSON POST request to the Open WebUI API."""
+    return _request('POST', path, json=payload, **kwargs)
+
+def _request(method, path, **kwargs):
+    client, settings = _current()
+    url = f"{settings['base_url']}{path}"
+    kwargs.setdefault('timeout', settings['timeout'])
+    if isinstance(client, requests.Session):
+        return client.request(method, url, **kwargs)
+    import httpx
+    try:
+        return client.request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        # Callers only know about requests' exceptions
+        raise requests.exceptions.ConnectionError(str(e)) from e
+
+@contextlib.contextmanager
+def post_stream(path, payload):
+    """Send a JSON POST request whose response body is read as it arrives."""
+    client, settings = _current()
+    url = f"{settings['base_url']}{path}"
+    if isinstance(client, requests.Session):
+        response = client.post(url, json=payload, stream=True, timeout=settings['timeout'])
+        try:
+            yield response
+        finally:
+            response.close()
+        return
+    import httpx
+    try:
+        with client.stream('POST', url, json=payload, timeout=settings['timeout']) as response:
+            if response.status_code >= 400:
+                # Make the error body available to the caller
+                response.read()
+            yield response
+    except httpx.HTTPError as e:
+        raise requests.exceptions.ConnectionError(str(e)) from e
+
+def iter_lines(response):
+    """Yield the decoded lines of a streamed response."""
+    if isinstance(response, requests.Response):
+        for line in response.iter_lines():
+            yield line.decode('utf-8')
+    else:
+        yield from response.iter_lines()
+
+def check_status(response):
+    """Raise requests' HTTPError for an error status, whatever the client."""
+    if response.status_code >= 400:
+        raise requests.exceptions.HTTPError(f"{response.status_code} Error for url: {response.url}", response=response)
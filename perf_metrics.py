@@ -0,0 +1,147 @@
+"""Per-request performance records and the per-model benchmark report.
+
+app-compare.py appends one JSON line per request to ./metrics/requests.jsonl
+(latency, HTTP status, retries, token usage and cost, failed requests
+included); app-anal.py does the same for the judge requests (kind 'judge').
+`aggregate` turns those records into a per-model table of latency
+percentiles, tokens/sec and error rate; the numeric work is done on numpy
+arrays so that it stays fast over tens of thousands of records.
+"""
+import os
+import csv
+import json
+import time
+import threading
+import numpy as np
+
+METRICS_FOLDER = './metrics'
+REQUESTS_LOG = os.path.join(METRICS_FOLDER, 'requests.jsonl')
+REPORT_CSV = os.path.join(METRICS_FOLDER, 'performance.csv')
+REPORT_JSON = os.path.join(METRICS_FOLDER, 'performance.json')
+
+REPORT_COLUMNS = [
+    'model', 'requests', 'errors', 'error_rate',
+    'latency_p50', 'latency_p90', 'latency_p99',
+    'ttft_p50', 'tokens_per_sec', 'prompt_tokens', 'completion_tokens', 'cost',
+]
+
+# Identifies the records of the current process' run
+RUN_ID = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+_lock = threading.Lock()
+
+def record_request(model, status, latency, ok, usage=None, ttft=None, tokens_per_sec=None, retries=0, kind='compare', stream=False, cost=None):
+    """Append the record of one request to the requests log."""
+    usage = usage or {}
+    record = {
+        'ts': time.time(),
+        'run': RUN_ID,
+        'kind': kind,
+        'model': model,
+        'status': status,
+        'ok': ok,
+        'latency': latency,
+        'ttft': ttft,
+        'tokens_per_sec': tokens_per_sec,
+        'retries': retries,
+        'stream': stream,
+        'prompt_tokens': usage.get('prompt_tokens'),
+        'completion_tokens': usage.get('completion_tokens'),
+        'cost': cost,
+    }
+    line = json.dumps(record) + '\n'
+    with _lock:
+        os.makedirs(METRICS_FOLDER, exist_ok=True)
+        with open(REQUESTS_LOG, 'a', encoding='utf-8') as file:
+            file.write(line)
+
+def load_records(path=REQUESTS_LOG, kind='compare', run=None, since=None):
+    """Load the request records, optionally for one run or after a timestamp."""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if kind is not None and record.get('kind') != kind:
+                continue
+            if run is not None and record.get('run') != run:
+                continue
+            if since is not None and record.get('ts', 0) < since:
+                continue
+            records.append(record)
+    return records
+
+def last_run(records):
+    """Return the id of the most recent run in the records."""
+    return max(records, key=lambda record: record['ts'])['run'] if records else None
+
+def _column(records, key):
+    """Extract a numeric column, missing values as NaN."""
+    return np.array([record.get(key) if record.get(key) is not None else np.nan for record in records], dtype=float)
+
+def _round(value, digits=3):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+def aggregate(records):
+    """Aggregate the records into one performance row per model."""
+    if not records:
+        return []
+    models, model_index = np.unique([record['model'] for record in records], return_inverse=True)
+    ok = np.array([bool(record.get('ok')) for record in records])
+    latency = _column(records, 'latency')
+    ttft = _column(records, 'ttft')
+    tokens_per_sec = _column(records, 'tokens_per_sec')
+    prompt_tokens = _column(records, 'prompt_tokens')
+    completion_tokens = _column(records, 'completion_tokens')
+    request_costs = _column(records, 'cost')
+
+    counts = np.bincount(model_index, minlength=len(models))
+    errors = np.bincount(model_index, weights=~ok, minlength=len(models))
+    prompt_sums = np.bincount(model_index, weights=np.nan_to_num(prompt_tokens), minlength=len(models))
+    completion_sums = np.bincount(model_index, weights=np.nan_to_num(completion_tokens), minlength=len(models))
+    cost_sums = np.bincount(model_index, weights=np.nan_to_num(request_costs), minlength=len(models))
+
+    # Group the successful requests by model with a single sort; latency and
+    # throughput only make sense for them
+    order = np.argsort(model_index[ok], kind='stable')
+    bounds = np.cumsum(np.bincount(model_index[ok], minlength=len(models)))[:-1]
+    latency_groups = np.split(latency[ok][order], bounds)
+    ttft_groups = np.split(ttft[ok][order], bounds)
+    tps_groups = np.split(tokens_per_sec[ok][order], bounds)
+
+    rows = []
+    for i, model in enumerate(models):
+        model_latency = latency_groups[i][~np.isnan(latency_groups[i])]
+        p50, p90, p99 = np.percentile(model_latency, [50, 90, 99]) if model_latency.size else (np.nan,) * 3
+        model_ttft = ttft_groups[i][~np.isnan(ttft_groups[i])]
+        model_tps = tps_groups[i][~np.isnan(tps_groups[i])]
+        rows.append({
+            'model': str(model),
+            'requests': int(counts[i]),
+            'errors': int(errors[i]),
+            'error_rate': _round(errors[i] / counts[i], 4),
+            'latency_p50': _round(p50),
+            'latency_p90': _round(p90),
+            'latency_p99': _round(p99),
+            'ttft_p50': _round(np.median(model_ttft)) if model_ttft.size else None,
+            'tokens_per_sec': _round(np.mean(model_tps), 1) if model_tps.size else None,
+            'prompt_tokens': int(prompt_sums[i]),
+            'completion_tokens': int(completion_sums[i]),
+            'cost': _round(cost_sums[i], 6),
+        })
+    rows.sort(key=lambda row: (row['latency_p50'] is None, row['latency_p50'] or 0))
+    return rows
+
+def write_report(rows, csv_path=REPORT_CSV, json_path=REPORT_JSON):
+    """Write the performance table as CSV and JSON."""
+    os.makedirs(os.path.dirname(csv_path) or '.', exist_ok=True)
+    with open(csv_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(json_path, 'w', encoding='utf-8') as file:
+        json.dump(rows, file, indent=2)
@@ -0,0 +1,207 @@
+"""Local pre-scoring of the answers, before the analysis model.
+
+For each question, every answer is compared with the target data, all the
+answers of the question at once with numpy:
+
+- `coverage`: share of the items of `infos_cruciales` found in the answer
+  (an item is found when most of its words are in the answer);
+- `forbidden_hits`: number of items of `infos_a_eviter` found in the answer;
+- `similarity`: cosine similarity of the words of the answer and of
+  `reponse_cible`, weighted by idf over the answers of the question;
+- `tokens` and `truncated`: the length of the answer and whether the model
+  stopped on its length limit.
+
+Words are compared without accents, case and short French stop words, so
+this is a lexical measure only: a negated piece of information is still
+"found". The scores are recorded with the verdicts. With `mode: triage`,
+the clear cases are graded locally instead of being sent to the judge
+(empty or truncated answers and answers missing nearly everything fail,
+answers covering nearly everything pass), and `judge_budget` caps the
+number of answers judged per question, the most ambiguous first. Settings
+in ./config/config.yaml, with the defaults of DEFAULT_SETTINGS:
+
+    prescore:
+      mode: triage            # off, record (default) or triage
+      pass_coverage: 0.9
+      pass_similarity: 0.5
+      fail_coverage: 0.1
+      fail_similarity: 0.1
+      judge_budget: 5
+"""
+import re
+import json
+import unicodedata
+import numpy as np
+import config_store
+
+MODES = ('off', 'record', 'triage')
+
+DEFAULT_SETTINGS = {
+    'mode': 'record',
+    # Share of the words of an item that must be in the answer
+    'item_match': 0.6,
+    'forbidden_match': 0.8,
+    # Below this many words, an answer is empty
+    'min_tokens': 5,
+    'pass_coverage': 0.9,
+    'pass_similarity': 0.5,
+    'fail_coverage': 0.1,
+    'fail_similarity': 0.1,
+    # Answers judged per question at most (None: all the ambiguous ones)
+    'judge_budget': None,
+}
+
+STOP_WORDS = set("""
+au aux avec ce ces cette dans de des du elle en est et il ils la le les leur lui mais
+ne ni nous on ou par pas pour qu que qui sa se ses son sont sur ta te un une vous
+the and of to in is are for
+""".split())
+
+def load_settings():
+    """Load the pre-scoring settings from the configuration."""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config_store.config().get('prescore') or {})
+    if settings['mode'] not in MODES:
+        print(f"Unknown prescore mode '{settings['mode']}', expected one of {', '.join(MODES)}; using 'record'")
+        settings['mode'] = 'record'
+    return settings
+
+def words(text):
+    """The words of a text, lower case, without accents and stop words."""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return [word for word in re.findall(r'\w+', text) if len(word) > 1 and word not in STOP_WORDS]
+
+def items(text):
+    """Split a list of pieces of information (lines, bullets, semicolons) into items."""
+    parts = re.split(r'[\n;•]+|(?:^|\s)[-*]\s|\d+[.)]\s', text or '')
+    return [part.strip() for part in parts if words(part)]
+
+def _matrix(texts, vocabulary):
+    """Word counts of each text, one row per text."""
+    counts = np.zeros((len(texts), len(vocabulary)))
+    for row, text in enumerate(texts):
+        for word in text:
+            counts[row, vocabulary[word]] += 1
+    return counts
+
+def _found(answers, item_words, vocabulary, match):
+    """(answers x items) booleans: is the item found in the answer."""
+    if not item_words:
+        return np.zeros((answers.shape[0], 0), dtype=bool)
+    item_matrix = _matrix(item_words, vocabulary) > 0
+    present = (answers > 0).astype(float) @ item_matrix.T.astype(float)
+    return present / item_matrix.sum(axis=1) >= match
+
+def score_answers(answers, target_answer, infos_cruciales, infos_a_eviter, settings=None):
+    """Pre-score the answers to one question; `answers` maps a model to (text, truncated).
+
+    Returns a dict mapping each model to its local scores.
+    """
+    settings = settings or load_settings()
+    models = list(answers)
+    if not models:
+        return {}
+    answer_words = [words(answers[model][0]) for model in models]
+    target_words = words(target_answer)
+    crucial_words = [words(item) for item in items(infos_cruciales)]
+    forbidden_words = [words(item) for item in items(infos_a_eviter)]
+    vocabulary = {}
+    for text in answer_words + [target_words] + crucial_words + forbidden_words:
+        for word in text:
+            vocabulary.setdefault(word, len(vocabulary))
+
+    answer_matrix = _matrix(answer_words, vocabulary)
+    crucial = _found(answer_matrix, crucial_words, vocabulary, settings['item_match'])
+    forbidden = _found(answer_matrix, forbidden_words, vocabulary, settings['forbidden_match'])
+    coverage = crucial.mean(axis=1) if crucial_words else np.full(len(models), np.nan)
+
+    # idf over the answers and the target, then cosine with the target
+    documents = np.vstack([answer_matrix, _matrix([target_words], vocabulary)])
+    idf = np.log((1 + len(documents)) / (1 + (documents > 0).sum(axis=0))) + 1
+    weighted = np.log1p(documents) * idf
+    norms = np.linalg.norm(weighted, axis=1)
+    dots = weighted[:-1] @ weighted[-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        similarity = np.where(norms[:-1] * norms[-1] > 0, dots / (norms[:-1] * norms[-1]), 0.0)
+
+    scores = {}
+    for row, model in enumerate(models):
+        scores[model] = {
+            'coverage': None if np.isnan(coverage[row]) else round(float(coverage[row]), 3),
+            'forbidden_hits': int(forbidden[row].sum()),
+            'similarity': round(float(similarity[row]), 3),
+            'tokens': len(answer_words[row]),
+            'truncated': bool(answers[model][1]),
+        }
+    return scores
+
+def local_grade(prescore):
+    """A 0-10 grade from the local scores alone."""
+    coverage = prescore['coverage'] if prescore['coverage'] is not None else prescore['similarity']
+    grade = 10 * (0.7 * coverage + 0.3 * prescore['similarity'])
+    if prescore['forbidden_hits']:
+        grade = grade / 2
+    return round(grade, 1)
+
+def decision(prescore, settings):
+    """'pass', 'fail' or None (ambiguous: for the judge) for one answer."""
+    if prescore['tokens'] < settings['min_tokens'] or prescore['truncated']:
+        return 'fail'
+    coverage = prescore['coverage'] if prescore['coverage'] is not None else prescore['similarity']
+    if coverage <= settings['fail_coverage'] and prescore['similarity'] <= settings['fail_similarity']:
+        return 'fail'
+    if (coverage >= settings['pass_coverage'] and prescore['similarity'] >= settings['pass_similarity']
+            and not prescore['forbidden_hits']):
+        return 'pass'
+    return None
+
+def ambiguity(prescore):
+    """How far an answer is from a clear case; the judge budget goes to the highest."""
+    return -abs(local_grade(prescore) - 5)
+
+def triage(prescores, settings):
+    """Split the answers between the judge and local grading.
+
+    Returns (to_judge, graded): the models to send to the judge, most
+    ambiguous first, and a dict mapping the other models to the reason
+    they were graded locally ('pass', 'fail' or 'budget').
+    """
+    graded = {}
+    to_judge = []
+    for model, prescore in prescores.items():
+        verdict = decision(prescore, settings)
+        if verdict is None:
+            to_judge.append(model)
+        else:
+            graded[model] = verdict
+    to_judge.sort(key=lambda model: ambiguity(prescores[model]), reverse=True)
+    budget = settings['judge_budget']
+    if budget is not None and len(to_judge) > budget:
+        for model in to_judge[budget:]:
+            graded[model] = 'budget'
+        to_judge = to_judge[:budget]
+    return to_judge, graded
+
+REASONS = {
+    'pass': "la réponse couvre les informations cruciales et ressemble à la réponse attendue",
+    'fail': "la réponse est vide, tronquée ou ne contient presque rien de la réponse attendue",
+    'budget': "réponse non soumise au modèle d'analyse (budget d'évaluation atteint)",
+}
+
+def local_analysis(prescore, reason):
+    """The text recorded as the analysis of a locally graded answer, ending with the scores like a judge verdict."""
+    coverage = prescore['coverage'] if prescore['coverage'] is not None else prescore['similarity']
+    if reason == 'fail':
+        grade = min(local_grade(prescore), 2.0)
+    elif reason == 'pass':
+        grade = max(local_grade(prescore), 8.0)
+    else:
+        grade = local_grade(prescore)
+    scores = {
+        'couverture_infos_cruciales': round(10 * coverage, 1),
+        'infos_a_eviter_presentes': prescore['forbidden_hits'] > 0,
+        'note_globale': grade,
+    }
+    return (f"Évaluation locale, sans modèle d'analyse: {REASONS[reason]}.\n"
+            f"{json.dumps(scores, ensure_ascii=False)}")
@@ -0,0 +1,129 @@
+"""In-memory index of the questions and their target data.
+
+The listing pages of app-setup-questions.py are served from the index
+instead of reading every ./questions/<nom>.q and ./targets/<nom>.t file on
+each page load. The web interface updates the index itself when it saves or
+deletes a question (`update`, `remove`); changes made outside of it are
+picked up from the modification times: a changed folder (file added,
+removed or replaced) triggers a scan of the file modification times, and
+only the files that changed are read again. In-place edits that leave the
+folders untouched are caught by the same scan, done at most every
+RESCAN_SECONDS.
+"""
+import os
+import json
+import time
+import threading
+
+QUESTIONS_FOLDER = './questions'
+TARGETS_FOLDER = './targets'
+RESCAN_SECONDS = 30
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+class QuestionIndex:
+    """Questions and target data, kept in memory and revalidated by mtime."""
+
+    def __init__(self, questions_folder=QUESTIONS_FOLDER, targets_folder=TARGETS_FOLDER):
+        self.questions_folder = questions_folder
+        self.targets_folder = targets_folder
+        self.entries = {}
+        self.file_mtimes = {}
+        self.folder_mtimes = None
+        self.scanned = 0.0
+        self.sorted_entries = None
+        self.lock = threading.RLock()
+
+    def _question_path(self, nom_question):
+        return os.path.join(self.questions_folder, f"{nom_question}.q")
+
+    def _target_path(self, nom_question):
+        return os.path.join(self.targets_folder, f"{nom_question}.t")
+
+    def _read(self, nom_question):
+        """Read the question and target files of one question."""
+        try:
+            with open(self._question_path(nom_question), 'r', encoding="utf-8") as file:
+                question_content = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            with open(self._target_path(nom_question), 'r', encoding="utf-8") as file:
+                target_data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            target_data = None
+        return {
+            'nom_question': nom_question,
+            'question_content': question_content,
+            'target_data': target_data,
+            'first_paragraph': question_content.split('\n')[0] if question_content else '',
+        }
+
+    def _scan(self):
+        """Read the questions whose files changed since the last scan."""
+        names = set()
+        if os.path.isdir(self.questions_folder):
+            names = {f[:-2] for f in os.listdir(self.questions_folder) if f.endswith('.q')}
+        for nom_question in list(self.entries):
+            if nom_question not in names:
+                del self.entries[nom_question]
+                self.file_mtimes.pop(nom_question, None)
+        for nom_question in names:
+            mtimes = (_mtime(self._question_path(nom_question)), _mtime(self._target_path(nom_question)))
+            if self.file_mtimes.get(nom_question) != mtimes or nom_question not in self.entries:
+                entry = self._read(nom_question)
+                if entry is None:
+                    continue
+                self.entries[nom_question] = entry
+                self.file_mtimes[nom_question] = mtimes
+        self.sorted_entries = None
+        self.scanned = time.monotonic()
+
+    def refresh(self):
+        """Bring the index up to date with the folders, when they changed."""
+        with self.lock:
+            folder_mtimes = (_mtime(self.questions_folder), _mtime(self.targets_folder))
+            if folder_mtimes != self.folder_mtimes or time.monotonic() - self.scanned > RESCAN_SECONDS:
+                self._scan()
+                self.folder_mtimes = folder_mtimes
+
+    def all(self):
+        """Return every question, sorted by name."""
+        self.refresh()
+        with self.lock:
+            if self.sorted_entries is None:
+                self.sorted_entries = sorted(self.entries.values(), key=lambda x: x['nom_question'].lower())
+            return self.sorted_entries
+
+    def names(self):
+        """Return the names of every question, sorted."""
+        return [entry['nom_question'] for entry in self.all()]
+
+    def get(self, nom_question):
+        """Return one question, or None."""
+        self.refresh()
+        with self.lock:
+            return self.entries.get(nom_question)
+
+    def update(self, nom_question):
+        """Read again a question that was just saved."""
+        with self.lock:
+            entry = self._read(nom_question)
+            if entry is None:
+                self.entries.pop(nom_question, None)
+                self.file_mtimes.pop(nom_question, None)
+            else:
+                self.entries[nom_question] = entry
+                self.file_mtimes[nom_question] = (_mtime(self._question_path(nom_question)), _mtime(self._target_path(nom_question)))
+            self.sorted_entries = None
+
+    def remove(self, nom_question):
+        """Forget a deleted question."""
+        with self.lock:
+            self.entries.pop(nom_question, None)
+            self.file_mtimes.pop(nom_question, None)
+            self.sorted_entries = None
@@ -0,0 +1,308 @@
+"""Structured judge scores and the model leaderboard.
+
+The judge ends each evaluation with a JSON object of per-criterion scores.
+`parse_scores` extracts and validates it, and the scores of every
+(question, model) pair are kept in the columnar file ./analysis/results.csv,
+one row per pair (the latest analysis wins). `leaderboard` aggregates them
+per model with numpy, with bootstrap confidence intervals on the mean grade.
+
+When a model answered a question several times (app-compare.py --samples),
+its results row holds the mean of the samples' scores, and the spread of
+the samples is kept in ./analysis/samples.csv, one row per pair: mean and
+variance of the grades and of the latency, and how alike the answers are
+(mean Jaccard similarity of their words, share of identical answers).
+`stability` aggregates these rows per model into ./analysis/stability.csv.
+"""
+import os
+import re
+import csv
+import json
+import time
+import tempfile
+import numpy as np
+
+ANALYSIS_FOLDER = './analysis'
+RESULTS_CSV = os.path.join(ANALYSIS_FOLDER, 'results.csv')
+LEADERBOARD_CSV = os.path.join(ANALYSIS_FOLDER, 'leaderboard.csv')
+SAMPLES_CSV = os.path.join(ANALYSIS_FOLDER, 'samples.csv')
+STABILITY_CSV = os.path.join(ANALYSIS_FOLDER, 'stability.csv')
+
+SCORE_FIELDS = ['couverture_infos_cruciales', 'infos_a_eviter_presentes', 'note_globale']
+RESULT_COLUMNS = ['question', 'model', 'judge', 'valid'] + SCORE_FIELDS + ['analysed_at']
+LEADERBOARD_COLUMNS = [
+    'model', 'questions', 'valid_scores',
+    'note_globale_moyenne', 'note_globale_ic_bas', 'note_globale_ic_haut',
+    'couverture_moyenne', 'taux_infos_a_eviter',
+]
+
+SAMPLE_STATS = [
+    'note_globale_moyenne', 'note_globale_variance', 'couverture_moyenne', 'couverture_variance',
+    'latence_moyenne', 'latence_variance', 'similarite_reponses', 'reponses_identiques',
+]
+SAMPLE_COLUMNS = ['question', 'model', 'samples', 'valid_scores'] + SAMPLE_STATS + ['analysed_at']
+STABILITY_COLUMNS = ['model', 'questions', 'samples'] + SAMPLE_STATS
+
+BOOTSTRAP_SAMPLES = 2000
+CONFIDENCE = 0.95
+
+def _as_grade(value):
+    """Validate a 0-10 grade."""
+    if isinstance(value, bool):
+        return None
+    try:
+        grade = float(value)
+    except (TypeError, ValueError):
+        return None
+    return grade if 0 <= grade <= 10 else None
+
+def _as_flag(value):
+    """Validate a yes/no answer."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ('true', 'oui', 'vrai', 'yes', 'false', 'non', 'faux', 'no'):
+        return value.strip().lower() in ('true', 'oui', 'vrai', 'yes')
+    return None
+
+def parse_scores(analysis):
+    """Extract the scores from a judge evaluation; returns None when missing or invalid."""
+    if not isinstance(analysis, str):
+        return None
+    # The scores are the last JSON object mentioning the overall grade
+    for match in reversed(list(re.finditer(r'\{[^{}]*"note_globale"[^{}]*\}', analysis))):
+        try:
+            raw = json.loads(match.group(0))
+        except ValueError:
+            continue
+        scores = {
+            'couverture_infos_cruciales': _as_grade(raw.get('couverture_infos_cruciales')),
+            'infos_a_eviter_presentes': _as_flag(raw.get('infos_a_eviter_presentes')),
+            'note_globale': _as_grade(raw.get('note_globale')),
+        }
+        if all(value is not None for value in scores.values()):
+            return scores
+    return None
+
+def make_row(question_name, model, judge, analysis):
+    """Build the results row of one judged answer."""
+    scores = parse_scores(analysis)
+    row = {'question': question_name, 'model': model, 'judge': judge, 'valid': scores is not None,
+           'analysed_at': int(time.time())}
+    row.update(scores or {field: None for field in SCORE_FIELDS})
+    return row
+
+def make_samples_row(question_name, model, judge, analyses):
+    """Build the results row of a model answering several times: the mean of the valid scores."""
+    scores = [score for score in (parse_scores(analysis) for analysis in analyses) if score is not None]
+    row = {'question': question_name, 'model': model, 'judge': judge, 'valid': bool(scores),
+           'analysed_at': int(time.time())}
+    if scores:
+        row['couverture_infos_cruciales'] = round(float(np.mean([score['couverture_infos_cruciales'] for score in scores])), 2)
+        row['note_globale'] = round(float(np.mean([score['note_globale'] for score in scores])), 2)
+        # Present when most samples have it
+        row['infos_a_eviter_presentes'] = bool(np.mean([score['infos_a_eviter_presentes'] for score in scores]) > 0.5)
+    else:
+        row.update({field: None for field in SCORE_FIELDS})
+    return row
+
+def _variance(values):
+    """Sample variance, None below two values."""
+    values = [value for value in values if value is not None]
+    return round(float(np.var(values, ddof=1)), 3) if len(values) > 1 else None
+
+def _mean(values):
+    values = [value for value in values if value is not None]
+    return round(float(np.mean(values)), 3) if values else None
+
+def make_sample_stats_row(question_name, model, analyses, latencies, texts, words):
+    """Build the samples.csv row of a model answering several times.
+
+    `analyses`, `latencies`, `texts` and `words` (the words of each text)
+    list the samples in the same order.
+    """
+    scores = [score for score in (parse_scores(analysis) for analysis in analyses) if score is not None]
+    grades = [score['note_globale'] for score in scores]
+    coverages = [score['couverture_infos_cruciales'] for score in scores]
+
+    # Pairwise Jaccard similarity of the word sets, from one matrix product
+    vocabulary = {word: i for i, word in enumerate(sorted(set().union(*map(set, words))))} if words else {}
+    present = np.zeros((len(words), len(vocabulary)))
+    for row, sample_words in enumerate(words):
+        present[row, [vocabulary[word] for word in set(sample_words)]] = 1
+    intersection = present @ present.T
+    sizes = present.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - intersection
+    pairs = np.triu_indices(len(words), k=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jaccard = np.where(union[pairs] > 0, intersection[pairs] / union[pairs], 1.0)
+    normalized = [' '.join(text.split()) for text in texts]
+    identical = [normalized[i] == normalized[j] for i, j in zip(*pairs)]
+
+    return {
+        'question': question_name,
+        'model': model,
+        'samples': len(analyses),
+        'valid_scores': len(scores),
+        'note_globale_moyenne': _mean(grades),
+        'note_globale_variance': _variance(grades),
+        'couverture_moyenne': _mean(coverages),
+        'couverture_variance': _variance(coverages),
+        'latence_moyenne': _mean(latencies),
+        'latence_variance': _variance(latencies),
+        'similarite_reponses': round(float(jaccard.mean()), 3) if jaccard.size else None,
+        'reponses_identiques': round(float(np.mean(identical)), 3) if identical else None,
+        'analysed_at': int(time.time()),
+    }
+
+def _as_float(value):
+    return float(value) if value not in (None, '') else None
+
+def load_sample_stats(path=SAMPLES_CSV):
+    """Load the samples.csv rows, with typed values."""
+    rows = []
+    if not os.path.exists(path):
+        return rows
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        for row in csv.DictReader(file):
+            row['samples'] = int(row['samples'])
+            row['valid_scores'] = int(row['valid_scores'])
+            for column in SAMPLE_STATS:
+                row[column] = _as_float(row[column])
+            rows.append(row)
+    return rows
+
+def save_sample_stats(new_rows, path=SAMPLES_CSV):
+    """Add or replace the samples.csv rows of the analysed (question, model) pairs."""
+    rows = {(row['question'], row['model']): row for row in load_sample_stats(path)}
+    for row in new_rows:
+        rows[(row['question'], row['model'])] = row
+    _write_csv(path, SAMPLE_COLUMNS, sorted(rows.values(), key=lambda row: (row['question'], row['model'])))
+
+def stability(rows):
+    """Aggregate the samples.csv rows per model: the means over the questions.
+
+    The variances are the mean variances between the samples of a question,
+    not the spread of the grades across questions.
+    """
+    models = {}
+    for row in rows:
+        models.setdefault(row['model'], []).append(row)
+    board = []
+    for model, model_rows in sorted(models.items()):
+        entry = {'model': model, 'questions': len(model_rows), 'samples': sum(row['samples'] for row in model_rows)}
+        for column in SAMPLE_STATS:
+            entry[column] = _mean([row[column] for row in model_rows])
+        board.append(entry)
+    return board
+
+def save_stability(board, path=STABILITY_CSV):
+    _write_csv(path, STABILITY_COLUMNS, board)
+
+def load_results(path=RESULTS_CSV):
+    """Load the results rows, with typed values."""
+    rows = []
+    if not os.path.exists(path):
+        return rows
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        for row in csv.DictReader(file):
+            row['valid'] = row['valid'] == 'True'
+            row['couverture_infos_cruciales'] = _as_grade(row['couverture_infos_cruciales']) if row['couverture_infos_cruciales'] else None
+            row['infos_a_eviter_presentes'] = _as_flag(row['infos_a_eviter_presentes']) if row['infos_a_eviter_presentes'] else None
+            row['note_globale'] = _as_grade(row['note_globale']) if row['note_globale'] else None
+            rows.append(row)
+    return rows
+
+def _write_csv(path, columns, rows):
+    """Atomically write rows as CSV."""
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+def save_results(new_rows, path=RESULTS_CSV):
+    """Add or replace the rows of the judged (question, model) pairs."""
+    rows = {(row['question'], row['model']): row for row in load_results(path)}
+    for row in new_rows:
+        rows[(row['question'], row['model'])] = row
+    _write_csv(path, RESULT_COLUMNS, sorted(rows.values(), key=lambda row: (row['question'], row['model'])))
+
+def _bootstrap_interval(values, rng):
+    """Bootstrap confidence interval of the mean of `values`."""
+    if values.size < 2:
+        return (np.nan, np.nan)
+    samples = values[rng.integers(0, values.size, size=(BOOTSTRAP_SAMPLES, values.size))].mean(axis=1)
+    tail = (1 - CONFIDENCE) / 2 * 100
+    return tuple(np.percentile(samples, [tail, 100 - tail]))
+
+def _round(value, digits=2):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+def leaderboard(rows, seed=0):
+    """Rank the models on their mean overall grade, with confidence intervals."""
+    if not rows:
+        return []
+    rng = np.random.default_rng(seed)
+    models, model_index = np.unique([row['model'] for row in rows], return_inverse=True)
+    valid = np.array([row['valid'] for row in rows])
+    grade = np.array([row['note_globale'] if row['valid'] else np.nan for row in rows], dtype=float)
+    coverage = np.array([row['couverture_infos_cruciales'] if row['valid'] else np.nan for row in rows], dtype=float)
+    forbidden = np.array([float(row['infos_a_eviter_presentes']) if row['valid'] else np.nan for row in rows], dtype=float)
+
+    counts = np.bincount(model_index, minlength=len(models))
+    valid_counts = np.bincount(model_index, weights=valid, minlength=len(models))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_grade = np.bincount(model_index, weights=np.nan_to_num(grade), minlength=len(models)) / valid_counts
+        mean_coverage = np.bincount(model_index, weights=np.nan_to_num(coverage), minlength=len(models)) / valid_counts
+        forbidden_rate = np.bincount(model_index, weights=np.nan_to_num(forbidden), minlength=len(models)) / valid_counts
+
+    board = []
+    for i, model in enumerate(models):
+        low, high = _bootstrap_interval(grade[(model_index == i) & valid], rng)
+        board.append({
+            'model': str(model),
+            'questions': int(counts[i]),
+            'valid_scores': int(valid_counts[i]),
+            'note_globale_moyenne': _round(mean_grade[i]),
+            'note_globale_ic_bas': _round(low),
+            'note_globale_ic_haut': _round(high),
+            'couverture_moyenne': _round(mean_coverage[i]),
+            'taux_infos_a_eviter': _round(forbidden_rate[i], 3),
+        })
+    board.sort(key=lambda row: -(row['note_globale_moyenne'] if row['note_globale_moyenne'] is not None else -1))
+    return board
+
+def save_leaderboard(board, path=LEADERBOARD_CSV):
+    _write_csv(path, LEADERBOARD_COLUMNS, board)
+
+def forget_question(question_name):
+    """Drop the results and samples.csv rows of a deleted question, and rank the models again without them."""
+    changed = False
+    for path, columns, load in ((RESULTS_CSV, RESULT_COLUMNS, load_results),
+                                (SAMPLES_CSV, SAMPLE_COLUMNS, load_sample_stats)):
+        rows = load(path)
+        kept = [row for row in rows if row['question'] != question_name]
+        if len(kept) != len(rows):
+            _write_csv(path, columns, kept)
+            changed = True
+    if changed:
+        update_rankings()
+    return changed
+
+def update_rankings():
+    """Rebuild the leaderboard, and the stability table when there are sample statistics, from the saved rows.
+
+    Returns (leaderboard, stability table or None).
+    """
+    board = leaderboard(load_results())
+    save_leaderboard(board)
+    sample_stats = load_sample_stats()
+    if not sample_stats:
+        return board, None
+    table = stability(sample_stats)
+    save_stability(table)
+    return board, table
@@ -0,0 +1,161 @@
+"""Rate-limit aware sending of the requests to the models.
+
+Requests are grouped by provider, with the same name heuristics as the model
+selection page (Anthropic, OpenAI, Google, Perplexity, Mistral, Ollama).
+Each provider has a token bucket limiting its request rate, and a request
+answered with 429 or a 5xx status, or failing to connect, is retried with
+exponential backoff and jitter. A `Retry-After` header is honoured, and a 429
+pauses the whole provider, not only the request that received it.
+
+Limits are set in ./config/config.yaml (no rate limit by default):
+
+    rate_limits:
+      default: {requests_per_minute: 120, burst: 10}
+      OpenAI: {requests_per_minute: 500, burst: 20}
+      Anthropic: {requests_per_minute: 50, burst: 5}
+    retries:
+      max_retries: 5       # per request
+      backoff_base: 1.0    # seconds, doubled at each retry
+      backoff_max: 60      # seconds
+"""
+import time
+import random
+import threading
+import email.utils
+import requests
+import config_store
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Errors without a status that asking again does not fix: a malformed
+# response body (requests' JSONDecodeError is a ValueError) or payload
+NOT_RETRYABLE_ERRORS = (requests.exceptions.HTTPError, requests.exceptions.InvalidJSONError, ValueError)
+DEFAULT_RETRIES = {'max_retries': 5, 'backoff_base': 1.0, 'backoff_max': 60}
+
+_lock = threading.Lock()
+_buckets = {}
+_settings = None
+
+def provider_for(model_name, model_type=None):
+    """Return the provider of a model from its name (and Open WebUI type when known)."""
+    name = model_name.lower()
+    if 'google' in name or 'gemini' in name:
+        return 'Google'
+    if 'anthropic' in name or 'claude' in name:
+        return 'Anthropic'
+    if 'perplexity' in name:
+        return 'Perplexity'
+    if model_type == 'OpenAI' or (model_type is None and (name.startswith(('gpt', 'o1', 'o3', 'o4')) or 'openai' in name)):
+        return 'OpenAI'
+    if model_type == 'Ollama' or (model_type is None and ':' in name):
+        return 'Ollama'
+    if 'mistral' in name or model_type == 'Mistral':
+        return 'Mistral'
+    return 'Autre'
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, with bursts of `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate is None:
+                    return
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every request of the bucket for `seconds`."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+def load_settings():
+    """Load the rate limits and retry policy from the configuration."""
+    config = config_store.config()
+    retries = dict(DEFAULT_RETRIES)
+    retries.update(config.get('retries') or {})
+    return {'rate_limits': config.get('rate_limits') or {}, 'retries': retries}
+
+def _settings_now():
+    global _settings
+    with _lock:
+        if _settings is None:
+            _settings = load_settings()
+        return _settings
+
+def bucket_for(provider):
+    """Return the token bucket of a provider."""
+    rate_limits = _settings_now()['rate_limits']
+    with _lock:
+        if provider not in _buckets:
+            limits = rate_limits.get(provider) or rate_limits.get('default') or {}
+            per_minute = limits.get('requests_per_minute')
+            rate = per_minute / 60.0 if per_minute else None
+            _buckets[provider] = TokenBucket(rate, limits.get('burst', 1))
+        return _buckets[provider]
+
+def retry_after_seconds(response):
+    """Read the Retry-After header of a response, in seconds."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def call_with_retries(model_name, send, verbose=False):
+    """Call `send()` under the rate limit of the model's provider, retrying failures.
+
+    `send` performs one request and raises requests' HTTPError for an error
+    status. Returns `(result, retries)`; when every attempt failed, the last
+    exception is raised with its `retries` attribute set.
+    """
+    retries = _settings_now()['retries']
+    provider = provider_for(model_name)
+    bucket = bucket_for(provider)
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            return send(), attempt
+        except requests.exceptions.RequestException as e:
+            response = getattr(e, 'response', None)
+            status = response.status_code if response is not None else None
+            retryable = status in RETRYABLE_STATUS or (status is None and not isinstance(e, NOT_RETRYABLE_ERRORS))
+            if not retryable or attempt >= retries['max_retries']:
+                e.retries = attempt
+                raise
+            delay = retry_after_seconds(response)
+            if delay is None:
+                # Full jitter: spread the retries of concurrent workers
+                delay = random.uniform(0, min(retries['backoff_max'], retries['backoff_base'] * 2 ** attempt))
+            if status == 429:
+                bucket.pause(delay)
+            attempt += 1
+            if verbose:
+                print("*-*-*-*-*-*-*-*-*")
+                print(f"Request to '{model_name}' ({provider}) failed with {status or e}; retry {attempt}/{retries['max_retries']} in {delay:.1f}s")
+            if status != 429:
+                time.sleep(delay)
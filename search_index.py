@@ -0,0 +1,245 @@
+"""Full-text search over the questions, target data, answers and analyses.
+
+The texts of the storage (see storage) are indexed in a separate SQLite
+database with FTS5, ./search-index.db by default:
+
+- `question`: the content of the question;
+- `reponse_cible`, `infos_cruciales`, `infos_a_eviter`: the target data;
+- `answer`: the answer of each model;
+- `analysis`: the verdict of the analysis model on each answer (the whole
+  report, without model, for analyses made before the analysis records).
+
+The index is maintained incrementally: the storage gives a version of each
+question (modification times of its files, or update times in the
+database), and `sync` only indexes again the questions whose version
+changed. `search` brings the index up to date at most every SYNC_SECONDS,
+so a search costs a version check now and then and an FTS5 query.
+
+Run `python search_index.py "<query>"` to search from the command line, or
+`python search_index.py --rebuild` to build the index again from scratch.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import storage
+import answer_store
+
+DEFAULT_INDEX = './search-index.db'
+SYNC_SECONDS = 5
+DEFAULT_LIMIT = 50
+# Around the matches in the snippets; characters that do not occur in the texts
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+KINDS = ('question', 'reponse_cible', 'infos_cruciales', 'infos_a_eviter', 'answer', 'analysis')
+TARGET_KINDS = ('reponse_cible', 'infos_cruciales', 'infos_a_eviter')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    question TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    model TEXT,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_by_question ON documents (question);
+CREATE INDEX IF NOT EXISTS documents_by_model ON documents (model);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    content,
+    content='documents',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS documents_insert AFTER INSERT ON documents BEGIN
+    INSERT INTO documents_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS documents_delete AFTER DELETE ON documents BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TABLE IF NOT EXISTS indexed (
+    question TEXT PRIMARY KEY,
+    version TEXT NOT NULL
+);
+"""
+
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+def match_expression(query):
+    """Turn a user query into an FTS5 expression.
+
+    Every word must appear; "a few words" between double quotes is a
+    phrase and a trailing * makes a word a prefix. Anything else is taken
+    literally, so a query never fails on the FTS5 syntax.
+    """
+    terms = []
+    for phrase, word in _TERM.findall(query or ''):
+        text = phrase if phrase else word
+        prefix = not phrase and text.endswith('*')
+        text = text.rstrip('*').replace('"', '')
+        if not text.strip():
+            continue
+        terms.append(f'"{text}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+def question_documents(store, nom_question):
+    """Yield the (kind, model, content) documents of one question."""
+    question_content = store.load_question(nom_question)
+    if question_content:
+        yield 'question', None, question_content
+    target_data = store.load_target(nom_question) or {}
+    for kind in TARGET_KINDS:
+        if target_data.get(kind):
+            yield kind, None, target_data[kind]
+    for model_name, answer in store.load_answers(nom_question).items():
+        content = answer_store.answer_text(answer)
+        if content:
+            yield 'answer', model_name, content
+    verdicts = {}
+    for record in store.load_analysis_records(nom_question):
+        if record.get('type') == 'verdict' and record.get('analysis'):
+            # The latest verdict of a model replaces the previous ones
+            verdicts[record['model']] = record['analysis']
+    if verdicts:
+        for model_name, analysis in verdicts.items():
+            yield 'analysis', model_name, analysis
+    else:
+        report = store.load_analysis(nom_question)
+        if report:
+            yield 'analysis', None, report
+
+class SearchIndex:
+    """FTS5 index of the texts of a storage, kept up to date by version."""
+
+    def __init__(self, path=DEFAULT_INDEX, store=None):
+        self.path = path
+        self.store = store
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.synced = None
+
+    def _storage(self):
+        return self.store if self.store is not None else storage.get_storage()
+
+    def _connection(self):
+        """One connection per thread, like SQLiteStorage."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+        return connection
+
+    def sync(self, force=False, verbose=False):
+        """Index again the questions that changed; returns how many were indexed or removed.
+
+        Without `force`, nothing is checked when the last sync is less than
+        SYNC_SECONDS old.
+        """
+        with self.lock:
+            if not force and self.synced is not None and time.monotonic() - self.synced < SYNC_SECONDS:
+                return 0
+            store = self._storage()
+            versions = {name: json.dumps(version) for name, version in store.versions().items()}
+            connection = self._connection()
+            indexed = dict(connection.execute("SELECT question, version FROM indexed").fetchall())
+            changed = [name for name, version in versions.items() if indexed.get(name) != version]
+            removed = [name for name in indexed if name not in versions]
+            with connection:
+                for nom_question in removed:
+                    connection.execute("DELETE FROM documents WHERE question = ?", (nom_question,))
+                    connection.execute("DELETE FROM indexed WHERE question = ?", (nom_question,))
+                for nom_question in changed:
+                    connection.execute("DELETE FROM documents WHERE question = ?", (nom_question,))
+                    connection.executemany(
+                        "INSERT INTO documents (question, kind, model, content) VALUES (?, ?, ?, ?)",
+                        [(nom_question, kind, model, content)
+                         for kind, model, content in question_documents(store, nom_question)],
+                    )
+                    connection.execute(
+                        "INSERT INTO indexed (question, version) VALUES (?, ?) "
+                        "ON CONFLICT (question) DO UPDATE SET version = excluded.version",
+                        (nom_question, versions[nom_question]),
+                    )
+                    if verbose:
+                        print(f"Indexed '{nom_question}'")
+            self.synced = time.monotonic()
+            return len(changed) + len(removed)
+
+    def rebuild(self, verbose=False):
+        """Drop the index and build it again from the storage."""
+        with self.lock:
+            with self._connection() as connection:
+                connection.execute("DELETE FROM documents")
+                connection.execute("DELETE FROM indexed")
+                connection.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+        return self.sync(force=True, verbose=verbose)
+
+    def models(self):
+        """The models having indexed answers or verdicts, sorted."""
+        self.sync()
+        rows = self._connection().execute(
+            "SELECT DISTINCT model FROM documents WHERE model IS NOT NULL ORDER BY model"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def search(self, query, models=None, questions=None, kinds=None, limit=DEFAULT_LIMIT):
+        """Return the documents matching a query, best first.
+
+        `models`, `questions` and `kinds` restrict the results when given;
+        filtering by model leaves only answers and verdicts.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        self.sync()
+        sql = ("SELECT d.question, d.kind, d.model, "
+               "snippet(documents_fts, 0, ?, ?, '…', 16), bm25(documents_fts) "
+               "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+               "WHERE documents_fts MATCH ?")
+        params = [MATCH_START, MATCH_END, expression]
+        for column, values in (('d.model', models), ('d.question', questions), ('d.kind', kinds)):
+            if values:
+                sql += f" AND {column} IN ({', '.join('?' * len(values))})"
+                params.extend(values)
+        sql += " ORDER BY bm25(documents_fts) LIMIT ?"
+        params.append(limit)
+        rows = self._connection().execute(sql, params).fetchall()
+        return [{'question': question, 'kind': kind, 'model': model, 'snippet': snippet, 'score': round(-score, 3)}
+                for question, kind, model, snippet, score in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the questions, target data, answers and analyses.")
+    parser.add_argument('query', nargs='?', help="Words to search; \"a phrase\" between double quotes, word* for a prefix")
+    parser.add_argument('--model', action='append', help="Only the answers and verdicts of this model (repeatable)")
+    parser.add_argument('--kind', action='append', choices=KINDS, help="Only this kind of text (repeatable)")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help=f"Maximum number of results (default {DEFAULT_LIMIT})")
+    parser.add_argument('--index', default=DEFAULT_INDEX, help=f"Index database (default {DEFAULT_INDEX})")
+    parser.add_argument('--rebuild', action='store_true', help="Build the index again from scratch")
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
+    args = parser.parse_args()
+
+    index = SearchIndex(args.index)
+    if args.rebuild:
+        print(f"Indexed {index.rebuild(args.verbose)} questions in {args.index}")
+    else:
+        count = index.sync(force=True, verbose=args.verbose)
+        if args.verbose:
+            print(f"Indexed {count} changed questions in {args.index}")
+    if args.query:
+        for result in index.search(args.query, args.model, None, args.kind, args.limit):
+            model = f" ({result['model']})" if result['model'] else ""
+            snippet = result['snippet'].replace(MATCH_START, '[').replace(MATCH_END, ']')
+            print(f"{result['question']} - {result['kind']}{model}: {snippet}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Sharded runs of app-compare.py and app-anal.py, on one or several machines.
+
+The work is split in units: a (question, model) pair for app-compare.py,
+a question for app-anal.py (all the answers to a question are analysed
+together). Two ways of sharing them between processes, which can be used
+together:
+
+- `--shard i/N`: the process only takes the units whose hash falls in
+  shard i of N. The split is deterministic, so N processes started with
+  1/N ... N/N cover everything exactly once;
+- `--queue`: the units are claimed one by one with lease files in the work
+  directory (created with O_EXCL, so only one process gets each unit). A
+  finished unit is marked done; the lease of a process that died is taken
+  over after LEASE_SECONDS.
+
+Each process writes what would otherwise be shared files in its own
+folder of the work directory (./shards by default, it must be shared
+between the machines): app-compare.py appends its answers to
+`<worker>/answers.jsonl`, and app-anal.py its scores to
+`<worker>/results.csv` and `<worker>/samples.csv` (the analysis of a
+question is only made by one process, so it goes to the usual place).
+`merge` (python app-shards.py merge) then brings everything back into the
+storage and ./analysis, rebuilds the leaderboard and moves each merged
+folder to `merged/`, so that a later merge does not bring its records back
+over newer answers and scores.
+"""
+import os
+import json
+import time
+import socket
+import hashlib
+import argparse
+import threading
+import results_store
+
+DEFAULT_WORK_DIR = './shards'
+LEASE_SECONDS = 1800
+# Folders of the work directory that are not worker folders
+QUEUE_FOLDERS = ('leases', 'done')
+MERGED_FOLDER = 'merged'
+
+def parse_shard(spec):
+    """Parse 'i/N' into (i, N), for argparse."""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{spec}', expected i/N (e.g. 2/4)")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{spec}', i must be between 1 and N")
+    return index, count
+
+def unit_key(nom_question, model_name=None):
+    """The key of a unit of work: a question, or a (question, model) pair."""
+    return nom_question if model_name is None else f"{nom_question}\t{model_name}"
+
+def _digest(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def in_shard(key, shard):
+    """Tell whether a unit belongs to the shard (i, N); everything does without a shard."""
+    if shard is None:
+        return True
+    index, count = shard
+    return int(_digest(key)[:16], 16) % count == index - 1
+
+def worker_id(shard=None):
+    """The name of the output folder of this process."""
+    if shard is not None:
+        return f"shard-{shard[0]}-of-{shard[1]}"
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class WorkQueue:
+    """Units of work claimed with lease files in a shared folder."""
+
+    def __init__(self, folder=DEFAULT_WORK_DIR, worker=None, lease_seconds=LEASE_SECONDS):
+        self.leases = os.path.join(folder, 'leases')
+        self.done_folder = os.path.join(folder, 'done')
+        self.worker = worker or worker_id()
+        self.lease_seconds = lease_seconds
+        os.makedirs(self.leases, exist_ok=True)
+        os.makedirs(self.done_folder, exist_ok=True)
+
+    def _lease_path(self, key):
+        return os.path.join(self.leases, _digest(key) + '.lease')
+
+    def _done_path(self, key):
+        return os.path.join(self.done_folder, _digest(key))
+
+    def is_done(self, key):
+        return os.path.exists(self._done_path(key))
+
+    def _create_lease(self, key):
+        try:
+            fd = os.open(self._lease_path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump({'key': key, 'worker': self.worker, 'claimed_at': time.time()}, file)
+        return True
+
+    def claim(self, key):
+        """Claim a unit; False when it is done or leased by another process."""
+        if self.is_done(key):
+            return False
+        if not self._create_lease(key):
+            path = self._lease_path(key)
+            try:
+                age = time.time() - os.stat(path).st_mtime
+            except FileNotFoundError:
+                age = None
+            if age is not None and age < self.lease_seconds:
+                return False
+            # A stale lease: only the process whose rename succeeds takes it over
+            stale_path = f"{path}.stale-{self.worker}"
+            try:
+                os.rename(path, stale_path)
+            except FileNotFoundError:
+                pass
+            else:
+                if time.time() - os.stat(stale_path).st_mtime < self.lease_seconds:
+                    # Another process took it over in the meantime: give it back
+                    os.rename(stale_path, path)
+                    return False
+                os.remove(stale_path)
+            if not self._create_lease(key):
+                return False
+        # The unit may have been finished between the check and the lease
+        if self.is_done(key):
+            self.release(key)
+            return False
+        return True
+
+    def complete(self, key):
+        """Mark a claimed unit as done and drop its lease."""
+        with open(self._done_path(key), 'w', encoding='utf-8') as file:
+            json.dump({'key': key, 'worker': self.worker, 'done_at': time.time()}, file)
+        self.release(key)
+
+    def release(self, key):
+        """Give a claimed unit back, e.g. after a failure, so that it is tried again."""
+        try:
+            os.remove(self._lease_path(key))
+        except FileNotFoundError:
+            pass
+
+    def status(self):
+        """Return the numbers of units done and currently leased."""
+        done = len(os.listdir(self.done_folder))
+        leased = len([name for name in os.listdir(self.leases) if name.endswith('.lease')])
+        return {'done': done, 'leased': leased}
+
+class ShardOutput:
+    """The output folder of one process: its answers, results and sample statistics."""
+
+    def __init__(self, folder=DEFAULT_WORK_DIR, worker=None):
+        self.folder = os.path.join(folder, worker or worker_id())
+        self.answers_path = os.path.join(self.folder, 'answers.jsonl')
+        self.results_path = os.path.join(self.folder, 'results.csv')
+        self.samples_path = os.path.join(self.folder, 'samples.csv')
+        self.lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def describe(self):
+        return f"shard output {self.folder}"
+
+    # Same methods as the storage for the answers written by app-compare.py
+    def answers_location(self, nom_question):
+        return self.answers_path
+
+    def append_answer(self, nom_question, model_name, answer):
+        line = json.dumps({'question': nom_question, 'model': model_name, 'answer': answer}) + '\n'
+        with self.lock:
+            with open(self.answers_path, 'a', encoding='utf-8') as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def compact(self, nom_question):
+        # Folded into the storage by merge
+        return False
+
+    def answer_records(self):
+        """Yield the (question, model, answer) records of the answers file, oldest first."""
+        if not os.path.exists(self.answers_path):
+            return
+        with open(self.answers_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash during an append
+                    continue
+                yield record['question'], record['model'], record['answer']
+
+    def request_hashes(self):
+        """The request hash of each (question, model) answered in this folder, to resume a run."""
+        return {(question, model): (answer.get('harness') or {}).get('request_hash')
+                for question, model, answer in self.answer_records()}
+
+def _worker_folders(folder):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name not in QUEUE_FOLDERS + (MERGED_FOLDER,) and os.path.isdir(os.path.join(folder, name)))
+
+def merge(store, folder=DEFAULT_WORK_DIR, verbose=False):
+    """Bring the answers and scores of every worker folder into the storage and ./analysis.
+
+    Each merged folder is moved to `merged/<worker>-<date>`: merging again
+    only brings the folders written since, and never overwrites the answers
+    and scores of a later run with older shard records. Merge once every
+    shard is done. Returns the numbers of answers and result rows merged.
+    """
+    counts = {'answers': 0, 'results': 0, 'samples': 0}
+    questions = set()
+    for worker_folder in _worker_folders(folder):
+        output = ShardOutput(folder, os.path.basename(worker_folder))
+        n_answers = 0
+        for nom_question, model_name, answer in output.answer_records():
+            store.append_answer(nom_question, model_name, answer)
+            questions.add(nom_question)
+            n_answers += 1
+        results = results_store.load_results(output.results_path)
+        if results:
+            results_store.save_results(results)
+        samples = results_store.load_sample_stats(output.samples_path)
+        if samples:
+            results_store.save_sample_stats(samples)
+        counts['answers'] += n_answers
+        counts['results'] += len(results)
+        counts['samples'] += len(samples)
+        archive = os.path.join(folder, MERGED_FOLDER, f"{os.path.basename(worker_folder)}-{time.strftime('%Y%m%d-%H%M%S')}")
+        os.makedirs(os.path.dirname(archive), exist_ok=True)
+        os.replace(worker_folder, archive)
+        if verbose:
+            print(f"Merged {n_answers} answers and {len(results)} result rows from {worker_folder}, moved to {archive}")
+    for nom_question in sorted(questions):
+        store.compact(nom_question)
+    if counts['results'] or counts['samples']:
+        results_store.update_rankings()
+    return counts
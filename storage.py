@@ -0,0 +1,527 @@
+"""Storage of the questions, target data, answers and analysis reports.
+
+Two backends offer the same methods:
+
+- `FileStorage`, the usual layout of small files: ./questions/<nom>.q,
+  ./targets/<nom>.t, ./answers/<nom>.a (see answer_store) and
+  ./analysis/<nom>.txt;
+- `SQLiteStorage`, a single SQLite database in WAL mode, where the answers
+  are indexed by question and by model, so that "all the answers of a
+  model" is an index lookup instead of a scan of every answers file.
+
+The backend is chosen in ./config/config.yaml (files by default):
+
+    storage:
+      backend: sqlite
+      path: ./genai-compare.db
+
+`copy` moves everything from one backend to the other; app-storage.py
+runs it from the command line.
+"""
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import config_store
+import answer_store
+import question_index
+import analysis_report
+import results_store
+
+DEFAULT_DATABASE = './genai-compare.db'
+
+class FileStorage:
+    """Questions, targets, answers and analyses as files in the current folder."""
+
+    questions_folder = './questions'
+    targets_folder = './targets'
+    analysis_folder = './analysis'
+
+    def __init__(self):
+        self.index = question_index.QuestionIndex(self.questions_folder, self.targets_folder)
+
+    def describe(self):
+        return f"files in {self.questions_folder}, {self.targets_folder}, {answer_store.ANSWERS_FOLDER} and {self.analysis_folder}"
+
+    def versions(self):
+        """A version of each question with any stored data: the modification
+        times of its files, which change whenever one of them is written."""
+        versions = {}
+        folders = (
+            (self.questions_folder, ('.q',)),
+            (self.targets_folder, ('.t',)),
+            (answer_store.ANSWERS_FOLDER, ('.a', '.a' + answer_store.LOG_SUFFIX)),
+            (self.analysis_folder, ('.txt', '.records.jsonl')),
+        )
+        for folder, suffixes in folders:
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    for suffix in suffixes:
+                        if entry.name.endswith(suffix):
+                            nom_question = entry.name[:-len(suffix)]
+                            versions.setdefault(nom_question, []).append([suffix, entry.stat().st_mtime_ns])
+                            break
+        return {nom_question: sorted(version) for nom_question, version in versions.items()}
+
+    # Questions and targets
+    def _question_path(self, nom_question):
+        return os.path.join(self.questions_folder, f"{nom_question}.q")
+
+    def _target_path(self, nom_question):
+        return os.path.join(self.targets_folder, f"{nom_question}.t")
+
+    def list_questions(self):
+        if not os.path.isdir(self.questions_folder):
+            return []
+        return sorted(f[:-2] for f in os.listdir(self.questions_folder) if f.endswith('.q'))
+
+    def list_targets(self):
+        if not os.path.isdir(self.targets_folder):
+            return []
+        return sorted(f[:-2] for f in os.listdir(self.targets_folder) if f.endswith('.t'))
+
+    def all_questions(self):
+        """Every question with its target data, sorted by name."""
+        return self.index.all()
+
+    def question_page(self, offset=0, limit=50):
+        """Return (total, page) of the questions sorted by name, with their first paragraph only."""
+        entries = self.index.all()
+        page = [{'nom_question': entry['nom_question'], 'first_paragraph': entry['first_paragraph']}
+                for entry in entries[offset:offset + limit]]
+        return len(entries), page
+
+    def load_question(self, nom_question):
+        path = self._question_path(nom_question)
+        if os.path.exists(path):
+            with open(path, 'r', encoding="utf-8") as file:
+                return file.read()
+        return None
+
+    def save_question(self, nom_question, question_content):
+        os.makedirs(self.questions_folder, exist_ok=True)
+        with open(self._question_path(nom_question), 'w', encoding="utf-8") as file:
+            file.write(question_content)
+        self.index.update(nom_question)
+
+    def save_questions(self, questions):
+        """Save (nom_question, question_content, target_data) tuples, e.g. a batch of a bulk import."""
+        for nom_question, question_content, target_data in questions:
+            self.save_question(nom_question, question_content)
+            self.save_target(nom_question, target_data)
+
+    def load_target(self, nom_question):
+        path = self._target_path(nom_question)
+        if os.path.exists(path):
+            with open(path, 'r', encoding="utf-8") as file:
+                return json.load(file)
+        return None
+
+    def save_target(self, nom_question, target_data):
+        os.makedirs(self.targets_folder, exist_ok=True)
+        with open(self._target_path(nom_question), 'w', encoding="utf-8") as file:
+            json.dump(target_data, file, indent=4)
+        self.index.update(nom_question)
+
+    def delete_question(self, nom_question):
+        """Delete a question with its target data, answers and analysis (records, report, renderings and scores)."""
+        for path in (self._question_path(nom_question), self._target_path(nom_question),
+                     self.analysis_location(nom_question), self._records_path(nom_question)):
+            if os.path.exists(path):
+                os.remove(path)
+        answer_store.delete_answers(nom_question)
+        self.index.remove(nom_question)
+        delete_analysis_outputs(nom_question)
+
+    # Answers
+    def answers_location(self, nom_question):
+        return answer_store.answer_path(nom_question)
+
+    def has_answers(self, nom_question):
+        return answer_store.has_answers(nom_question)
+
+    def list_answered_questions(self):
+        return answer_store.list_answered_questions()
+
+    def load_answers(self, nom_question):
+        return answer_store.load_answers(nom_question)
+
+    def append_answer(self, nom_question, model_name, answer):
+        answer_store.append_answer(nom_question, model_name, answer)
+
+    def write_answers(self, nom_question, answers):
+        # Drops the log too, it would otherwise be applied over the new answers
+        answer_store.write_answers(nom_question, answers)
+
+    def compact(self, nom_question):
+        return answer_store.compact(nom_question)
+
+    def answers_by_model(self, model_name):
+        """All the answers of one model, by question."""
+        answers = {}
+        for nom_question in self.list_answered_questions():
+            answer = self.load_answers(nom_question).get(model_name)
+            if answer is not None:
+                answers[nom_question] = answer
+        return answers
+
+    # Analysis reports
+    def analysis_location(self, nom_question):
+        return os.path.join(self.analysis_folder, f"{nom_question}.txt")
+
+    def list_analyses(self):
+        if not os.path.isdir(self.analysis_folder):
+            return []
+        return sorted(f[:-4] for f in os.listdir(self.analysis_folder) if f.endswith('.txt'))
+
+    def load_analysis(self, nom_question):
+        path = self.analysis_location(nom_question)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                return file.read()
+        return None
+
+    def save_analysis(self, nom_question, report):
+        # Written again after each verdict: replace it atomically
+        os.makedirs(self.analysis_folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.analysis_folder, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(report)
+        os.replace(tmp_path, self.analysis_location(nom_question))
+
+    # Analysis records (see analysis_report)
+    def _records_path(self, nom_question):
+        return os.path.join(self.analysis_folder, f"{nom_question}.records.jsonl")
+
+    def load_analysis_records(self, nom_question):
+        records = []
+        path = self._records_path(nom_question)
+        if not os.path.exists(path):
+            return records
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash during an append
+                    continue
+        return records
+
+    def append_analysis_record(self, nom_question, record):
+        os.makedirs(self.analysis_folder, exist_ok=True)
+        with open(self._records_path(nom_question), 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def write_analysis_records(self, nom_question, records):
+        """Atomically replace the records of an analysis."""
+        os.makedirs(self.analysis_folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.analysis_folder, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self._records_path(nom_question))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    name TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS targets (
+    question TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS answers (
+    question TEXT NOT NULL,
+    model TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (question, model)
+);
+CREATE INDEX IF NOT EXISTS answers_by_model ON answers (model, question);
+CREATE TABLE IF NOT EXISTS analyses (
+    question TEXT PRIMARY KEY,
+    report TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analysis_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analysis_records_by_question ON analysis_records (question, id);
+"""
+
+class SQLiteStorage:
+    """Questions, targets, answers and analyses in one SQLite database."""
+
+    def __init__(self, path=DEFAULT_DATABASE, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def describe(self):
+        return f"SQLite database {self.path}"
+
+    def _connection(self):
+        """One connection per thread; the workers and Flask threads each get theirs."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            # WAL lets the web interface read while a script is writing
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def _query(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def _write(self, sql, params=()):
+        with self._connection() as connection:
+            connection.execute(sql, params)
+
+    def versions(self):
+        """A version of each question with any stored data: the latest update
+        times of its rows (and the last analysis record)."""
+        rows = self._query(
+            "SELECT question, max(updated), count(*), 'q' FROM ("
+            " SELECT name AS question, updated FROM questions"
+            " UNION ALL SELECT question, updated FROM targets"
+            " UNION ALL SELECT question, updated FROM answers"
+            " UNION ALL SELECT question, updated FROM analyses"
+            ") GROUP BY question"
+            " UNION ALL SELECT question, max(id), count(*), 'r' FROM analysis_records GROUP BY question"
+        )
+        versions = {}
+        for nom_question, latest, count, source in rows:
+            versions.setdefault(nom_question, []).append([source, latest, count])
+        return {nom_question: sorted(version) for nom_question, version in versions.items()}
+
+    # Questions and targets
+    def list_questions(self):
+        return [row[0] for row in self._query("SELECT name FROM questions ORDER BY name")]
+
+    def list_targets(self):
+        return [row[0] for row in self._query("SELECT question FROM targets ORDER BY question")]
+
+    def all_questions(self):
+        """Every question with its target data, sorted by name."""
+        rows = self._query(
+            "SELECT q.name, q.content, t.data FROM questions q LEFT JOIN targets t ON t.question = q.name"
+        )
+        entries = [{
+            'nom_question': name,
+            'question_content': content,
+            'target_data': json.loads(data) if data is not None else None,
+            'first_paragraph': content.split('\n')[0] if content else '',
+        } for name, content, data in rows]
+        entries.sort(key=lambda x: x['nom_question'].lower())
+        return entries
+
+    def question_page(self, offset=0, limit=50):
+        """Return (total, page) of the questions sorted by name, with their first paragraph only."""
+        total = self._query("SELECT count(*) FROM questions")[0][0]
+        rows = self._query(
+            "SELECT name, substr(content, 1, 2000) FROM questions ORDER BY lower(name), name LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        page = [{'nom_question': name, 'first_paragraph': content.split('\n')[0] if content else ''}
+                for name, content in rows]
+        return total, page
+
+    def load_question(self, nom_question):
+        rows = self._query("SELECT content FROM questions WHERE name = ?", (nom_question,))
+        return rows[0][0] if rows else None
+
+    def save_question(self, nom_question, question_content):
+        self._write(
+            "INSERT INTO questions (name, content, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET content = excluded.content, updated = excluded.updated",
+            (nom_question, question_content, time.time()),
+        )
+
+    def save_questions(self, questions):
+        """Save (nom_question, question_content, target_data) tuples in one transaction."""
+        now = time.time()
+        questions = list(questions)
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT INTO questions (name, content, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET content = excluded.content, updated = excluded.updated",
+                [(nom_question, question_content, now) for nom_question, question_content, _ in questions],
+            )
+            connection.executemany(
+                "INSERT INTO targets (question, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (question) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                [(nom_question, json.dumps(target_data, ensure_ascii=False), now)
+                 for nom_question, _, target_data in questions],
+            )
+
+    def load_target(self, nom_question):
+        rows = self._query("SELECT data FROM targets WHERE question = ?", (nom_question,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_target(self, nom_question, target_data):
+        self._write(
+            "INSERT INTO targets (question, data, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (question) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (nom_question, json.dumps(target_data, ensure_ascii=False), time.time()),
+        )
+
+    def delete_question(self, nom_question):
+        """Delete a question with its target data, answers and analysis (its rows in one transaction, then its renderings and scores)."""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM questions WHERE name = ?", (nom_question,))
+            connection.execute("DELETE FROM targets WHERE question = ?", (nom_question,))
+            connection.execute("DELETE FROM answers WHERE question = ?", (nom_question,))
+            connection.execute("DELETE FROM analyses WHERE question = ?", (nom_question,))
+            connection.execute("DELETE FROM analysis_records WHERE question = ?", (nom_question,))
+        delete_analysis_outputs(nom_question)
+
+    # Answers
+    def answers_location(self, nom_question):
+        return f"{self.path} ({nom_question})"
+
+    def has_answers(self, nom_question):
+        return bool(self._query("SELECT 1 FROM answers WHERE question = ? LIMIT 1", (nom_question,)))
+
+    def list_answered_questions(self):
+        return [row[0] for row in self._query("SELECT DISTINCT question FROM answers ORDER BY question")]
+
+    def load_answers(self, nom_question):
+        # rowid order is the order in which the models first answered, like the keys of an .a file
+        rows = self._query("SELECT model, data FROM answers WHERE question = ? ORDER BY rowid", (nom_question,))
+        return {model: json.loads(data) for model, data in rows}
+
+    def append_answer(self, nom_question, model_name, answer):
+        self._write(
+            "INSERT INTO answers (question, model, data, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (question, model) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (nom_question, model_name, json.dumps(answer), time.time()),
+        )
+
+    def write_answers(self, nom_question, answers):
+        """Replace all the answers to a question in one transaction."""
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute("DELETE FROM answers WHERE question = ?", (nom_question,))
+            connection.executemany(
+                "INSERT INTO answers (question, model, data, updated) VALUES (?, ?, ?, ?)",
+                [(nom_question, model_name, json.dumps(answer), now) for model_name, answer in answers.items()],
+            )
+
+    def compact(self, nom_question):
+        # Every answer is already in place
+        return False
+
+    def answers_by_model(self, model_name):
+        """All the answers of one model, by question."""
+        rows = self._query("SELECT question, data FROM answers WHERE model = ? ORDER BY question", (model_name,))
+        return {question: json.loads(data) for question, data in rows}
+
+    # Analysis reports
+    def analysis_location(self, nom_question):
+        return f"{self.path} ({nom_question})"
+
+    def list_analyses(self):
+        return [row[0] for row in self._query("SELECT question FROM analyses ORDER BY question")]
+
+    def load_analysis(self, nom_question):
+        rows = self._query("SELECT report FROM analyses WHERE question = ?", (nom_question,))
+        return rows[0][0] if rows else None
+
+    def save_analysis(self, nom_question, report):
+        self._write(
+            "INSERT INTO analyses (question, report, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (question) DO UPDATE SET report = excluded.report, updated = excluded.updated",
+            (nom_question, report, time.time()),
+        )
+
+    # Analysis records (see analysis_report)
+    def load_analysis_records(self, nom_question):
+        rows = self._query("SELECT data FROM analysis_records WHERE question = ? ORDER BY id", (nom_question,))
+        return [json.loads(data) for data, in rows]
+
+    def append_analysis_record(self, nom_question, record):
+        self._write("INSERT INTO analysis_records (question, data) VALUES (?, ?)",
+                    (nom_question, json.dumps(record, ensure_ascii=False)))
+
+    def write_analysis_records(self, nom_question, records):
+        """Replace the records of an analysis in one transaction."""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM analysis_records WHERE question = ?", (nom_question,))
+            connection.executemany("INSERT INTO analysis_records (question, data) VALUES (?, ?)",
+                                   [(nom_question, json.dumps(record, ensure_ascii=False)) for record in records])
+
+def delete_analysis_outputs(nom_question):
+    """Delete what the analysis of a question wrote outside the storage, whatever the backend:
+    its JSON and HTML renderings and its rows of results.csv and samples.csv."""
+    analysis_report.delete_renderings(nom_question)
+    results_store.forget_question(nom_question)
+
+def valid_question_name(nom_question):
+    """The rule of the web interface: a question name is a single word."""
+    return bool(nom_question) and ' ' not in nom_question
+
+def load_settings():
+    """Load the storage section of the configuration."""
+    return config_store.config().get('storage') or {}
+
+def open_storage(backend='files', path=None):
+    """Open a storage backend by name."""
+    if backend == 'sqlite':
+        return SQLiteStorage(path or DEFAULT_DATABASE)
+    if backend == 'files':
+        return FileStorage()
+    raise ValueError(f"Unknown storage backend '{backend}' (expected 'files' or 'sqlite')")
+
+_lock = threading.Lock()
+_storage = None
+
+def get_storage():
+    """Return the storage configured in ./config/config.yaml."""
+    global _storage
+    with _lock:
+        if _storage is None:
+            settings = load_settings()
+            _storage = open_storage(settings.get('backend', 'files'), settings.get('path'))
+        return _storage
+
+def copy(source, destination, verbose=False):
+    """Copy every question, target, answer and analysis from one storage to another.
+
+    Returns the number of items copied of each kind.
+    """
+    counts = {'questions': 0, 'targets': 0, 'answers': 0, 'analyses': 0}
+    for nom_question in source.list_questions():
+        destination.save_question(nom_question, source.load_question(nom_question))
+        counts['questions'] += 1
+    for nom_question in source.list_targets():
+        destination.save_target(nom_question, source.load_target(nom_question))
+        counts['targets'] += 1
+    for nom_question in source.list_answered_questions():
+        answers = source.load_answers(nom_question)
+        destination.write_answers(nom_question, answers)
+        counts['answers'] += len(answers)
+        if verbose:
+            print(f"Copied {len(answers)} answers to '{nom_question}'")
+    for nom_question in source.list_analyses():
+        destination.save_analysis(nom_question, source.load_analysis(nom_question))
+        destination.write_analysis_records(nom_question, source.load_analysis_records(nom_question))
+        counts['analyses'] += 1
+    return counts